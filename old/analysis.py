@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+SB Notes Analysis
+Map-reduce note analysis: long transcriptions are split on page boundaries,
+each chunk is analyzed concurrently, and the partial analyses are merged
+into the usual summary/key_topics/important_concepts/... schema. Raw chunk
+responses are cached by content so re-analyzing an edited note only pays
+for the chunks that changed.
+"""
+
+import hashlib
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from metrics import span
+from model_gateway import ModelGateway, build_analysis_request, cacheable_system
+from ocr_cache import TranscriptionCache
+
+# Matches the old single-call cutoff, so short notes still take exactly one call
+CHUNK_CHARS = 8000
+MAX_CONCURRENT_CHUNKS = 4
+
+ANALYSIS_KEYS = (
+    "summary",
+    "key_topics",
+    "important_concepts",
+    "difficulty_level",
+    "estimated_study_time",
+    "related_topics",
+    "transcription_quality"
+)
+LIST_KEYS = ("key_topics", "important_concepts", "related_topics")
+DIFFICULTY_ORDER = ("Beginner", "Intermediate", "Advanced")
+# Models the terminal and web apps have analyzed notes with; used for cache-only recovery
+KNOWN_ANALYSIS_MODELS = ("claude-opus-4-1-20250805", "claude-sonnet-4-20250514")
+
+PAGE_HEADING_RE = re.compile(r"(?m)^(?=## Page \d+)")
+# Typical length of a transcribed page; sets how many pages share a chunk
+PAGE_CHARS = 2000
+
+
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+
+# Placeholder values written by the old fallback; notes carrying them need recovery
+FALLBACK_TOPICS = ["Extracted from AI analysis"]
+# transcription_quality of the "AI analysis failed" placeholder older versions stored
+FAILED_QUALITY = "Failed"
+
+
+def _balanced_object(text: str, start: int) -> Optional[str]:
+    """The {...} starting at text[start], matched with awareness of strings, or None if unclosed."""
+    depth, in_string, escaped = 0, False, False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+
+def _close_truncated(text: str) -> str:
+    """Close an object cut off mid-stream: finish the open string and brackets, drop a dangling key."""
+    stack, in_string, escaped = [], False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+
+    repaired = text[:-1] if escaped else text
+    if in_string:
+        repaired += '"'
+    repaired = repaired.rstrip().rstrip(",")
+    # A key with no value ("key" or "key":) can't be completed; drop it
+    if stack and stack[-1] == "}":
+        repaired = re.sub(r'([{,])\s*"[^"]*"\s*:?\s*$', r"\1", repaired)
+    return repaired.rstrip().rstrip(",") + "".join(reversed(stack))
+
+
+def _loads_lenient(candidate: str) -> Optional[Dict]:
+    """json.loads after fixing common model slips: smart quotes, trailing commas, Python literals."""
+    attempts = [candidate]
+    fixed = TRAILING_COMMA_RE.sub(r"\1", candidate.translate(SMART_QUOTES))
+    fixed = re.sub(r"\b(True|False|None)\b", lambda m: PYTHON_LITERALS[m.group(1)], fixed)
+    attempts.append(fixed)
+    for attempt in attempts:
+        try:
+            value = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def extract_analysis_json(response_text: str, allow_truncated: bool = False) -> Optional[Dict]:
+    """Find the JSON object in a model response, tolerating preamble, fences and small syntax slips.
+
+    With allow_truncated, an object cut off before its closing brace is
+    closed and parsed too (used when recovering clipped stored responses).
+    Returns None if no object can be recovered.
+    """
+    text = response_text.strip()
+    candidates = [text]
+    candidates.extend(match.group(1).strip() for match in FENCE_RE.finditer(text))
+    for start in (index for index, char in enumerate(text) if char == "{"):
+        balanced = _balanced_object(text, start)
+        if balanced is not None:
+            candidates.append(balanced)
+        elif allow_truncated:
+            candidates.append(_close_truncated(text[start:]))
+            break
+
+    for candidate in candidates:
+        parsed = _loads_lenient(candidate)
+        if parsed is not None:
+            return parsed
+    return None
+
+
+def _as_text(value) -> str:
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return "" if value is None else str(value)
+
+
+def _as_list(value) -> List[str]:
+    if isinstance(value, list):
+        return [_as_text(item) for item in value if _as_text(item)]
+    if isinstance(value, dict):
+        return [f"{key}: {_as_text(item)}" for key, item in value.items()]
+    text = _as_text(value)
+    return [part.strip() for part in re.split(r"[;\n]|,\s+", text) if part.strip()] if text else []
+
+
+def validate_analysis(parsed: Dict) -> Optional[Dict]:
+    """Coerce a parsed response into the analysis schema, or None if it isn't an analysis at all."""
+    # Some responses wrap the object, e.g. {"analysis": {...}}
+    if not any(key in parsed for key in ANALYSIS_KEYS) and len(parsed) == 1:
+        inner = next(iter(parsed.values()))
+        if isinstance(inner, dict):
+            parsed = inner
+    if not any(key in parsed for key in ANALYSIS_KEYS):
+        return None
+
+    analysis = {}
+    for key in ANALYSIS_KEYS:
+        if key in LIST_KEYS:
+            analysis[key] = _as_list(parsed.get(key))
+        else:
+            analysis[key] = _as_text(parsed.get(key)) or "Unknown"
+
+    level = analysis["difficulty_level"].lower()
+    for name in DIFFICULTY_ORDER:
+        if name.lower() in level:
+            analysis["difficulty_level"] = name
+            break
+    return analysis
+
+
+def parse_analysis_response(response_text: str) -> Dict:
+    """Parse the model's JSON analysis, falling back to a placeholder structure."""
+    parsed = extract_analysis_json(response_text)
+    analysis = validate_analysis(parsed) if parsed is not None else None
+    if analysis is None:
+        # Keep the whole raw response so the note can be recovered later without another call
+        return {
+            "summary": response_text[:200] + "...",
+            "key_topics": list(FALLBACK_TOPICS),
+            "important_concepts": ["See full analysis"],
+            "difficulty_level": "Unknown",
+            "estimated_study_time": "Unknown",
+            "related_topics": [],
+            "transcription_quality": "Unknown",
+            "raw_response": response_text
+        }
+    return analysis
+
+
+def is_valid_response(response_text: str) -> bool:
+    """Whether a response parses into an analysis; only these are worth caching."""
+    parsed = extract_analysis_json(response_text)
+    return parsed is not None and validate_analysis(parsed) is not None
+
+
+def needs_recovery(analysis: Dict) -> bool:
+    """Whether a stored analysis is the unparsed-response placeholder, or the one older
+    versions saved when the model couldn't be reached."""
+    return (analysis.get("key_topics") == FALLBACK_TOPICS or "raw_response" in analysis
+            or analysis.get("transcription_quality") == FAILED_QUALITY)
+
+
+def recover_analysis(analysis: Dict) -> Optional[Dict]:
+    """Re-parse a placeholder analysis locally from its raw response, or from the clipped summary."""
+    raw = analysis.get("raw_response")
+    if raw:
+        parsed = extract_analysis_json(raw, allow_truncated=True)
+    else:
+        summary = str(analysis.get("summary", ""))
+        # The old fallback kept the first 200 characters followed by "..."
+        parsed = extract_analysis_json(summary[:-3] if summary.endswith("...") else summary, allow_truncated=True)
+        if parsed is not None and parsed.get("summary") and summary.endswith("..."):
+            parsed["summary"] = f"{parsed['summary']}..."
+    return validate_analysis(parsed) if parsed is not None else None
+
+
+def _split_paragraphs(section: str, chunk_chars: int) -> List[str]:
+    """Cut text longer than chunk_chars at paragraph breaks (or hard, if there are none)."""
+    pieces = []
+    while len(section) > chunk_chars:
+        cut = section.rfind("\n\n", 0, chunk_chars)
+        if cut <= 0:
+            cut = chunk_chars
+        pieces.append(section[:cut])
+        section = section[cut:]
+    pieces.append(section)
+    return pieces
+
+
+def split_for_analysis(text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """Split text into chunks of at most chunk_chars on '## Page N' boundaries.
+
+    Pages are grouped a fixed number at a time (chunk_chars // PAGE_CHARS), so
+    editing a page only changes the chunk that holds it and the other chunks
+    still hit the cache; adding or removing pages shifts the groups after it.
+    A group longer than chunk_chars, or text without page headings, is cut at
+    paragraph breaks.
+    """
+    if len(text) <= chunk_chars:
+        return [text]
+
+    sections = [section for section in PAGE_HEADING_RE.split(text) if section.strip()]
+    pages_per_chunk = max(1, chunk_chars // PAGE_CHARS)
+    chunks: List[str] = []
+    for start in range(0, len(sections), pages_per_chunk):
+        chunks.extend(_split_paragraphs("".join(sections[start:start + pages_per_chunk]), chunk_chars))
+    return chunks
+
+
+MERGE_INSTRUCTIONS = """You will be given JSON analyses of consecutive parts of the same document of class notes.
+Merge them into a single analysis of the whole document.
+
+Respond with a single JSON object and nothing else, with these keys:
+- summary (2-3 sentences covering the whole document)
+- key_topics
+- important_concepts
+- difficulty_level (Beginner/Intermediate/Advanced)
+- estimated_study_time (for the whole document)
+- related_topics
+- transcription_quality"""
+
+
+def build_merge_prompt(partials: List[Dict], note_type: str, class_name: str) -> str:
+    """Variable part of the merge request: the partial analyses to reduce."""
+    return f"""Partial analyses of a {note_type} for {class_name}:
+{json.dumps(partials, indent=2)}"""
+
+
+def build_merge_request(partials: List[Dict], note_type: str, class_name: str, model: str,
+                        max_tokens: int = 1000) -> Dict:
+    """Keyword arguments for the reduce call: cached merge instructions first, partials last."""
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": cacheable_system(MERGE_INSTRUCTIONS),
+        "messages": [{"role": "user", "content": build_merge_prompt(partials, note_type, class_name)}]
+    }
+
+
+def merge_partial_analyses(partials: List[Dict]) -> Dict:
+    """Local reduce used when the merge call fails: concatenate and de-duplicate fields."""
+    merged: Dict = {key: [] for key in LIST_KEYS}
+    for partial in partials:
+        for key in LIST_KEYS:
+            for item in partial.get(key, []) or []:
+                if item not in merged[key]:
+                    merged[key].append(item)
+
+    merged["summary"] = " ".join(str(p.get("summary", "")).strip() for p in partials).strip()
+    levels = [p.get("difficulty_level") for p in partials if p.get("difficulty_level") in DIFFICULTY_ORDER]
+    merged["difficulty_level"] = max(levels, key=DIFFICULTY_ORDER.index) if levels else "Unknown"
+    merged["estimated_study_time"] = "; ".join(
+        str(p["estimated_study_time"]) for p in partials if p.get("estimated_study_time")
+    ) or "Unknown"
+    merged["transcription_quality"] = partials[0].get("transcription_quality", "Unknown") if partials else "Unknown"
+    return merged
+
+
+def _cache_key(kind: str, request: Dict) -> str:
+    """Response cache key covering everything the model sees (instructions and content)."""
+    content = json.dumps([request["system"][0]["text"], request["messages"]], sort_keys=True)
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return TranscriptionCache.make_key(digest, request["model"], kind)
+
+
+def _chunk_requests(text: str, note_type: str, class_name: str, model: str,
+                    chunk_chars: int, max_tokens: int) -> List[Dict]:
+    """Map-step requests for a transcription, one per chunk.
+
+    Parts are not told the chunk count, so appending pages leaves the earlier
+    chunks' requests (and cache keys) unchanged.
+    """
+    chunks = split_for_analysis(text, chunk_chars)
+    return [
+        build_analysis_request(chunk, note_type, class_name, model, max_tokens)
+        if len(chunks) == 1 else
+        build_analysis_request(chunk, f"part {i} of a {note_type}", class_name, model, max_tokens)
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+def pending_requests(text: str, note_type: str, class_name: str, model: str, cache: TranscriptionCache,
+                     chunk_chars: int = CHUNK_CHARS, max_tokens: int = 1000) -> List[Tuple[str, Dict]]:
+    """(cache_key, request) pairs still needed before analyze_text can finish from the cache alone.
+
+    Returns the uncached map requests first; once those are all cached, the
+    merge request (for multi-chunk notes). Empty when the analysis is complete.
+    Used by batch re-analysis, which fills the cache in rounds.
+    """
+    requests = _chunk_requests(text, note_type, class_name, model, chunk_chars, max_tokens)
+    missing = [(_cache_key("analysis", request), request) for request in requests]
+    missing = [(key, request) for key, request in missing if cache.get(key) is None]
+    if missing or len(requests) == 1:
+        return missing
+
+    partials = [parse_analysis_response(cache.get(_cache_key("analysis", request))) for request in requests]
+    merge_request = build_merge_request(partials, note_type, class_name, model, max_tokens)
+    merge_key = _cache_key("merge", merge_request)
+    return [] if cache.get(merge_key) is not None else [(merge_key, merge_request)]
+
+
+def analyze_text(gateway: Optional[ModelGateway], text: str, note_type: str, class_name: str, model: str,
+                 cache: Optional[TranscriptionCache] = None, chunk_chars: int = CHUNK_CHARS,
+                 max_concurrency: int = MAX_CONCURRENT_CHUNKS, max_tokens: int = 1000) -> Optional[Dict]:
+    """Analyze a full transcription, map-reducing over chunks when it is long.
+
+    Raises if the model cannot be reached for a chunk; callers keep their own
+    failure placeholder. With gateway=None only cached responses are used and
+    None is returned if any chunk is missing from the cache.
+    """
+    requests = _chunk_requests(text, note_type, class_name, model, chunk_chars, max_tokens)
+
+    # Map: reuse cached raw responses, send the rest concurrently
+    responses: List[Optional[str]] = []
+    missing = []
+    for i, request in enumerate(requests):
+        cached = cache.get(_cache_key("analysis", request)) if cache is not None else None
+        responses.append(cached)
+        if cached is None:
+            missing.append(i)
+
+    if missing and gateway is None:
+        return None
+    if missing:
+        pending = [requests[i] for i in missing]
+        with span("analyze_map", chunks=len(pending)):
+            messages = gateway.create_many(pending, max_concurrency=max_concurrency)
+        for i, message in zip(missing, messages):
+            if isinstance(message, Exception):
+                raise message
+            responses[i] = message.content[0].text
+            # A garbled or truncated reply is used once but not cached, so the next run retries it
+            if cache is not None and is_valid_response(responses[i]):
+                cache.put(_cache_key("analysis", requests[i]), responses[i])
+
+    partials = [parse_analysis_response(response) for response in responses]
+    if len(partials) == 1:
+        return partials[0]
+
+    # Reduce: ask the model to merge, keyed on the partial results so unchanged notes skip it too
+    merge_request = build_merge_request(partials, note_type, class_name, model, max_tokens)
+    merge_key = _cache_key("merge", merge_request)
+    merged_text = cache.get(merge_key) if cache is not None else None
+    if merged_text is None and gateway is None:
+        return merge_partial_analyses(partials)
+    if merged_text is None:
+        try:
+            with span("analyze_merge", partials=len(partials)):
+                message = gateway.create(**merge_request)
+            merged_text = message.content[0].text
+            if cache is not None and is_valid_response(merged_text):
+                cache.put(merge_key, merged_text)
+        except Exception:
+            return merge_partial_analyses(partials)
+
+    parsed = extract_analysis_json(merged_text)
+    merged = validate_analysis(parsed) if parsed is not None else None
+    if merged is None:
+        return merge_partial_analyses(partials)
+    # validate_analysis turns keys the merge response left out into "Unknown" or [];
+    # take those from the local reduce instead
+    local = merge_partial_analyses(partials)
+    return {key: local[key] if value in ("Unknown", []) and key in local else value
+            for key, value in merged.items()}
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+SB Notes Batch Re-analysis
+Re-analyzes many notes through the Message Batches API instead of one
+messages.create call per chunk. Batch results are written into the analysis
+cache, so a round of map requests is followed (for long notes) by a round of
+merge requests, and the final analyses are assembled locally with
+analyze_text(gateway=None). Submitted batches are recorded in SQLite, so an
+interrupted run resumes by polling the same batch ids instead of paying for
+the work again.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from analysis import analyze_text, is_valid_response, pending_requests
+from ocr_cache import TranscriptionCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    request_count INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batch_items (
+    batch_id TEXT NOT NULL,
+    custom_id TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    PRIMARY KEY (batch_id, custom_id)
+);
+"""
+
+SUBMITTED, COLLECTED = "submitted", "collected"
+# Well under the API's per-batch limits (100,000 requests / 256 MB)
+MAX_BATCH_REQUESTS = 5000
+POLL_INTERVAL = 30.0
+MAX_ROUNDS = 3
+
+
+class BatchLog:
+    """Local record of submitted batches and which cache key each request fills."""
+
+    def __init__(self, db_path: Path = Path("data/batches.db")):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def record(self, batch_id: str, items: Dict[str, str]):
+        """Remember a submitted batch; items maps custom_id to cache key."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO batches (id, status, request_count, created_at) VALUES (?, ?, ?, ?)",
+                (batch_id, SUBMITTED, len(items), time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO batch_items (batch_id, custom_id, cache_key) VALUES (?, ?, ?)",
+                [(batch_id, custom_id, key) for custom_id, key in items.items()]
+            )
+
+    def items(self, batch_id: str) -> Dict[str, str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT custom_id, cache_key FROM batch_items WHERE batch_id = ?", (batch_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def mark_collected(self, batch_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE batches SET status = ? WHERE id = ?", (COLLECTED, batch_id))
+
+    def unfinished(self) -> List[str]:
+        """Batches submitted but not yet collected, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM batches WHERE status = ? ORDER BY created_at", (SUBMITTED,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class BatchReanalyzer:
+    """Drives map/merge rounds of Message Batches and assembles analyses from the cache."""
+
+    def __init__(self, client, cache: TranscriptionCache, log: BatchLog,
+                 poll_interval: float = POLL_INTERVAL,
+                 on_status: Optional[Callable[[str], None]] = None):
+        # client is a synchronous anthropic.Anthropic; batch calls are few and long-lived
+        self.client = client
+        self.cache = cache
+        self.log = log
+        self.poll_interval = poll_interval
+        self.on_status = on_status or (lambda message: None)
+
+    def submit(self, requests: List[Tuple[str, Dict]]) -> List[str]:
+        """Submit (cache_key, request) pairs in as many batches as needed; returns the batch ids."""
+        batch_ids = []
+        for start in range(0, len(requests), MAX_BATCH_REQUESTS):
+            chunk = requests[start:start + MAX_BATCH_REQUESTS]
+            # custom_id must be short and alphanumeric, so map it back to the cache key locally
+            items = {f"r{start + i}": key for i, (key, _) in enumerate(chunk)}
+            batch = self.client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": request}
+                for custom_id, (_, request) in zip(items, chunk)
+            ])
+            self.log.record(batch.id, items)
+            self.on_status(f"Submitted batch {batch.id} with {len(chunk)} requests")
+            batch_ids.append(batch.id)
+        return batch_ids
+
+    def collect(self, batch_id: str) -> Tuple[int, int]:
+        """Wait for a batch to end and cache its successful responses. Returns (succeeded, failed)."""
+        items = self.log.items(batch_id)
+        if not items:
+            raise ValueError(f"Batch {batch_id} was not submitted from this library")
+
+        while True:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                break
+            counts = batch.request_counts
+            self.on_status(f"Batch {batch_id}: {counts.succeeded + counts.errored} of {len(items)} done, waiting...")
+            time.sleep(self.poll_interval)
+
+        succeeded = failed = 0
+        for entry in self.client.messages.batches.results(batch_id):
+            key = items.get(entry.custom_id)
+            text = entry.result.message.content[0].text if entry.result.type == "succeeded" else None
+            # Unparseable replies are not cached, so the next round asks again (as analyze_text does)
+            if key is not None and text is not None and is_valid_response(text):
+                self.cache.put(key, text)
+                succeeded += 1
+            else:
+                failed += 1
+        self.log.mark_collected(batch_id)
+        self.on_status(f"Batch {batch_id}: {succeeded} succeeded, {failed} failed")
+        return succeeded, failed
+
+    def resume(self) -> int:
+        """Collect any batches left unfinished by an earlier run. Returns how many were collected."""
+        batch_ids = self.log.unfinished()
+        for batch_id in batch_ids:
+            self.collect(batch_id)
+        return len(batch_ids)
+
+    def run(self, notes: List[Dict], text_loader: Callable[[Dict], str], model: str,
+            max_rounds: int = MAX_ROUNDS) -> Dict[str, Dict]:
+        """Re-analyze notes; returns {note_id: analysis} for every note that completed."""
+        self.resume()
+        texts = {note["id"]: text_loader(note) for note in notes}
+
+        for _ in range(max_rounds):
+            # Deduplicated by cache key: identical chunks across notes are analyzed once
+            pending: Dict[str, Dict] = {}
+            for note in notes:
+                for key, request in pending_requests(texts[note["id"]], note["note_type"], note["class_name"],
+                                                     model, self.cache):
+                    pending[key] = request
+            if not pending:
+                break
+            for batch_id in self.submit(list(pending.items())):
+                self.collect(batch_id)
+
+        results = {}
+        for note in notes:
+            analysis = analyze_text(None, texts[note["id"]], note["note_type"], note["class_name"], model,
+                                    cache=self.cache)
+            if analysis is not None:
+                results[note["id"]] = analysis
+        return results
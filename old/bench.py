@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+"""
+SB Notes Benchmarks
+Reproducible performance runs for ingest, search, listing and combined-PDF
+builds. Corpora are generated from a seed (text PDFs, scanned-like image PDFs
+and note stores of 1k/10k/100k notes) and cached under bench_data/, and model
+calls go to the deterministic fake Anthropic server, so two runs differ only
+by the code under test. Each benchmark runs in a fresh process so its peak RSS
+is its own. Results are written as JSON for comparison across runs:
+
+    python bench.py run --sizes 1000,10000
+    python bench.py compare bench_results/before.json bench_results/after.json
+"""
+
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from metrics import percentile, read_records, summarize
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+console = Console()
+
+SYLLABLES = ["ka", "lo", "mi", "ter", "pha", "ion", "gen", "cal", "vec", "tor", "sta", "tis",
+             "mo", "lec", "ule", "an", "dy", "nam", "ics", "re", "sol", "qua", "bi", "ent"]
+CLASSES = [f"Course {number:02d}" for number in range(1, 21)]
+NOTE_TYPES = ["Lecture", "Lab", "Review"]
+WORDS_PER_NOTE = 160
+WORDS_PER_PAGE = 220
+
+
+# ---------------------------------------------------------------- corpora
+
+def vocabulary(seed: int, size: int = 3000) -> List[str]:
+    """Deterministic made-up words; earlier words are drawn more often (Zipf-like)."""
+    rng = random.Random(seed)
+    words, seen = [], set()
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if len(word) >= 4 and word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class TextGenerator:
+    """Seeded sentences over a Zipf-weighted vocabulary."""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.words = vocabulary(seed)
+        self.weights = [1.0 / (rank + 1) for rank in range(len(self.words))]
+
+    def words_sample(self, count: int) -> List[str]:
+        return self.rng.choices(self.words, weights=self.weights, k=count)
+
+    def paragraph(self, word_count: int) -> str:
+        sentences, remaining = [], word_count
+        while remaining > 0:
+            length = min(remaining, self.rng.randint(8, 16))
+            words = self.words_sample(length)
+            sentences.append(" ".join(words).capitalize() + ".")
+            remaining -= length
+        return " ".join(sentences)
+
+
+def make_text_pdf(path: Path, generator: TextGenerator, pages: int):
+    """A PDF with a real text layer, like notes typed up or exported from an app."""
+    import fpdf
+
+    pdf = fpdf.FPDF()
+    pdf.set_font("helvetica", "", 11)
+    for _ in range(pages):
+        pdf.add_page()
+        pdf.multi_cell(0, 6, generator.paragraph(WORDS_PER_PAGE))
+    pdf.output(str(path))
+
+
+def make_scanned_pdf(path: Path, generator: TextGenerator, pages: int):
+    """An image-only PDF: grey noisy paper with dark strokes where lines of handwriting would be."""
+    import fpdf
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(generator.rng.randrange(2 ** 32))
+    pdf = fpdf.FPDF()
+    for _ in range(pages):
+        page = rng.normal(225, 12, size=(1100, 850)).clip(0, 255)
+        for top in range(80, 1020, 34):
+            x = 70
+            end = int(rng.integers(400, 780))
+            while x < end:
+                width = int(rng.integers(20, 90))
+                page[top:top + 14, x:min(x + width, end)] -= rng.uniform(110, 170)
+                x += width + int(rng.integers(8, 20))
+        image = Image.fromarray(page.clip(0, 255).astype(np.uint8), mode="L")
+        pdf.add_page()
+        pdf.image(image, x=0, y=0, w=pdf.w, h=pdf.h)
+    pdf.output(str(path))
+
+
+def pdf_corpus(workdir: Path, seed: int, text_pdfs: int, scanned_pdfs: int, pages: int) -> Path:
+    """Generate (or reuse) a directory of text/ and scanned/ PDFs."""
+    root = workdir / f"pdfs-s{seed}-t{text_pdfs}-i{scanned_pdfs}-p{pages}"
+    marker = root / "corpus.json"
+    if marker.exists():
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    (root / "text").mkdir(parents=True)
+    (root / "scanned").mkdir()
+    generator = TextGenerator(seed)
+    for number in range(text_pdfs):
+        make_text_pdf(root / "text" / f"text_{number:04d}.pdf", generator, pages)
+    for number in range(scanned_pdfs):
+        make_scanned_pdf(root / "scanned" / f"scan_{number:04d}.pdf", generator, pages)
+    marker.write_text(json.dumps({"seed": seed, "text": text_pdfs, "scanned": scanned_pdfs, "pages": pages}))
+    return root
+
+
+def synthetic_analysis(words: List[str]) -> Dict:
+    topics = list(dict.fromkeys(words))[:6]
+    return {
+        "summary": f"Notes covering {', '.join(topics[:3])}.",
+        "key_topics": topics,
+        "important_concepts": topics[:3],
+        "difficulty_level": "Intermediate",
+        "estimated_study_time": "1 hour",
+        "related_topics": topics[3:5],
+        "transcription_quality": "Good"
+    }
+
+
+def store_dir(workdir: Path, size: int, seed: int) -> Path:
+    return workdir / f"store-{size}-s{seed}"
+
+
+def build_store(root: str, size: int, seed: int, batch_size: int = 1000) -> Dict:
+    """Fill a NoteStore, TextStore and both indexes with `size` synthetic notes."""
+    from note_store import NoteStore, make_note_entry
+    from search_index import SearchIndex
+    from text_store import TextStore
+    from vector_index import VectorIndex
+
+    root = Path(root)
+    shutil.rmtree(root, ignore_errors=True)
+    store = NoteStore(root / "notes.db", legacy_json=None)
+    text_store = TextStore(root / "texts")
+    search_index = SearchIndex(root / "search_index.db")
+    vector_index = VectorIndex(root / "vector_index.db")
+
+    generator = TextGenerator(seed)
+    started = datetime(2024, 1, 1, 8, 0)
+    timings = Timings()
+    for start in range(0, size, batch_size):
+        batch = []
+        for number in range(start, min(size, start + batch_size)):
+            class_name = CLASSES[generator.rng.randrange(len(CLASSES))]
+            text = generator.paragraph(WORDS_PER_NOTE)
+            timestamp = (started + timedelta(minutes=37 * number)).isoformat()
+            note = make_note_entry(f"{class_name}_{timestamp}", class_name,
+                                   NOTE_TYPES[generator.rng.randrange(len(NOTE_TYPES))], timestamp,
+                                   root / "missing.pdf", synthetic_analysis(text.lower().split()),
+                                   text, text_store.put(text))
+            batch.append((note, text))
+        with timings.measure("store"):
+            store.add_notes([note for note, _ in batch])
+        with timings.measure("keyword_index"):
+            search_index.index_notes(batch)
+        with timings.measure("vector_index"):
+            vector_index.index_notes(batch)
+
+    (root / "corpus.json").write_text(json.dumps({"size": size, "seed": seed}))
+    return {"ops": timings.summary(batch_size), "params": {"embedder": vector_index.embedder.name}}
+
+
+def search_queries(seed: int, count: int) -> List[str]:
+    """Single words at common, middling and rare ranks, two-word queries and prefixes."""
+    rng = random.Random(seed + 1)
+    words = vocabulary(seed)
+    queries = []
+    while len(queries) < count:
+        kind = len(queries) % 5
+        if kind == 0:
+            queries.append(words[rng.randrange(50)])
+        elif kind == 1:
+            queries.append(words[rng.randrange(200, 500)])
+        elif kind == 2:
+            queries.append(words[rng.randrange(1000, len(words))])
+        elif kind == 3:
+            queries.append(f"{words[rng.randrange(100)]} {words[rng.randrange(100, 800)]}")
+        else:
+            queries.append(words[rng.randrange(300)][:4])
+    return queries
+
+
+# ---------------------------------------------------------------- measurement
+
+class Timings:
+    """Latency samples grouped by operation name."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def measure(self, op: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(op, []).append(time.perf_counter() - started)
+
+    def summary(self, items_per_sample: int = 1) -> Dict[str, Dict]:
+        return {op: latency_stats(values, items_per_sample) for op, values in self.samples.items()}
+
+
+def latency_stats(samples: List[float], items_per_sample: int = 1) -> Dict:
+    """Count, throughput and nearest-rank percentiles of a list of durations in seconds."""
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "total_seconds": round(total, 6),
+        "throughput_per_second": round(len(values) * items_per_sample / total, 3) if total else None,
+        "mean": round(total / len(values), 6) if values else 0.0,
+        "p50": round(percentile(values, 0.5), 6),
+        "p95": round(percentile(values, 0.95), 6),
+        "p99": round(percentile(values, 0.99), 6),
+        "max": round(values[-1], 6) if values else 0.0
+    }
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak resident set size of this process and of its (waited-for) children."""
+    if resource is None:
+        return {"peak_rss_mb": None, "peak_rss_children_mb": None}
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    }
+
+
+# ---------------------------------------------------------------- benchmarks
+# Each runs in its own spawned process with the working directory, API key,
+# base URL and trace file already set up by the parent.
+
+def _quiet_manager(workdir: Path, requests_per_minute: float):
+    """A NoteManager rooted in workdir with console output discarded."""
+    from model_gateway import get_gateway
+    from sbnotes import NoteManager
+
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+    # Gateways are shared per API key, so this sets the rate limit the manager will use
+    get_gateway(os.environ["ANTHROPIC_API_KEY"], requests_per_minute=requests_per_minute)
+    manager = NoteManager()
+    manager.console = Console(quiet=True)
+    return manager
+
+
+def bench_ingest(workdir: str, corpus: str, concurrency: int, requests_per_minute: float) -> Dict:
+    """Bulk ingest of every corpus PDF into an empty library."""
+    manager = _quiet_manager(Path(workdir), requests_per_minute)
+    files = sorted(Path(corpus).rglob("*.pdf"))
+    started = time.perf_counter()
+    manager.ingest_notes(corpus, "Bench", "Lecture", concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+    ingested = manager.store.count_notes()
+    return {
+        "ops": {"ingest": {
+            "count": ingested,
+            "total_seconds": round(elapsed, 6),
+            "throughput_per_second": round(ingested / elapsed, 3) if elapsed else None
+        }},
+        "params": {"files": len(files), "concurrency": concurrency},
+        "model_requests": manager.gateway.stats["requests"]
+    }
+
+
+def bench_upload(workdir: str, corpus: str, requests_per_minute: float) -> Dict:
+    """One interactive-style upload (process_pdf) per corpus PDF, in sequence."""
+    manager = _quiet_manager(Path(workdir), requests_per_minute)
+    timings = Timings()
+    for path in sorted(Path(corpus).rglob("*.pdf")):
+        kind = "upload_scanned" if path.parent.name == "scanned" else "upload_text"
+        with timings.measure(kind):
+            manager.process_pdf(path, "Bench", "Lecture")
+    return {"ops": timings.summary(), "model_requests": manager.gateway.stats["requests"]}
+
+
+def bench_search(root: str, queries: List[str], repeat: int) -> Dict:
+    """Keyword and semantic search (ranking plus loading the hits), and related notes."""
+    from note_store import NoteStore
+    from search_index import SearchIndex
+    from vector_index import VectorIndex
+
+    root = Path(root)
+    timings = Timings()
+    with timings.measure("open"):
+        store = NoteStore(root / "notes.db", legacy_json=None)
+        search_index = SearchIndex(root / "search_index.db")
+        vector_index = VectorIndex(root / "vector_index.db")
+
+    # The first semantic query loads the embedding matrix; report it on its own
+    with timings.measure("semantic_first"):
+        vector_index.search(queries[0], limit=10)
+
+    hits = []
+    for _ in range(repeat):
+        for query in queries:
+            with timings.measure("keyword"):
+                ranked = search_index.search(query, limit=10)
+                store.get_notes([note_id for note_id, _ in ranked])
+            with timings.measure("semantic"):
+                ranked = vector_index.search(query, limit=10)
+                store.get_notes([note_id for note_id, _ in ranked])
+            hits.extend(note_id for note_id, _ in ranked[:1])
+
+    for note_id in hits[:len(queries)]:
+        with timings.measure("related"):
+            vector_index.related(note_id)
+    return {"ops": timings.summary(), "params": {"queries": len(queries), "repeat": repeat,
+                                                "embedder": vector_index.embedder.name}}
+
+
+def bench_listing(root: str, repeat: int, page_size: int = 25, deep_pages: int = 40) -> Dict:
+    """First pages, deep cursor paging, class filters and the aggregate lookups."""
+    from note_store import NoteStore
+
+    store = NoteStore(Path(root) / "notes.db", legacy_json=None)
+    timings = Timings()
+    for number in range(repeat):
+        class_name = CLASSES[number % len(CLASSES)]
+        with timings.measure("first_page"):
+            store.page_notes(limit=page_size)
+        with timings.measure("class_page"):
+            store.page_notes(class_name=class_name, limit=page_size)
+        with timings.measure("class_type_page"):
+            store.page_notes(class_name=class_name, note_type=NOTE_TYPES[number % len(NOTE_TYPES)],
+                             limit=page_size)
+        with timings.measure("classes"):
+            store.get_classes()
+        with timings.measure("totals"):
+            store.get_totals()
+        with timings.measure("count_matching"):
+            store.count_matching(class_name=class_name)
+
+    cursor = None
+    for _ in range(deep_pages):
+        with timings.measure("next_page"):
+            _, cursor = store.page_notes(after=cursor, limit=page_size)
+        if cursor is None:
+            break
+    return {"ops": timings.summary(), "params": {"repeat": repeat, "page_size": page_size}}
+
+
+def bench_pdf(workdir: str, corpus: str, base_notes: int, appended: int, repeat: int) -> Dict:
+    """Combined-PDF builds: cold, appending one note at a time, unchanged and forced rebuilds."""
+    from note_store import make_note_entry
+    from pdf_builder import CombinedPdfBuilder
+
+    workdir = Path(workdir)
+    shutil.rmtree(workdir, ignore_errors=True)
+    files = sorted((Path(corpus) / "text").glob("*.pdf"))
+    generator = TextGenerator(len(files))
+    started = datetime(2024, 1, 1, 8, 0)
+    notes = []
+    for number in range(base_notes + appended):
+        text = generator.paragraph(60)
+        timestamp = (started + timedelta(days=number)).isoformat()
+        notes.append(make_note_entry(f"Bench_{timestamp}", "Bench", "Lecture", timestamp,
+                                     files[number % len(files)], synthetic_analysis(text.lower().split()), text))
+
+    builder = CombinedPdfBuilder(workdir / "generated")
+    timings = Timings()
+    with timings.measure("rebuild_cold"):
+        builder.build("Bench", notes[:base_notes])
+    for count in range(base_notes + 1, base_notes + appended + 1):
+        with timings.measure("append"):
+            builder.build("Bench", notes[:count])
+    for _ in range(repeat):
+        with timings.measure("unchanged"):
+            builder.build("Bench", notes)
+    for _ in range(repeat):
+        with timings.measure("rebuild_warm"):
+            builder.build("Bench", notes, force=True)
+    output = builder.output_path("Bench")
+    return {"ops": timings.summary(), "params": {"notes": len(notes), "repeat": repeat},
+            "output_bytes": output.stat().st_size}
+
+
+BENCHMARKS = {
+    "build_store": build_store,
+    "ingest": bench_ingest,
+    "upload": bench_upload,
+    "search": bench_search,
+    "listing": bench_listing,
+    "pdf": bench_pdf
+}
+
+
+def _run_in_child(name: str, kwargs: Dict) -> Dict:
+    started = time.perf_counter()
+    result = BENCHMARKS[name](**kwargs)
+    result["wall_seconds"] = round(time.perf_counter() - started, 6)
+    result.update(peak_rss_mb())
+    return result
+
+
+def run_isolated(name: str, kwargs: Dict, trace_path: Path) -> Dict:
+    """Run one benchmark in a fresh process; pipeline stage timings come from its trace file."""
+    trace_path.parent.mkdir(parents=True, exist_ok=True)
+    trace_path.unlink(missing_ok=True)
+    # Spawned children read the environment when they import metrics
+    os.environ["SBNOTES_TRACE_FILE"] = str(trace_path.resolve())
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        result = pool.submit(_run_in_child, name, kwargs).result()
+    stages, models = summarize(read_records(trace_path))
+    if stages:
+        result["stages"] = stages
+        result["models"] = models
+    return result
+
+
+# ---------------------------------------------------------------- CLI
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.group()
+def cli():
+    """SB Notes benchmark suite."""
+
+
+@cli.command()
+@click.option("--sizes", default="1000,10000,100000", show_default=True, help="Note store sizes for search/listing")
+@click.option("--seed", default=1, show_default=True)
+@click.option("--only", "only", multiple=True, type=click.Choice(["ingest", "upload", "search", "listing", "pdf"]),
+              help="Run only these benchmarks (repeatable)")
+@click.option("--text-pdfs", default=24, show_default=True)
+@click.option("--scanned-pdfs", default=8, show_default=True)
+@click.option("--pages", default=3, show_default=True, help="Pages per generated PDF")
+@click.option("--queries", default=25, show_default=True)
+@click.option("--repeat", default=4, show_default=True)
+@click.option("--latency", default=0.05, show_default=True, help="Fake model latency per call, seconds")
+@click.option("--concurrency", default=4, show_default=True, help="Model concurrency for bulk ingest")
+@click.option("--rpm", default=6000.0, show_default=True,
+              help="Gateway rate limit; high by default so the limiter doesn't dominate timings")
+@click.option("--workdir", type=click.Path(path_type=Path), default=Path("bench_data"), show_default=True)
+@click.option("--output", type=click.Path(path_type=Path), default=None,
+              help="Result file (default: bench_results/<timestamp>.json)")
+def run(sizes, seed, only, text_pdfs, scanned_pdfs, pages, queries, repeat, latency, concurrency, rpm, workdir,
+        output):
+    """Generate corpora as needed, run the benchmarks and write a JSON result file."""
+    from fake_anthropic import serve
+
+    selected = set(only) or {"ingest", "upload", "search", "listing", "pdf"}
+    store_sizes = [int(size) for size in sizes.split(",") if size.strip()]
+    workdir = workdir.resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    traces = workdir / "traces"
+
+    server = serve(port=0, latency=latency)
+    os.environ["ANTHROPIC_API_KEY"] = "bench"
+    os.environ["ANTHROPIC_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results: Dict[str, Dict] = {}
+    try:
+        if selected & {"ingest", "upload", "pdf"}:
+            console.print("[yellow]Preparing PDF corpus...[/yellow]")
+            corpus = pdf_corpus(workdir, seed, text_pdfs, scanned_pdfs, pages)
+
+        for name in ("ingest", "upload"):
+            if name in selected:
+                console.print(f"[yellow]Running {name}...[/yellow]")
+                run_dir = workdir / "runs" / name
+                shutil.rmtree(run_dir, ignore_errors=True)
+                kwargs = {"workdir": str(run_dir), "corpus": str(corpus), "requests_per_minute": rpm}
+                if name == "ingest":
+                    kwargs["concurrency"] = concurrency
+                results[name] = run_isolated(name, kwargs, traces / f"{name}.jsonl")
+
+        if "pdf" in selected:
+            console.print("[yellow]Running pdf...[/yellow]")
+            results["pdf"] = run_isolated("pdf", {
+                "workdir": str(workdir / "runs" / "pdf"), "corpus": str(corpus),
+                "base_notes": 40, "appended": 5, "repeat": repeat
+            }, traces / "pdf.jsonl")
+
+        query_list = search_queries(seed, queries)
+        for size in store_sizes if selected & {"search", "listing"} else []:
+            root = store_dir(workdir, size, seed)
+            if not (root / "corpus.json").exists():
+                console.print(f"[yellow]Building {size:,}-note store...[/yellow]")
+                results[f"build_store[{size}]"] = run_isolated(
+                    "build_store", {"root": str(root), "size": size, "seed": seed}, traces / "build_store.jsonl")
+            if "search" in selected:
+                console.print(f"[yellow]Running search[{size}]...[/yellow]")
+                results[f"search[{size}]"] = run_isolated(
+                    "search", {"root": str(root), "queries": query_list, "repeat": repeat}, traces / "search.jsonl")
+            if "listing" in selected:
+                console.print(f"[yellow]Running listing[{size}]...[/yellow]")
+                results[f"listing[{size}]"] = run_isolated(
+                    "listing", {"root": str(root), "repeat": repeat * 25}, traces / "listing.jsonl")
+    finally:
+        server.shutdown()
+
+    report = {
+        "created": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {"sizes": store_sizes, "seed": seed, "text_pdfs": text_pdfs, "scanned_pdfs": scanned_pdfs,
+                   "pages": pages, "queries": queries, "repeat": repeat, "latency": latency,
+                   "concurrency": concurrency, "rpm": rpm},
+        "results": results
+    }
+    output = output or Path("bench_results") / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    show_report(report)
+    console.print(f"[green]✅ Results written to {output}[/green]")
+
+
+def show_report(report: Dict):
+    table = Table(title=f"Benchmarks at {(report.get('commit') or 'unknown commit')[:12]}")
+    table.add_column("Benchmark", style="cyan")
+    table.add_column("Operation", style="magenta")
+    table.add_column("Count", justify="right")
+    table.add_column("p50 ms", justify="right")
+    table.add_column("p95 ms", justify="right")
+    table.add_column("Throughput/s", justify="right")
+    table.add_column("Peak RSS MB", justify="right")
+    for name, result in report["results"].items():
+        for op, stats in result["ops"].items():
+            table.add_row(name, op, str(stats["count"]),
+                          f"{stats['p50'] * 1000:.2f}" if "p50" in stats else "-",
+                          f"{stats['p95'] * 1000:.2f}" if "p95" in stats else "-",
+                          f"{stats['throughput_per_second']:.1f}" if stats.get("throughput_per_second") else "-",
+                          str(result.get("peak_rss_mb")))
+    console.print(table)
+
+
+def _change(before: Optional[float], after: Optional[float]) -> str:
+    if not before or after is None:
+        return "-"
+    delta = (after - before) / before * 100
+    style = "green" if delta < 0 else "red" if delta > 5 else "white"
+    return f"[{style}]{delta:+.1f}%[/{style}]"
+
+
+@cli.command()
+@click.argument("before", type=click.Path(exists=True, path_type=Path))
+@click.argument("after", type=click.Path(exists=True, path_type=Path))
+def compare(before, after):
+    """Compare two result files operation by operation (negative is faster/smaller)."""
+    old = json.loads(before.read_text())["results"]
+    new = json.loads(after.read_text())["results"]
+
+    table = Table(title=f"{before.name} → {after.name}")
+    table.add_column("Benchmark", style="cyan")
+    table.add_column("Operation", style="magenta")
+    table.add_column("p50 ms", justify="right")
+    table.add_column("Δ p50", justify="right")
+    table.add_column("p95 ms", justify="right")
+    table.add_column("Δ p95", justify="right")
+    table.add_column("Δ total", justify="right")
+    table.add_column("Δ peak RSS", justify="right")
+    for name in sorted(set(old) & set(new)):
+        rss = _change(old[name].get("peak_rss_mb"), new[name].get("peak_rss_mb"))
+        for op in sorted(set(old[name]["ops"]) & set(new[name]["ops"])):
+            a, b = old[name]["ops"][op], new[name]["ops"][op]
+            table.add_row(
+                name, op,
+                f"{b['p50'] * 1000:.2f}" if "p50" in b else "-",
+                _change(a.get("p50"), b.get("p50")),
+                f"{b['p95'] * 1000:.2f}" if "p95" in b else "-",
+                _change(a.get("p95"), b.get("p95")),
+                _change(a.get("total_seconds"), b.get("total_seconds")),
+                rss
+            )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
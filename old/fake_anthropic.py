@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+SB Notes Fake Anthropic Server
+A small local stand-in for the Anthropic API so batch re-analysis and the
+benchmarks can be run offline. Point the SDK at it with ANTHROPIC_BASE_URL:
+
+    python fake_anthropic.py --port 8765 &
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 python sbnotes.py reanalyze --batch
+
+Replies are deterministic fake analyses, practice questions or answers built
+from the request text, streamed as server-sent events when the request asks
+for it; --latency adds a fixed delay to every messages.create call to stand
+in for model time.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import click
+
+WORD_RE = re.compile(r"[A-Za-z]{4,}")
+
+
+def _request_text(params: Dict) -> str:
+    """Plain text of the last user turn."""
+    content = params["messages"][-1]["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def _system_text(params: Dict) -> str:
+    system = params.get("system", "")
+    if isinstance(system, str):
+        return system
+    return "\n".join(block.get("text", "") for block in system)
+
+
+def fake_reply(params: Dict) -> str:
+    """Deterministic stand-in for a model reply to params."""
+    content = params["messages"][-1]["content"]
+    if isinstance(content, list) and any(block.get("type") == "document" for block in content):
+        return "## Page 1\n\nFake transcription of the submitted pages."
+
+    words = [word.lower() for word in WORD_RE.findall(_request_text(params))]
+    topics = [word for word, _ in Counter(words).most_common(5)]
+    system = _system_text(params)
+    if "practice questions" in system:
+        return json.dumps({"questions": [
+            {"question": f"What do the notes say about {topic}?", "answer": f"Fake answer about {topic}.",
+             "type": "short_answer"}
+            for topic in topics
+        ]})
+    if "study assistant" in system:
+        return f"Fake explanation drawing on {', '.join(topics[:3]) or 'nothing'} [1]."
+    return json.dumps({
+        "summary": f"Fake analysis covering {', '.join(topics[:3]) or 'nothing'}.",
+        "key_topics": topics,
+        "important_concepts": topics[:2],
+        "difficulty_level": "Intermediate",
+        "estimated_study_time": "1 hour",
+        "related_topics": [],
+        "transcription_quality": "Good"
+    })
+
+
+def fake_message(params: Dict) -> Dict:
+    """A messages.create response body."""
+    text = fake_reply(params)
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "fake"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": len(json.dumps(params)) // 4,
+            "output_tokens": len(text) // 4,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0
+        }
+    }
+
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat().replace("+00:00", "Z")
+
+
+class FakeAnthropic:
+    """In-memory batch state shared by the request handlers."""
+
+    def __init__(self, batch_delay: float = 2.0, error_rate: float = 0.0, latency: float = 0.0,
+                 seed: Optional[int] = None):
+        self.batch_delay = batch_delay
+        self.error_rate = error_rate
+        self.latency = latency
+        # Seeded so tests get the same partial failures every run
+        self.random = random.Random(seed)
+        self.batches: Dict[str, Dict] = {}
+        self.message_requests = 0
+        self.lock = threading.Lock()
+
+    def create_message(self, params: Dict) -> Dict:
+        with self.lock:
+            self.message_requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return fake_message(params)
+
+    def create_batch(self, body: Dict) -> Dict:
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        results = []
+        for item in body["requests"]:
+            if self.random.random() < self.error_rate:
+                result = {"type": "errored", "error": {"type": "error", "error": {
+                    "type": "overloaded_error", "message": "Fake overload"}}}
+            else:
+                result = {"type": "succeeded", "message": fake_message(item["params"])}
+            results.append({"custom_id": item["custom_id"], "result": result})
+        with self.lock:
+            self.batches[batch_id] = {"created": time.time(), "results": results}
+        return self.batch_object(batch_id, base_url="")
+
+    def batch_object(self, batch_id: str, base_url: str) -> Optional[Dict]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        created = datetime.fromtimestamp(batch["created"], timezone.utc)
+        ended = time.time() - batch["created"] >= self.batch_delay
+        results = batch["results"]
+        succeeded = sum(1 for entry in results if entry["result"]["type"] == "succeeded")
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(results),
+                "succeeded": succeeded if ended else 0,
+                "errored": len(results) - succeeded if ended else 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": _iso(created),
+            "expires_at": _iso(created + timedelta(days=1)),
+            "ended_at": _iso(datetime.now(timezone.utc)) if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": f"{base_url}/v1/messages/batches/{batch_id}/results" if ended else None
+        }
+
+
+def make_handler(state: FakeAnthropic):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body, content_type: str = "application/json"):
+            payload = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, message: Dict):
+            """A message as the server-sent events of a streamed response, one word per delta."""
+            text = message["content"][0]["text"]
+            start = dict(message, content=[], stop_reason=None,
+                         usage=dict(message["usage"], output_tokens=0))
+            events = [("message_start", {"type": "message_start", "message": start}),
+                      ("content_block_start", {"type": "content_block_start", "index": 0,
+                                               "content_block": {"type": "text", "text": ""}})]
+            events.extend(
+                ("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                         "delta": {"type": "text_delta", "text": piece}})
+                for piece in re.findall(r"\S+\s*|\s+", text)
+            )
+            events.extend([
+                ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                   "usage": {"output_tokens": message["usage"]["output_tokens"]}}),
+                ("message_stop", {"type": "message_stop"})
+            ])
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for name, data in events:
+                self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def _not_found(self):
+            self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        def _read_body(self) -> Dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            if self.path == "/v1/messages/batches":
+                self._send_json(200, state.create_batch(self._read_body()))
+            elif self.path == "/v1/messages":
+                params = self._read_body()
+                if params.get("stream"):
+                    self._send_stream(state.create_message(params))
+                else:
+                    self._send_json(200, state.create_message(params))
+            else:
+                self._not_found()
+
+        def do_GET(self):
+            base_url = f"http://{self.headers.get('Host')}"
+            match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", self.path)
+            batch = state.batch_object(match.group(1), base_url) if match else None
+            if batch is None:
+                self._not_found()
+            elif match.group(2) and batch["results_url"]:
+                with state.lock:
+                    results = state.batches[match.group(1)]["results"]
+                lines = "".join(json.dumps(entry) + "\n" for entry in results)
+                self._send_json(200, lines.encode("utf-8"), content_type="application/binary")
+            elif match.group(2):
+                self._send_json(409, {"type": "error", "error": {"type": "invalid_request_error",
+                                                                  "message": "Batch is still processing"}})
+            else:
+                self._send_json(200, batch)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8765, batch_delay: float = 2.0, error_rate: float = 0.0,
+          latency: float = 0.0, seed: Optional[int] = None) -> ThreadingHTTPServer:
+    """Start the fake server on a background thread and return it (call .shutdown() to stop).
+
+    Pass port 0 to pick a free port; the chosen one is server.server_address[1].
+    The FakeAnthropic behind it is server.state.
+    """
+    state = FakeAnthropic(batch_delay, error_rate, latency, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option("--port", default=8765, show_default=True)
+@click.option("--batch-delay", default=2.0, show_default=True, help="Seconds before a batch reports ended")
+@click.option("--error-rate", default=0.0, show_default=True, help="Fraction of batch requests that error")
+@click.option("--latency", default=0.0, show_default=True, help="Seconds added to every messages.create call")
+@click.option("--seed", type=int, default=None, help="Seed for which batch requests error")
+def main(port, batch_delay, error_rate, latency, seed):
+    """Run the fake Anthropic API until interrupted."""
+    server = serve(port, batch_delay, error_rate, latency, seed)
+    print(f"Fake Anthropic API on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
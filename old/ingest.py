@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+SB Notes Bulk Ingest
+Non-interactive pipeline for ingesting a directory (or glob) of PDF notes.
+Local PyPDF2 extraction runs in a process pool while model calls run in a
+bounded asyncio pool; store writes are batched one transaction per chunk,
+and the store's ingest checkpoint lets an interrupted run resume.
+"""
+
+import asyncio
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import span
+from note_store import NoteStore, make_note_entry
+from search_index import SearchIndex
+from vector_index import VectorIndex
+from text_store import TextStore
+from ocr_cache import file_sha256
+from upload_store import UploadStore
+from pdf_text import MIN_PAGE_CHARS, extract_pdf_text
+
+# Same per-page cutoff the interactive upload uses before sending a page to vision OCR
+MIN_TEXT_CHARS = MIN_PAGE_CHARS
+
+
+def expand_inputs(target: str) -> List[Path]:
+    """Resolve a directory or glob pattern to a sorted list of PDF files."""
+    path = Path(target)
+    if path.is_dir():
+        candidates = path.rglob("*")
+    elif path.is_file():
+        candidates = [path]
+    else:
+        candidates = (Path(p) for p in glob.glob(target, recursive=True))
+    return sorted(p for p in candidates if p.is_file() and p.suffix.lower() == ".pdf")
+
+
+def extract_local_text(pdf_path: str) -> Tuple[str, bool]:
+    """Extract the text layer of a PDF with PyPDF2. Runs inside worker processes.
+
+    Returns the text and whether any page is too thin to trust without vision OCR.
+    Files whose sampled pages are all scanned return early without reading the rest.
+    """
+    try:
+        # Already inside the ingest process pool, so extract this file's pages sequentially
+        extraction = extract_pdf_text(Path(pdf_path), min_chars=MIN_TEXT_CHARS, parallel=False)
+    except Exception:
+        # Unreadable text layer; the caller falls back to vision OCR
+        return "", True
+    needs_ocr = not extraction.pages or bool(extraction.thin_pages(MIN_TEXT_CHARS))
+    return extraction.text, needs_ocr
+
+
+@dataclass
+class IngestResult:
+    """Outcome of a bulk ingest run."""
+    ingested: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+
+
+class BulkIngester:
+    """Concurrent extraction/analysis pipeline feeding a NoteStore."""
+
+    def __init__(self, store: NoteStore, upload_store: UploadStore,
+                 vision_fn: Callable[[Path, Optional[str]], str],
+                 analyze_fn: Callable[[str, str, str], Dict],
+                 chunk_size: int = 16, model_concurrency: int = 4,
+                 process_workers: Optional[int] = None,
+                 on_progress: Optional[Callable[[Path, str, str], None]] = None,
+                 search_index: Optional[SearchIndex] = None,
+                 text_store: Optional[TextStore] = None,
+                 vector_index: Optional[VectorIndex] = None):
+        self.store = store
+        self.upload_store = upload_store
+        self.vision_fn = vision_fn
+        self.analyze_fn = analyze_fn
+        self.chunk_size = max(1, chunk_size)
+        self.model_concurrency = max(1, model_concurrency)
+        self.process_workers = process_workers
+        self.on_progress = on_progress or (lambda path, status, detail: None)
+        self.search_index = search_index
+        self.text_store = text_store
+        self.vector_index = vector_index
+        self._last_timestamp: Optional[datetime] = None
+
+    def _next_timestamp(self) -> str:
+        """Monotonic upload timestamp so note ids stay unique within a run."""
+        now = datetime.now()
+        if self._last_timestamp is not None and now <= self._last_timestamp:
+            now = self._last_timestamp + timedelta(microseconds=1)
+        self._last_timestamp = now
+        return now.isoformat()
+
+    def run(self, files: List[Path], class_name: str, note_type: str) -> IngestResult:
+        """Ingest files in chunks; each chunk is committed together with its checkpoint rows."""
+        result = IngestResult()
+
+        pending, seen = [], set()
+        for path in files:
+            content_hash = file_sha256(path)
+            if content_hash in seen or self.store.is_ingested(content_hash):
+                result.skipped.append(str(path))
+                self.on_progress(path, "skipped", "already ingested")
+            else:
+                seen.add(content_hash)
+                pending.append((path, content_hash))
+
+        with ProcessPoolExecutor(max_workers=self.process_workers) as pool:
+            for start in range(0, len(pending), self.chunk_size):
+                chunk = pending[start:start + self.chunk_size]
+                asyncio.run(self._run_chunk(pool, chunk, class_name, note_type, result))
+        return result
+
+    async def _run_chunk(self, pool: ProcessPoolExecutor, chunk: List[tuple],
+                         class_name: str, note_type: str, result: IngestResult):
+        """Process one chunk concurrently, then write it in a single transaction."""
+        semaphore = asyncio.Semaphore(self.model_concurrency)
+        outcomes = await asyncio.gather(
+            *(self._process_file(pool, semaphore, path, content_hash, class_name, note_type)
+              for path, content_hash in chunk),
+            return_exceptions=True
+        )
+
+        entries, texts, checkpoint_entries = [], [], {}
+        for (path, content_hash), outcome in zip(chunk, outcomes):
+            if isinstance(outcome, BaseException):
+                result.failed[str(path)] = str(outcome)
+                self.on_progress(path, "failed", str(outcome))
+                continue
+
+            text, analysis = outcome
+            timestamp = self._next_timestamp()
+            note_id = f"{class_name}_{timestamp}"
+            # Content-addressed: a file that is already stored is not copied again
+            _, upload_path = self.upload_store.put_file(path, content_hash)
+
+            text_hash = self.text_store.put(text) if self.text_store is not None else None
+            entries.append(make_note_entry(note_id, class_name, note_type, timestamp, upload_path, analysis, text, text_hash))
+            texts.append(text)
+            checkpoint_entries[content_hash] = note_id
+
+        if entries:
+            with span("save", notes=len(entries)):
+                self.store.add_notes(entries, checkpoint=checkpoint_entries)
+            with span("index", notes=len(entries)):
+                if self.search_index is not None:
+                    self.search_index.index_notes(zip(entries, texts))
+                if self.vector_index is not None:
+                    self.vector_index.index_notes(zip(entries, texts))
+            for (path, _), outcome in zip(chunk, outcomes):
+                if not isinstance(outcome, BaseException):
+                    result.ingested.append(str(path))
+                    self.on_progress(path, "ingested", outcome[1].get("summary", ""))
+
+    async def _process_file(self, pool: ProcessPoolExecutor, semaphore: asyncio.Semaphore,
+                            path: Path, content_hash: str, class_name: str, note_type: str) -> tuple:
+        """Extract and analyze a single PDF."""
+        loop = asyncio.get_running_loop()
+        self.on_progress(path, "extracting", "")
+        with span("extract_local"):
+            text, needs_ocr = await loop.run_in_executor(pool, extract_local_text, str(path))
+
+        async with semaphore:
+            if needs_ocr:
+                self.on_progress(path, "ocr", "")
+                with span("extract"):
+                    text = await asyncio.to_thread(self.vision_fn, path, content_hash)
+            if not text.strip():
+                raise ValueError("Could not extract text from PDF")
+
+            self.on_progress(path, "analyzing", "")
+            with span("analyze", chars=len(text)):
+                analysis = await asyncio.to_thread(self.analyze_fn, text, note_type, class_name)
+        return text, analysis
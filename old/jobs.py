@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+SB Notes Background Jobs
+Durable SQLite job queue plus a worker pool that runs uploads outside the
+Streamlit script thread. Jobs survive restarts: anything left "running" by
+a worker that stopped heartbeating is put back in the queue.
+
+Run the pool directly with:  python jobs.py --workers 2
+"""
+
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import click
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+HEARTBEAT_INTERVAL = 5.0
+# A worker that hasn't heartbeated for this long is presumed dead
+STALE_AFTER = 30.0
+MAX_ATTEMPTS = 3
+# First wait before a failed job runs again; doubled on each further attempt
+RETRY_DELAY = 60.0
+DEFAULT_WORKERS = 2
+
+
+class JobQueue:
+    """Durable job records stored in SQLite; safe to share between processes."""
+
+    def __init__(self, db_path: Path = Path("data/jobs.db")):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a database was first created."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "run_after" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN run_after REAL NOT NULL DEFAULT 0")
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict) -> str:
+        """Add a job and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), now, now)
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the oldest queued job that is due, or return None if there is none."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND run_after <= ? ORDER BY created_at LIMIT 1",
+                    (QUEUED, time.time())
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, worker_id, time.time(), row["id"])
+                )
+                job = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(job)
+
+    def update(self, job_id: str, progress: float, message: str = ""):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?",
+                (progress, message, time.time(), job_id)
+            )
+
+    def complete(self, job_id: str, result: Dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, message = 'done', result = ?, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id)
+            )
+
+    def retry(self, job_id: str, error: str, delay: float):
+        """Put a failed job back in the queue to run again after delay seconds."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, message = ?, run_after = ?, updated_at = ? WHERE id = ?",
+                (QUEUED, f"retrying after error: {error}", now + delay, now, job_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, updated_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        """Most recently created jobs, newest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def active_files(self) -> List[str]:
+        """file_path of every queued or running job, so their uploads aren't garbage collected."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+        return [path for path in (json.loads(row["payload"]).get("file_path") for row in rows) if path]
+
+    def heartbeat(self, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO workers (id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, time.time())
+            )
+
+    def remove_worker(self, worker_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_workers(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat > ?", (time.time() - STALE_AFTER,)
+            ).fetchone()[0]
+
+    def requeue_stale(self) -> int:
+        """Return jobs held by dead workers to the queue (or fail them after MAX_ATTEMPTS)."""
+        cutoff = time.time() - STALE_AFTER
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                live = {row["id"] for row in self._conn.execute(
+                    "SELECT id FROM workers WHERE heartbeat > ?", (cutoff,)
+                )}
+                stale = [row for row in self._conn.execute(
+                    "SELECT id, worker, attempts FROM jobs WHERE status = ?", (RUNNING,)
+                ) if row["worker"] not in live]
+                for row in stale:
+                    if row["attempts"] >= MAX_ATTEMPTS:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, message = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, "worker stopped too many times", time.time(), row["id"])
+                        )
+                    else:
+                        self._conn.execute(
+                            "UPDATE jobs SET status = ?, worker = NULL, message = 'requeued', updated_at = ? WHERE id = ?",
+                            (QUEUED, time.time(), row["id"])
+                        )
+                self._conn.execute("DELETE FROM workers WHERE heartbeat <= ?", (cutoff,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(stale)
+
+
+def _run_upload(manager, queue: JobQueue, job: Dict) -> Dict:
+    """Process an "upload" job with the shared NoteManager pipeline."""
+    payload = job["payload"]
+    # A requeued job whose worker died after saving the note: finish it instead of failing on the duplicate id
+    timestamp = payload.get("timestamp")
+    existing = manager.store.get_note(f"{payload['class_name']}_{timestamp}") if timestamp else None
+    if existing is not None:
+        manager.reindex_note(existing)
+        return {"note_id": existing["id"], "analysis": existing["analysis"]}
+
+    manager.analysis_model = payload.get("analysis_model", manager.analysis_model)
+    note_entry = manager.process_pdf(
+        Path(payload["file_path"]),
+        payload["class_name"],
+        payload["note_type"],
+        timestamp=payload.get("timestamp"),
+        in_uploads=True,
+        on_stage=lambda stage, progress: queue.update(job["id"], progress, stage),
+        content_hash=payload.get("content_hash")
+    )
+    return {"note_id": note_entry["id"], "analysis": note_entry["analysis"]}
+
+
+HANDLERS = {"upload": _run_upload}
+
+
+def worker_loop(db_path: str, idle_exit: Optional[float] = None, upload_processes: int = 1):
+    """Claim and run jobs until idle for idle_exit seconds (forever if None).
+
+    upload_processes is how many processes share the upload byte budget.
+    """
+    # Imported here so the queue itself has no dependency on the app modules
+    from sbnotes import NoteManager
+    from streaming import share_upload_budget
+
+    share_upload_budget(upload_processes)
+
+    queue = JobQueue(Path(db_path))
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    manager = NoteManager()
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.is_set():
+            queue.heartbeat(worker_id)
+            stop.wait(HEARTBEAT_INTERVAL)
+
+    threading.Thread(target=beat, daemon=True).start()
+    last_work = time.time()
+    try:
+        while idle_exit is None or time.time() - last_work < idle_exit:
+            queue.requeue_stale()
+            job = queue.claim(worker_id)
+            if job is None:
+                time.sleep(1.0)
+                continue
+            try:
+                handler = HANDLERS[job["kind"]]
+                queue.complete(job["id"], handler(manager, queue, job))
+            except Exception as e:
+                # e.g. the model stayed unreachable through the gateway's own retries
+                if job["attempts"] < MAX_ATTEMPTS:
+                    queue.retry(job["id"], str(e), RETRY_DELAY * 2 ** (job["attempts"] - 1))
+                else:
+                    queue.fail(job["id"], str(e))
+            last_work = time.time()
+    finally:
+        stop.set()
+        queue.remove_worker(worker_id)
+
+
+def run_pool(workers: int = DEFAULT_WORKERS, db_path: str = "data/jobs.db", idle_exit: Optional[float] = None):
+    """Start a pool of worker processes and wait for them."""
+    workers = max(1, workers)
+    # Each worker gets an equal share of the upload budget, with one share left for the web app
+    processes = [
+        multiprocessing.Process(target=worker_loop, args=(db_path, idle_exit, workers + 1),
+                                name=f"sbnotes-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def ensure_workers(queue: JobQueue, workers: int = DEFAULT_WORKERS, idle_exit: float = 600.0,
+                   log_path: Path = Path("data/worker.log")) -> bool:
+    """Spawn a detached worker pool if none is alive. Returns True if one was started."""
+    if queue.live_workers() > 0:
+        return False
+    # Placeholder heartbeat so concurrent reruns don't spawn a second pool while this one starts
+    queue.heartbeat("launcher")
+    # The child keeps its own copy of the log handle; this process doesn't need one
+    with open(log_path, "a") as log:
+        subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--workers", str(workers),
+             "--db", str(queue.db_path), "--idle-exit", str(idle_exit)],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    return True
+
+
+@click.command()
+@click.option("--workers", default=DEFAULT_WORKERS, show_default=True, help="Number of worker processes")
+@click.option("--db", "db_path", default="data/jobs.db", show_default=True)
+@click.option("--idle-exit", type=float, default=None, help="Exit after this many idle seconds (default: run forever)")
+def main(workers, db_path, idle_exit):
+    """SB Notes background worker pool."""
+    run_pool(workers, db_path, idle_exit)
+
+
+if __name__ == "__main__":
+    main()
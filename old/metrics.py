@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+SB Notes Metrics
+Lightweight tracing for the upload/ingest pipeline. Stages are timed with
+nested spans and model calls are recorded with their token usage; every
+record is appended to a JSONL trace file shared by all processes (terminal,
+web, background workers). The trace file feeds a Prometheus text endpoint
+and the `stats` summary with per-stage percentiles.
+"""
+
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TRACE_PATH = Path(os.getenv("SBNOTES_TRACE_FILE", "data/traces.jsonl"))
+# Rotate the trace file to <name>.1 once it grows past this
+MAX_TRACE_BYTES = 50 * 1024 * 1024
+
+# Histogram buckets in seconds, from fast local stages up to long vision calls
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_KINDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("sbnotes_span", default=None)
+
+
+class Tracer:
+    """Writes span and event records to a JSONL file; safe to use from several threads."""
+
+    def __init__(self, path: Path = TRACE_PATH, max_bytes: int = MAX_TRACE_BYTES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _emit(self, record: Dict):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                    os.replace(self.path, self.path.with_suffix(self.path.suffix + ".1"))
+                # One short append per record, so lines from different processes don't interleave
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass  # tracing must never break the pipeline
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time a pipeline stage. Yields a dict the caller can add attributes to."""
+        parent = _current_span.get()
+        context = {
+            "trace": parent["trace"] if parent else uuid.uuid4().hex[:16],
+            "span": uuid.uuid4().hex[:16]
+        }
+        token = _current_span.set(context)
+        started = time.time()
+        clock = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            self._emit({
+                "type": "span",
+                "name": name,
+                "trace": context["trace"],
+                "span": context["span"],
+                "parent": parent["span"] if parent else None,
+                "start": started,
+                "duration": time.perf_counter() - clock,
+                "error": error,
+                "attrs": attrs
+            })
+
+    def model_call(self, model: str, latency: float, usage: Dict[str, int]):
+        """Record one model call with its token usage."""
+        parent = _current_span.get()
+        self._emit({
+            "type": "model_call",
+            "model": model,
+            "trace": parent["trace"] if parent else None,
+            "parent": parent["span"] if parent else None,
+            "start": time.time() - latency,
+            "duration": latency,
+            **{kind: usage.get(kind, 0) for kind in TOKEN_KINDS}
+        })
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer writing to TRACE_PATH."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def current_span() -> Optional[Dict]:
+    """The active span context, to carry into work run on another thread or event loop."""
+    return _current_span.get()
+
+
+def set_current_span(context: Optional[Dict]):
+    """Adopt a span context captured with current_span()."""
+    _current_span.set(context)
+
+
+def span(name: str, **attrs):
+    """Shorthand for get_tracer().span(...)."""
+    return get_tracer().span(name, **attrs)
+
+
+def read_records(path: Path = TRACE_PATH, since: Optional[float] = None) -> List[Dict]:
+    """All records in a trace file (and its rotated predecessor), optionally since a timestamp."""
+    records = []
+    for candidate in (path.with_suffix(path.suffix + ".1"), path):
+        if not candidate.exists():
+            continue
+        with open(candidate, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a partially written last line
+                if since is None or record.get("start", 0) >= since:
+                    records.append(record)
+    return records
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(records: List[Dict]) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """Per-stage latency stats and per-model call/token totals."""
+    durations: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    models: Dict[str, Dict] = {}
+    for record in records:
+        if record.get("type") == "span":
+            durations.setdefault(record["name"], []).append(record["duration"])
+            if record.get("error"):
+                errors[record["name"]] = errors.get(record["name"], 0) + 1
+        elif record.get("type") == "model_call":
+            durations.setdefault(f"model:{record['model']}", []).append(record["duration"])
+            totals = models.setdefault(record["model"], {"calls": 0, **{kind: 0 for kind in TOKEN_KINDS}})
+            totals["calls"] += 1
+            for kind in TOKEN_KINDS:
+                totals[kind] += record.get(kind, 0) or 0
+
+    stages = {}
+    for name, values in sorted(durations.items()):
+        values.sort()
+        stages[name] = {
+            "count": len(values),
+            "errors": errors.get(name, 0),
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": values[-1],
+            "total": sum(values)
+        }
+    return stages, models
+
+
+class MetricsRegistry:
+    """Prometheus histograms and counters built incrementally from trace records."""
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Tuple], Dict] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, name: str, labels: Tuple, value: float):
+        histogram = self.histograms.setdefault((name, labels), {
+            "buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0
+        })
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def _inc(self, name: str, labels: Tuple, value: float = 1.0):
+        self.counters[(name, labels)] = self.counters.get((name, labels), 0.0) + value
+
+    def observe_record(self, record: Dict):
+        with self._lock:
+            if record.get("type") == "span":
+                self._observe("sbnotes_stage_seconds", (("stage", record["name"]),), record["duration"])
+                if record.get("error"):
+                    self._inc("sbnotes_stage_errors_total", (("stage", record["name"]),))
+            elif record.get("type") == "model_call":
+                model = (("model", record["model"]),)
+                self._observe("sbnotes_model_call_seconds", model, record["duration"])
+                for kind in TOKEN_KINDS:
+                    self._inc("sbnotes_model_tokens_total", model + (("kind", kind[:-len("_tokens")]),),
+                              record.get(kind, 0) or 0)
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        def fmt(labels: Tuple) -> str:
+            return ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels)
+
+        lines = []
+        with self._lock:
+            for metric in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {metric} histogram")
+                for (name, labels), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    for bound, count in zip(BUCKETS, histogram["buckets"]):
+                        lines.append(f'{name}_bucket{{{fmt(labels + (("le", bound),))}}} {count}')
+                    lines.append(f'{name}_bucket{{{fmt(labels + (("le", "+Inf"),))}}} {histogram["count"]}')
+                    lines.append(f"{name}_sum{{{fmt(labels)}}} {histogram['sum']}")
+                    lines.append(f"{name}_count{{{fmt(labels)}}} {histogram['count']}")
+            for metric in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {metric} counter")
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == metric:
+                        lines.append(f"{name}{{{fmt(labels)}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class TraceFollower:
+    """Feeds newly appended trace lines into a registry, so scrapes never re-read the whole file."""
+
+    def __init__(self, path: Path, registry: MetricsRegistry):
+        self.path = Path(path)
+        self.registry = registry
+        self._offset = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def poll(self):
+        with self._lock:
+            try:
+                stat = self.path.stat()
+            except OSError:
+                return
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # New or rotated file: start from its beginning
+                self._inode, self._offset = stat.st_ino, 0
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            # Leave a partially written last line for the next poll
+            complete = data[:data.rfind(b"\n") + 1]
+            self._offset += len(complete)
+            for line in complete.splitlines():
+                try:
+                    self.registry.observe_record(json.loads(line))
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+
+def serve_metrics(port: int = 9464, path: Path = TRACE_PATH, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics for the trace file on a background thread and return the server."""
+    follower = TraceFollower(path, MetricsRegistry())
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            follower.poll()
+            body = follower.registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+SB Notes Model Gateway
+Shared entry point for every Anthropic call made by the terminal and web apps.
+Requests run on one background event loop with a pooled async client,
+token-bucket rate limiting, retry-after aware exponential backoff, and
+coalescing of identical in-flight requests. Responses can also be streamed
+to synchronous callers as text deltas.
+"""
+
+import asyncio
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import anthropic
+import httpx
+
+from metrics import current_span, get_tracer, set_current_span
+
+VISION_MODEL = "claude-sonnet-4-20250514"
+VISION_PROMPT = "Please read and transcribe all the text content from this PDF. This appears to be handwritten or scanned notes. Extract all text, mathematical formulas, diagrams descriptions, and any other written content from all pages. Be thorough and accurate in your transcription. Organize the content by pages if possible."
+
+# Status codes worth retrying: rate limits, transient server errors and overload
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def cacheable_system(text: str) -> List[Dict[str, Any]]:
+    """System prompt block marked as a prompt-cache breakpoint.
+
+    Everything up to and including this block (the static instructions) can be
+    served from the prompt cache on later calls; variable content goes after it.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_vision_request(pdf_base64: str, max_tokens: int = 4000, instructions: str = VISION_PROMPT,
+                         prompt: Optional[str] = None) -> Dict[str, Any]:
+    """Keyword arguments for a PDF transcription call.
+
+    The static instructions go in the cached system prompt; the document and
+    any per-call prompt (e.g. page numbering) follow it.
+    """
+    content: List[Dict[str, Any]] = [
+        {
+            "type": "document",
+            "source": {
+                "type": "base64",
+                "media_type": "application/pdf",
+                "data": pdf_base64
+            }
+        }
+    ]
+    if prompt:
+        content.append({"type": "text", "text": prompt})
+    return {
+        "model": VISION_MODEL,
+        "max_tokens": max_tokens,
+        "system": cacheable_system(instructions),
+        "messages": [{"role": "user", "content": content}]
+    }
+
+
+ANALYSIS_INSTRUCTIONS = """You analyze students' class notes. The content was extracted from scanned/handwritten notes using AI vision, so it may contain transcription artifacts.
+
+For the notes you are given, provide:
+1. A concise summary (2-3 sentences)
+2. Key topics/concepts covered
+3. Important formulas, definitions, or concepts
+4. Difficulty level (Beginner/Intermediate/Advanced)
+5. Estimated study time needed
+6. Related topics that might be connected
+7. Content quality assessment (how well the notes were transcribed)
+
+Respond with a single JSON object and nothing else, with these keys:
+- summary
+- key_topics
+- important_concepts
+- difficulty_level
+- estimated_study_time
+- related_topics
+- transcription_quality"""
+
+
+def build_analysis_prompt(text: str, note_type: str, class_name: str) -> str:
+    """Variable part of an analysis request: what the note is, then its text (always last)."""
+    return f"Analyze the following {note_type} for {class_name}.\n\nNotes content:\n{text}"
+
+
+def build_analysis_request(text: str, note_type: str, class_name: str, model: str,
+                           max_tokens: int = 1000) -> Dict[str, Any]:
+    """Keyword arguments for an analysis call: cached instructions first, note text last."""
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": cacheable_system(ANALYSIS_INSTRUCTIONS),
+        "messages": [{"role": "user", "content": build_analysis_prompt(text, note_type, class_name)}]
+    }
+
+
+def _base64_digest(data: str, slice_chars: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    for start in range(0, len(data), slice_chars):
+        digest.update(data[start:start + slice_chars].encode("ascii"))
+    return digest.hexdigest()
+
+
+def _without_base64(value: Any) -> Any:
+    """value with every base64 source's data replaced by its sha256."""
+    if isinstance(value, dict):
+        if value.get("type") == "base64" and isinstance(value.get("data"), str):
+            return dict(value, data=f"sha256:{_base64_digest(value['data'])}")
+        return {key: _without_base64(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_without_base64(item) for item in value]
+    return value
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available and take them."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Drain the bucket so nothing is sent for roughly `seconds` (used on 429s)."""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+        self.updated = time.monotonic()
+
+
+class ModelGateway:
+    """Rate-limited, retrying, coalescing wrapper around AsyncAnthropic."""
+
+    def __init__(self, api_key: str, requests_per_minute: float = 50, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0, max_connections: int = 20,
+                 timeout: float = 600.0):
+        self.api_key = api_key
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "requests": 0, "retries": 0, "coalesced": 0, "failures": 0,
+            "input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0
+        }
+        # Per-call usage records (most recent first out), for measuring prompt-cache savings
+        self.calls: deque = deque(maxlen=1000)
+
+        # One event loop per gateway owns the client, pool and in-flight map
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="model-gateway", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        """Create loop-bound resources on the gateway loop."""
+        self.client = anthropic.AsyncAnthropic(
+            api_key=self.api_key,
+            max_retries=0,  # retries are handled here so they share the rate limiter
+            timeout=self.timeout,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        )
+        rate = self.requests_per_minute / 60.0
+        self.bucket = TokenBucket(rate, capacity=max(1.0, min(self.requests_per_minute, 10)))
+
+    @staticmethod
+    def _request_key(kwargs: Dict[str, Any]) -> str:
+        """Stable hash of a request, used to coalesce identical calls.
+
+        Base64 document data is hashed in slices and keyed by its digest, so
+        keying a PDF request never builds another full copy of the document.
+        """
+        payload = json.dumps(_without_base64(kwargs), sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Backoff delay, honouring a retry-after header when the API sends one."""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.max_delay)
+                except ValueError:
+                    pass
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * (0.5 + random.random() / 2)
+
+    def _is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+            return True
+        if isinstance(error, anthropic.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS
+        return False
+
+    def _record_usage(self, model: str, message, latency: float):
+        """Add a response's token usage, including prompt-cache reads and writes, to the counters."""
+        usage = getattr(message, "usage", None)
+        record = {
+            "model": model,
+            "latency": latency,
+            "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+            "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+            "cache_read_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0
+        }
+        for key in ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens"):
+            self.stats[key] += record[key]
+        self.calls.append(record)
+        get_tracer().model_call(model, latency, record)
+
+    async def _send(self, kwargs: Dict[str, Any], emit: Optional[Callable[[str], None]] = None):
+        """Send one request with rate limiting and retries.
+
+        With emit, the response is streamed and each text delta is passed to it;
+        a stream is only retried if it failed before its first delta.
+        """
+        attempt = 0
+        emitted = False
+        while True:
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            started = time.monotonic()
+            try:
+                if emit is None:
+                    message = await self.client.messages.create(**kwargs)
+                else:
+                    async with self.client.messages.stream(**kwargs) as stream:
+                        async for text in stream.text_stream:
+                            emitted = True
+                            emit(text)
+                        message = await stream.get_final_message()
+                self._record_usage(kwargs.get("model", ""), message, time.monotonic() - started)
+                return message
+            except Exception as e:
+                if emitted or attempt >= self.max_retries or not self._is_retryable(e):
+                    self.stats["failures"] += 1
+                    raise
+                delay = self._retry_delay(attempt, e)
+                if isinstance(e, anthropic.RateLimitError):
+                    self.bucket.pause(delay)
+                self.stats["retries"] += 1
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def acreate(self, **kwargs):
+        """Async messages.create; must be awaited on the gateway loop."""
+        key = self._request_key(kwargs)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._send(kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled waiter doesn't cancel the shared request
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _in_span(parent, coroutine_fn):
+        """Run coroutine_fn on the gateway loop under the caller's trace span."""
+        set_current_span(parent)
+        return await coroutine_fn()
+
+    def create(self, **kwargs):
+        """Blocking messages.create for synchronous callers (any thread)."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._in_span(current_span(), lambda: self.acreate(**kwargs)), self._loop
+        )
+        return future.result()
+
+    async def _create_bounded(self, semaphore: asyncio.Semaphore, kwargs: Dict[str, Any]):
+        async with semaphore:
+            return await self.acreate(**kwargs)
+
+    def create_many(self, requests: List[Dict[str, Any]], max_concurrency: int = 4) -> List[Any]:
+        """Run several requests concurrently; results (or exceptions) come back in request order."""
+        async def run_all():
+            semaphore = asyncio.Semaphore(max(1, max_concurrency))
+            return await asyncio.gather(
+                *(self._create_bounded(semaphore, kwargs) for kwargs in requests),
+                return_exceptions=True
+            )
+        return asyncio.run_coroutine_threadsafe(self._in_span(current_span(), run_all), self._loop).result()
+
+    def stream(self, **kwargs) -> Iterator[str]:
+        """Blocking messages.stream for synchronous callers: yields text deltas as they arrive.
+
+        Streams are never coalesced. Errors are raised from the iterator; closing
+        it early cancels the request.
+        """
+        deltas: queue.Queue = queue.Queue()
+        done = object()
+        future = asyncio.run_coroutine_threadsafe(
+            self._in_span(current_span(), lambda: self._send(kwargs, emit=deltas.put)), self._loop
+        )
+        future.add_done_callback(lambda _: deltas.put(done))
+        try:
+            while True:
+                delta = deltas.get()
+                if delta is done:
+                    break
+                yield delta
+            future.result()
+        finally:
+            future.cancel()
+
+    def close(self):
+        """Close the HTTP pool and stop the gateway loop."""
+        asyncio.run_coroutine_threadsafe(self.client.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_gateways: Dict[str, ModelGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(api_key: str, **options) -> ModelGateway:
+    """Process-wide gateway per API key, so every caller shares one pool and rate limit."""
+    with _gateways_lock:
+        gateway = _gateways.get(api_key)
+        if gateway is None:
+            gateway = ModelGateway(api_key, **options)
+            _gateways[api_key] = gateway
+        return gateway
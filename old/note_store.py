@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+SB Notes Store
+SQLite-backed note storage shared by the terminal and web interfaces.
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id TEXT PRIMARY KEY,
+    class_name TEXT NOT NULL,
+    note_type TEXT NOT NULL,
+    upload_date TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    text_preview TEXT NOT NULL DEFAULT '',
+    text_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notes_class_name ON notes (class_name);
+CREATE INDEX IF NOT EXISTS idx_notes_note_type ON notes (note_type);
+CREATE INDEX IF NOT EXISTS idx_notes_upload_date ON notes (upload_date);
+CREATE INDEX IF NOT EXISTS idx_notes_class_type_date ON notes (class_name, note_type, upload_date);
+CREATE INDEX IF NOT EXISTS idx_notes_date_id ON notes (upload_date, id);
+CREATE INDEX IF NOT EXISTS idx_notes_class_date_id ON notes (class_name, upload_date, id);
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    content_hash TEXT PRIMARY KEY,
+    note_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Materialized aggregates, kept in step with notes by triggers so every writer
+# (terminal, web, background workers) updates them in the same transaction
+AGGREGATES_VERSION = "1"
+
+AGGREGATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS class_stats (
+    class_name TEXT NOT NULL,
+    note_type TEXT NOT NULL,
+    note_count INTEGER NOT NULL,
+    last_updated TEXT NOT NULL,
+    PRIMARY KEY (class_name, note_type)
+);
+CREATE TABLE IF NOT EXISTS note_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    note_count INTEGER NOT NULL,
+    class_count INTEGER NOT NULL,
+    latest_upload TEXT
+);
+INSERT OR IGNORE INTO note_totals (id, note_count, class_count, latest_upload) VALUES (1, 0, 0, NULL);
+"""
+
+# Trigger steps for a row entering ({row} = NEW) or leaving ({row} = OLD) the notes table
+_ADD_STEPS = """
+    INSERT INTO class_stats (class_name, note_type, note_count, last_updated)
+    VALUES ({row}.class_name, {row}.note_type, 1, {row}.upload_date)
+    ON CONFLICT(class_name, note_type) DO UPDATE SET
+        note_count = note_count + 1,
+        last_updated = MAX(last_updated, excluded.last_updated);
+    UPDATE note_totals SET
+        note_count = note_count + 1,
+        class_count = class_count + ((SELECT SUM(note_count) FROM class_stats WHERE class_name = {row}.class_name) = 1),
+        latest_upload = MAX(COALESCE(latest_upload, ''), {row}.upload_date)
+    WHERE id = 1;
+"""
+_REMOVE_STEPS = """
+    UPDATE class_stats SET
+        note_count = note_count - 1,
+        last_updated = COALESCE((SELECT MAX(upload_date) FROM notes
+                                 WHERE class_name = {row}.class_name AND note_type = {row}.note_type), '')
+    WHERE class_name = {row}.class_name AND note_type = {row}.note_type;
+    DELETE FROM class_stats WHERE class_name = {row}.class_name AND note_type = {row}.note_type AND note_count <= 0;
+    UPDATE note_totals SET
+        note_count = note_count - 1,
+        class_count = class_count - (NOT EXISTS (SELECT 1 FROM class_stats WHERE class_name = {row}.class_name)),
+        latest_upload = (SELECT MAX(upload_date) FROM notes)
+    WHERE id = 1;
+"""
+
+AGGREGATE_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS notes_aggregate_insert AFTER INSERT ON notes BEGIN
+{_ADD_STEPS.format(row="NEW")}
+END;
+CREATE TRIGGER IF NOT EXISTS notes_aggregate_delete AFTER DELETE ON notes BEGIN
+{_REMOVE_STEPS.format(row="OLD")}
+END;
+CREATE TRIGGER IF NOT EXISTS notes_aggregate_update AFTER UPDATE OF class_name, note_type, upload_date ON notes BEGIN
+{_REMOVE_STEPS.format(row="OLD")}
+{_ADD_STEPS.format(row="NEW")}
+END;
+"""
+
+NOTE_COLUMNS = ("id", "class_name", "note_type", "upload_date", "file_path", "analysis", "text_preview", "text_hash")
+
+
+def make_note_entry(note_id: str, class_name: str, note_type: str, timestamp: str,
+                    file_path: Path, analysis: Dict, text: str, text_hash: Optional[str] = None) -> Dict:
+    """Build a note dict in the stored schema. text_hash points at the full text in the TextStore."""
+    return {
+        "id": note_id,
+        "class_name": class_name,
+        "note_type": note_type,
+        "upload_date": timestamp,
+        "file_path": str(file_path),
+        "analysis": analysis,
+        "text_preview": text[:500] + "..." if len(text) > 500 else text,
+        "text_hash": text_hash
+    }
+
+
+class NoteStore:
+    """Indexed note storage backed by SQLite in WAL mode."""
+
+    def __init__(self, db_path: Path = Path("data/notes.db"), legacy_json: Optional[Path] = Path("data/notes.json")):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._writes = 0
+
+        # Streamlit serves reruns from several threads, so share one connection behind a lock
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Lets INSERT OR REPLACE fire the delete trigger for the replaced row
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.executescript(SCHEMA)
+        self._upgrade_schema()
+        self._conn.executescript(AGGREGATE_SCHEMA + AGGREGATE_TRIGGERS)
+        self._conn.commit()
+
+        # Databases created before the aggregate tables existed get them filled in once
+        if self._get_meta("aggregates_version") != AGGREGATES_VERSION:
+            self.rebuild_aggregates()
+
+        # One-shot import of the old notes.json library
+        if legacy_json is not None and Path(legacy_json).exists() and self._get_meta("migrated_from") is None:
+            self.migrate_from_json(Path(legacy_json))
+
+    def close(self):
+        """Close the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+    def version(self) -> str:
+        """Changes whenever the notes change, through this store or another connection.
+
+        Callers use it to invalidate derived caches without reloading everything.
+        """
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            return f"{data_version}.{self._writes}"
+
+    def _upgrade_schema(self):
+        """Add columns introduced after a database was first created."""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(notes)")}
+        if "text_hash" not in columns:
+            self._conn.execute("ALTER TABLE notes ADD COLUMN text_hash TEXT")
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        """Read a value from the meta table."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        """Write a value to the meta table (caller commits)."""
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    @staticmethod
+    def _note_params(note: Dict) -> tuple:
+        """Convert a note dict into an INSERT parameter tuple."""
+        return (
+            note["id"],
+            note["class_name"],
+            note["note_type"],
+            note["upload_date"],
+            note.get("file_path", ""),
+            json.dumps(note.get("analysis", {})),
+            note.get("text_preview", ""),
+            note.get("text_hash")
+        )
+
+    @staticmethod
+    def _row_to_note(row: sqlite3.Row) -> Dict:
+        """Convert a database row back into the note dict schema."""
+        note = dict(row)
+        note["analysis"] = json.loads(note["analysis"])
+        return note
+
+    def add_note(self, note: Dict):
+        """Insert a single note."""
+        with self._lock, self._conn:
+            self._writes += 1
+            self._conn.execute(
+                f"INSERT INTO notes ({', '.join(NOTE_COLUMNS)}) VALUES ({', '.join('?' * len(NOTE_COLUMNS))})",
+                self._note_params(note)
+            )
+
+    def add_notes(self, notes: List[Dict], checkpoint: Optional[Dict[str, str]] = None):
+        """Insert a batch of notes in a single transaction.
+
+        checkpoint maps source content hashes to note ids and is committed in the
+        same transaction, so an interrupted bulk ingest can resume safely.
+        """
+        with self._lock, self._conn:
+            self._writes += 1
+            self._conn.executemany(
+                f"INSERT INTO notes ({', '.join(NOTE_COLUMNS)}) VALUES ({', '.join('?' * len(NOTE_COLUMNS))})",
+                [self._note_params(note) for note in notes]
+            )
+            if checkpoint:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO ingest_checkpoint (content_hash, note_id) VALUES (?, ?)",
+                    list(checkpoint.items())
+                )
+
+    def update_analysis(self, note_id: str, analysis: Dict) -> bool:
+        """Replace a note's stored analysis. Returns True if the note exists."""
+        with self._lock, self._conn:
+            self._writes += 1
+            cursor = self._conn.execute(
+                "UPDATE notes SET analysis = ? WHERE id = ?", (json.dumps(analysis), note_id)
+            )
+        return cursor.rowcount > 0
+
+    def update_analyses(self, analyses: Dict[str, Dict]) -> int:
+        """Replace the analyses of several notes in one transaction. Returns how many were updated."""
+        with self._lock, self._conn:
+            self._writes += 1
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "UPDATE notes SET analysis = ? WHERE id = ?",
+                [(json.dumps(analysis), note_id) for note_id, analysis in analyses.items()]
+            )
+            return self._conn.total_changes - before
+
+    def is_ingested(self, content_hash: str) -> bool:
+        """Whether a source file with this content hash was already bulk ingested."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM ingest_checkpoint WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row is not None
+
+    def get_note(self, note_id: str) -> Optional[Dict]:
+        """Fetch one note by id."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM notes WHERE id = ?", (note_id,)).fetchone()
+        return self._row_to_note(row) if row else None
+
+    def get_notes(self, note_ids: List[str]) -> List[Dict]:
+        """Fetch several notes by id, preserving the order of note_ids."""
+        if not note_ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM notes WHERE id IN ({', '.join('?' * len(note_ids))})", note_ids
+            ).fetchall()
+        by_id = {row["id"]: self._row_to_note(row) for row in rows}
+        return [by_id[note_id] for note_id in note_ids if note_id in by_id]
+
+    def delete_note(self, note_id: str) -> bool:
+        """Delete a note by id. Returns True if a row was removed."""
+        with self._lock, self._conn:
+            self._writes += 1
+            cursor = self._conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
+        return cursor.rowcount > 0
+
+    def file_references(self) -> Dict[str, int]:
+        """How many notes point at each stored file path (the upload store's reference counts)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT file_path, COUNT(*) FROM notes GROUP BY file_path").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def update_file_paths(self, moves: Dict[str, str]) -> int:
+        """Repoint every note from old file paths to new ones in one transaction. Returns rows changed."""
+        with self._lock, self._conn:
+            self._writes += 1
+            changed = 0
+            for old, new in moves.items():
+                changed += self._conn.execute(
+                    "UPDATE notes SET file_path = ? WHERE file_path = ?", (new, old)
+                ).rowcount
+        return changed
+
+    def list_notes(self, class_name: Optional[str] = None, note_type: Optional[str] = None,
+                   newest_first: bool = False) -> List[Dict]:
+        """List notes, optionally filtered by class and type, ordered by upload date."""
+        clauses, params = [], []
+        if class_name is not None:
+            clauses.append("class_name = ?")
+            params.append(class_name)
+        if note_type is not None:
+            clauses.append("note_type = ?")
+            params.append(note_type)
+
+        query = "SELECT * FROM notes"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += f" ORDER BY upload_date {'DESC' if newest_first else 'ASC'}, id"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_note(row) for row in rows]
+
+    def page_notes(self, class_name: Optional[str] = None, note_type: Optional[str] = None,
+                   after: Optional[Tuple[str, str]] = None, limit: int = 25,
+                   newest_first: bool = True) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """One page of notes ordered by (upload_date, id), continuing after the cursor `after`.
+
+        Returns the page and the cursor for the next one (None when there are no more).
+        Seeks on the index instead of using OFFSET, so deep pages cost the same as the first.
+        """
+        clauses, params = [], []
+        if class_name is not None:
+            clauses.append("class_name = ?")
+            params.append(class_name)
+        if note_type is not None:
+            clauses.append("note_type = ?")
+            params.append(note_type)
+        if after is not None:
+            clauses.append(f"(upload_date, id) {'<' if newest_first else '>'} (?, ?)")
+            params.extend(after)
+
+        order = "DESC" if newest_first else "ASC"
+        query = "SELECT * FROM notes"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += f" ORDER BY upload_date {order}, id {order} LIMIT ?"
+        # Fetch one extra row to know whether another page exists
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        notes = [self._row_to_note(row) for row in rows[:limit]]
+        next_cursor = (notes[-1]["upload_date"], notes[-1]["id"]) if len(rows) > limit else None
+        return notes, next_cursor
+
+    def count_matching(self, class_name: Optional[str] = None, note_type: Optional[str] = None) -> int:
+        """Number of notes matching the class/type filters, from the materialized aggregates."""
+        if class_name is None and note_type is None:
+            return self.count_notes()
+        classes = self.get_classes()
+        if class_name is not None:
+            classes = {class_name: classes[class_name]} if class_name in classes else {}
+        if note_type is None:
+            return sum(info["total_notes"] for info in classes.values())
+        return sum(info["note_types"].get(note_type, 0) for info in classes.values())
+
+    def count_notes(self) -> int:
+        """Total number of notes."""
+        return self.get_totals()["total_notes"]
+
+    def latest_upload(self) -> Optional[str]:
+        """Upload date of the most recent note, if any."""
+        return self.get_totals()["latest_upload"]
+
+    def get_totals(self) -> Dict:
+        """Library-wide counters, read from the materialized totals row."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT note_count, class_count, latest_upload FROM note_totals WHERE id = 1"
+            ).fetchone()
+        return {
+            "total_notes": row["note_count"],
+            "total_classes": row["class_count"],
+            "latest_upload": row["latest_upload"]
+        }
+
+    def get_classes(self) -> Dict[str, Dict]:
+        """Per-class summary in the same shape as the old notes.json "classes" map."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT class_name, note_type, note_count AS n, last_updated FROM class_stats ORDER BY class_name"
+            ).fetchall()
+        return self._classes_from_rows(rows)
+
+    @staticmethod
+    def _classes_from_rows(rows: List[sqlite3.Row]) -> Dict[str, Dict]:
+        """Fold (class_name, note_type, n, last_updated) rows into the classes map."""
+        classes: Dict[str, Dict] = {}
+        for row in rows:
+            info = classes.setdefault(row["class_name"], {"total_notes": 0, "note_types": {}, "last_updated": ""})
+            info["total_notes"] += row["n"]
+            info["note_types"][row["note_type"]] = row["n"]
+            info["last_updated"] = max(info["last_updated"], row["last_updated"])
+        return classes
+
+    def _scan_classes(self) -> Dict[str, Dict]:
+        """Recompute the classes map from the notes table (full scan)."""
+        rows = self._conn.execute(
+            "SELECT class_name, note_type, COUNT(*) AS n, MAX(upload_date) AS last_updated "
+            "FROM notes GROUP BY class_name, note_type ORDER BY class_name"
+        ).fetchall()
+        return self._classes_from_rows(rows)
+
+    def verify_aggregates(self) -> List[str]:
+        """Compare the materialized aggregates with a full scan. Returns a list of mismatches."""
+        with self._lock:
+            expected = self._scan_classes()
+            actual = self.get_classes()
+            scanned = self._conn.execute("SELECT COUNT(*), MAX(upload_date) FROM notes").fetchone()
+            totals = self.get_totals()
+
+        problems = []
+        for class_name in sorted(set(expected) | set(actual)):
+            if expected.get(class_name) != actual.get(class_name):
+                problems.append(f"class {class_name!r}: stored {actual.get(class_name)}, actual {expected.get(class_name)}")
+        if totals["total_notes"] != scanned[0]:
+            problems.append(f"total notes: stored {totals['total_notes']}, actual {scanned[0]}")
+        if totals["total_classes"] != len(expected):
+            problems.append(f"total classes: stored {totals['total_classes']}, actual {len(expected)}")
+        if totals["latest_upload"] != scanned[1]:
+            problems.append(f"latest upload: stored {totals['latest_upload']}, actual {scanned[1]}")
+        return problems
+
+    def rebuild_aggregates(self):
+        """Recompute the materialized aggregates from the notes table."""
+        with self._lock, self._conn:
+            self._writes += 1
+            self._conn.execute("DELETE FROM class_stats")
+            self._conn.execute(
+                "INSERT INTO class_stats (class_name, note_type, note_count, last_updated) "
+                "SELECT class_name, note_type, COUNT(*), MAX(upload_date) FROM notes GROUP BY class_name, note_type"
+            )
+            self._conn.execute(
+                "UPDATE note_totals SET "
+                "note_count = (SELECT COUNT(*) FROM notes), "
+                "class_count = (SELECT COUNT(DISTINCT class_name) FROM notes), "
+                "latest_upload = (SELECT MAX(upload_date) FROM notes) "
+                "WHERE id = 1"
+            )
+            self._set_meta("aggregates_version", AGGREGATES_VERSION)
+
+    def migrate_from_json(self, json_path: Path) -> int:
+        """Import notes from the legacy notes.json schema. Returns the number of notes imported."""
+        try:
+            with open(json_path, "r") as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return 0
+
+        notes = legacy.get("notes", [])
+        with self._lock, self._conn:
+            self._writes += 1
+            # Counted from the table: total_changes would include the aggregate triggers' writes
+            before = self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO notes ({', '.join(NOTE_COLUMNS)}) VALUES ({', '.join('?' * len(NOTE_COLUMNS))})",
+                [self._note_params(note) for note in notes]
+            )
+            imported = self._conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0] - before
+            self._set_meta("migrated_from", str(json_path))
+        return imported
+
+
+if __name__ == "__main__":
+    import sys
+
+    source = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("data/notes.json")
+    store = NoteStore(legacy_json=None)
+    count = store.migrate_from_json(source)
+    print(f"✅ Imported {count} notes from {source} into {store.db_path}")
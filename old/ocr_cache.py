@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+SB Notes Transcription Cache
+Persistent, size-bounded LRU cache of vision OCR results keyed by PDF content.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transcriptions (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transcriptions_last_access ON transcriptions (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_version(prompt: str) -> str:
+    """Short stable identifier for a prompt, so prompt edits invalidate old entries."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+class TranscriptionCache:
+    """Vision transcription cache stored in SQLite with LRU eviction by total text size."""
+
+    def __init__(self, db_path: Path = Path("data/ocr_cache.db"), max_bytes: int = DEFAULT_MAX_BYTES):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(content_hash: str, model: str, prompt: str) -> str:
+        """Cache key from the PDF hash, model name and prompt version."""
+        return f"{content_hash}:{model}:{prompt_version(prompt)}"
+
+    def _bump(self, name: str, amount: int = 1):
+        """Increment a persistent counter (caller commits)."""
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached transcription for key, or None on a miss."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT text FROM transcriptions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._bump("misses")
+                return None
+            self._conn.execute("UPDATE transcriptions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._bump("hits")
+            return row[0]
+
+    def put(self, key: str, text: str):
+        """Store a transcription and evict least recently used entries over the size budget."""
+        now = time.time()
+        size = len(text.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO transcriptions (key, text, size, created_at, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET text = excluded.text, size = excluded.size, "
+                "last_access = excluded.last_access",
+                (key, text, size, now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes (caller commits)."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM transcriptions ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM transcriptions WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._bump("evictions", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters plus current entry count and size."""
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcriptions"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size
+        }
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+SB Notes Combined PDF Builder
+Incrementally maintains <class>_combined_notes.pdf. A manifest next to the
+output records which notes and divider pages make up the current file; when
+notes were only added at the end, the existing combined file is reused and
+just the new sections are appended. Divider pages are cached by a hash of
+their content, so they are rendered with fpdf once per distinct divider.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import fpdf
+import PyPDF2
+
+from metrics import span
+
+MANIFEST_VERSION = 1
+
+
+def divider_hash(note: Dict, day_number: int) -> str:
+    """Hash of everything rendered on a note's divider page."""
+    analysis = note.get("analysis", {})
+    payload = json.dumps([
+        MANIFEST_VERSION,
+        day_number,
+        note["class_name"],
+        note["note_type"],
+        note["upload_date"],
+        analysis.get("summary", "No summary available"),
+        (analysis.get("key_topics") or [])[:5]
+    ], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_divider_page(note: Dict, day_number: int, divider_path: Path) -> Path:
+    """Create a divider page for the combined PDF."""
+    pdf = fpdf.FPDF()
+    pdf.add_page()
+    pdf.set_font('helvetica', 'B', 16)
+
+    # Title
+    pdf.cell(0, 20, f"Day {day_number} Notes: {note['class_name']}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT, align='C')
+    pdf.ln(10)
+
+    # Note type and date
+    pdf.set_font('helvetica', '', 12)
+    pdf.cell(0, 10, f"Type: {note['note_type']}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+    pdf.cell(0, 10, f"Date: {datetime.fromisoformat(note['upload_date']).strftime('%Y-%m-%d %H:%M')}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+    pdf.ln(10)
+
+    # AI analysis summary
+    analysis = note['analysis']
+    pdf.cell(0, 10, "AI Analysis Summary:", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+    pdf.set_font('helvetica', '', 10)
+
+    summary = analysis.get('summary', 'No summary available')
+    # Wrap text to fit page width
+    for line in [summary[i:i+80] for i in range(0, len(summary), 80)]:
+        pdf.cell(0, 8, line, new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+
+    pdf.ln(10)
+
+    # Key topics
+    if analysis.get('key_topics'):
+        pdf.set_font('helvetica', 'B', 12)
+        pdf.cell(0, 10, "Key Topics:", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+        pdf.set_font('helvetica', '', 10)
+        for topic in analysis['key_topics'][:5]:  # Limit to 5 topics
+            pdf.cell(0, 8, f"- {topic}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
+
+    pdf.output(str(divider_path))
+    return divider_path
+
+
+def _file_signature(path: Path) -> Optional[List[int]]:
+    """Cheap change detector for a source PDF: size and mtime."""
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class CombinedPdfBuilder:
+    """Builds per-class combined PDFs, appending to the previous build when possible."""
+
+    def __init__(self, generated_dir: Path = Path("generated_pdfs"),
+                 on_warning: Optional[Callable[[str], None]] = None):
+        self.generated_dir = Path(generated_dir)
+        self.divider_dir = self.generated_dir / "dividers"
+        self.divider_dir.mkdir(parents=True, exist_ok=True)
+        self.on_warning = on_warning or (lambda message: None)
+
+    def output_path(self, class_name: str) -> Path:
+        return self.generated_dir / f"{class_name}_combined_notes.pdf"
+
+    def _manifest_path(self, class_name: str) -> Path:
+        return self.generated_dir / f"{class_name}_combined_notes.manifest.json"
+
+    def _load_manifest(self, class_name: str) -> Optional[Dict]:
+        path = self._manifest_path(class_name)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+    def _save_manifest(self, class_name: str, sections: List[Dict], output: Path):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "sections": sections,
+            "output": _file_signature(output)
+        }
+        path = self._manifest_path(class_name)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _divider(self, note: Dict, day_number: int, digest: str) -> Path:
+        """Cached divider PDF for a note, rendered on first use."""
+        path = self.divider_dir / f"{digest}.pdf"
+        if not path.exists():
+            tmp_path = path.with_suffix(".tmp")
+            render_divider_page(note, day_number, tmp_path)
+            os.replace(tmp_path, path)
+        return path
+
+    def _sections(self, notes: List[Dict]) -> List[Dict]:
+        """Describe each section (divider + note PDF) of the desired output."""
+        sections = []
+        for day_number, note in enumerate(notes, 1):
+            sections.append({
+                "note_id": note["id"],
+                "divider": divider_hash(note, day_number),
+                "file_path": note["file_path"],
+                "file": _file_signature(Path(note["file_path"]))
+            })
+        return sections
+
+    def _reusable_sections(self, class_name: str, sections: List[Dict], output: Path) -> Optional[int]:
+        """Number of leading sections the existing output already holds, or None if it can't be reused."""
+        manifest = self._load_manifest(class_name)
+        if (
+            manifest is None
+            or not output.exists()
+            or manifest.get("output") != _file_signature(output)
+            or manifest["sections"] != sections[:len(manifest["sections"])]
+        ):
+            return None
+        return len(manifest["sections"])
+
+    def is_up_to_date(self, class_name: str, notes: List[Dict]) -> bool:
+        """Whether the existing combined PDF already matches notes."""
+        output = self.output_path(class_name)
+        sections = self._sections(notes)
+        return self._reusable_sections(class_name, sections, output) == len(sections)
+
+    def build(self, class_name: str, notes: List[Dict], force: bool = False) -> Tuple[Path, str]:
+        """Bring the class's combined PDF up to date.
+
+        notes must be in presentation order (oldest first). Returns the output
+        path and what happened: "unchanged", "appended" or "rebuilt".
+        """
+        with span("pdf_merge", notes=len(notes)) as attrs:
+            output, mode = self._build(class_name, notes, force)
+            attrs["mode"] = mode
+        return output, mode
+
+    def _build(self, class_name: str, notes: List[Dict], force: bool) -> Tuple[Path, str]:
+        output = self.output_path(class_name)
+        sections = self._sections(notes)
+
+        reusable = None if force else self._reusable_sections(class_name, sections, output)
+
+        if reusable == len(sections):
+            return output, "unchanged"
+
+        merger = PyPDF2.PdfMerger()
+        if reusable:
+            # Existing prefix is still valid: start from the previous output and append
+            merger.append(str(output))
+            start = reusable
+            mode = "appended"
+        else:
+            start = 0
+            mode = "rebuilt"
+
+        for day_number, (note, section) in enumerate(zip(notes[start:], sections[start:]), start + 1):
+            # Add divider page
+            merger.append(str(self._divider(note, day_number, section["divider"])))
+
+            # Add actual note PDF
+            if section["file"] is not None:
+                merger.append(section["file_path"])
+            else:
+                self.on_warning(f"Original PDF not found for {note['id']}")
+
+        # Write to a temp file so a failed build never clobbers the previous output
+        tmp_output = output.with_suffix(".tmp")
+        with open(tmp_output, "wb") as output_file:
+            merger.write(output_file)
+        merger.close()
+        os.replace(tmp_output, output)
+
+        self._save_manifest(class_name, sections, output)
+        return output, mode
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+SB Notes PDF Text Extraction
+Reads the PyPDF2 text layer of a PDF page by page. A few evenly spaced pages
+are sampled first to classify the file as text, scanned or mixed: scanned
+files stop there (every page goes to vision anyway), while large text files
+are extracted in parallel page batches across worker processes. Every page
+records how long its extraction took.
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import PyPDF2
+
+# Pages whose text layer is shorter than this are treated as scanned/handwritten
+MIN_PAGE_CHARS = 50
+SAMPLE_PAGES = 5
+# Below this many pages the process round trip costs more than it saves
+PARALLEL_MIN_PAGES = 40
+PAGES_PER_BATCH = 16
+MAX_WORKERS = 8
+
+TEXT, SCANNED, MIXED = "text", "scanned", "mixed"
+
+
+@dataclass
+class PageText:
+    """Text layer of one page (1-based) and the seconds spent extracting it."""
+    page: int
+    text: str
+    seconds: float
+    extracted: bool = True
+
+
+@dataclass
+class PdfText:
+    """Per-page text layer of a PDF plus its sampled classification."""
+    kind: str
+    pages: List[PageText] = field(default_factory=list)
+    parallel: bool = False
+
+    @property
+    def text(self) -> str:
+        return "\n".join(page.text for page in self.pages if page.text.strip())
+
+    def thin_pages(self, min_chars: int = MIN_PAGE_CHARS) -> List[int]:
+        return [page.page for page in self.pages if len(page.text.strip()) < min_chars]
+
+    @property
+    def seconds(self) -> float:
+        return sum(page.seconds for page in self.pages)
+
+    def slowest(self) -> Optional[PageText]:
+        return max(self.pages, key=lambda page: page.seconds, default=None)
+
+
+def sample_indexes(page_count: int, samples: int = SAMPLE_PAGES) -> List[int]:
+    """Evenly spaced 0-based page indexes, always including the first and last page."""
+    if page_count <= samples:
+        return list(range(page_count))
+    step = (page_count - 1) / (samples - 1)
+    return sorted({round(step * i) for i in range(samples)})
+
+
+def classify(texts: List[str], min_chars: int = MIN_PAGE_CHARS) -> str:
+    """TEXT if every sampled page has a usable text layer, SCANNED if none does, else MIXED."""
+    thin = sum(1 for text in texts if len(text.strip()) < min_chars)
+    if thin == 0:
+        return TEXT
+    if thin == len(texts):
+        return SCANNED
+    return MIXED
+
+
+def _extract_pages(reader: PyPDF2.PdfReader, indexes: List[int]) -> List[Tuple[int, str, float]]:
+    results = []
+    for index in indexes:
+        started = time.perf_counter()
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception:
+            # One damaged page shouldn't lose the rest; an empty page goes to vision
+            text = ""
+        results.append((index, text, time.perf_counter() - started))
+    return results
+
+
+def _extract_batch(pdf_path: str, indexes: List[int]) -> List[Tuple[int, str, float]]:
+    """Worker-process entry point: open the PDF and extract a batch of pages."""
+    with open(pdf_path, "rb") as f:
+        return _extract_pages(PyPDF2.PdfReader(f), indexes)
+
+
+def usable_cpus() -> int:
+    """CPUs this process may run on (respects affinity masks and container limits where visible)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Process-wide extraction pool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=min(MAX_WORKERS, usable_cpus()))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def extract_pdf_text(pdf_path: Path, reader: Optional[PyPDF2.PdfReader] = None,
+                     min_chars: int = MIN_PAGE_CHARS, parallel: bool = True) -> PdfText:
+    """Extract a PDF's text layer page by page.
+
+    Pass an open reader to reuse it (the sample and sequential pages are read
+    from it). parallel=False keeps everything in this process, for callers
+    already running inside a worker pool. Raises PyPDF2 errors if the file
+    cannot be opened at all.
+    """
+    if reader is None:
+        with open(pdf_path, "rb") as f:
+            return extract_pdf_text(pdf_path, PyPDF2.PdfReader(f), min_chars, parallel)
+    page_count = len(reader.pages)
+
+    extracted = {index: (text, seconds) for index, text, seconds in _extract_pages(reader, sample_indexes(page_count))}
+    kind = classify([text for text, _ in extracted.values()], min_chars) if extracted else SCANNED
+
+    remaining = [index for index in range(page_count) if index not in extracted]
+    used_pool = False
+    if kind == SCANNED:
+        # Every sampled page is an image: the rest are sent to vision without reading them
+        remaining = []
+    elif parallel and page_count >= PARALLEL_MIN_PAGES and usable_cpus() > 1:
+        # Each batch re-opens the file, so aim for about two batches per worker
+        workers = min(MAX_WORKERS, usable_cpus())
+        size = max(PAGES_PER_BATCH, math.ceil(len(remaining) / (workers * 2)))
+        batches = [remaining[start:start + size] for start in range(0, len(remaining), size)]
+        try:
+            pool = _get_pool()
+            for results in pool.map(_extract_batch, [str(pdf_path)] * len(batches), batches):
+                extracted.update((index, (text, seconds)) for index, text, seconds in results)
+            remaining = []
+            used_pool = True
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); finish here and start a fresh pool next time
+            _reset_pool()
+            remaining = [index for index in remaining if index not in extracted]
+    for index, text, seconds in _extract_pages(reader, remaining):
+        extracted[index] = (text, seconds)
+
+    pages = [
+        PageText(index + 1, *extracted[index]) if index in extracted
+        else PageText(index + 1, "", 0.0, extracted=False)
+        for index in range(page_count)
+    ]
+    return PdfText(kind=kind, pages=pages, parallel=used_pool)
@@ -39,7 +39,8 @@ def main():
         subprocess.run([
             sys.executable, "-m", "streamlit", "run", "sbnotes_web.py",
             "--server.port", "8501",
-            "--server.headless", "true"
+            "--server.headless", "true",
+            "--server.enableStaticServing", "true"
         ])
     except KeyboardInterrupt:
         print("\n👋 Web server stopped. Goodbye!")
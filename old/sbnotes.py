@@ -5,33 +5,49 @@ A terminal-based tool for uploading, analyzing, and organizing PDF notes with AI
 """
 
 import os
-import json
-import shutil
-import base64
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
-import PyPDF2
+from typing import Callable, Dict, List, Optional
 from rich.console import Console
-from rich.prompt import Prompt, Confirm
+from rich.prompt import Prompt, Confirm, IntPrompt
 from rich.table import Table
 from rich.panel import Panel
 from rich.text import Text
 import anthropic
+import click
 from dotenv import load_dotenv
-import fpdf
 from dateutil import parser
+from batch_analysis import BatchLog, BatchReanalyzer
+from analysis import KNOWN_ANALYSIS_MODELS, analyze_text, needs_recovery, recover_analysis
+from model_gateway import VISION_MODEL, VISION_PROMPT, build_vision_request, get_gateway
+from pdf_builder import CombinedPdfBuilder
+from note_store import NoteStore, make_note_entry
+from search_index import SearchIndex
+from vector_index import VectorIndex
+from text_store import TextStore
+from transcription import transcribe_pdf_pages
+from ocr_cache import TranscriptionCache, file_sha256
+from ingest import BulkIngester, expand_inputs
+from streaming import encode_file_base64, get_upload_budget, request_bytes
+from upload_store import DEFAULT_GRACE_SECONDS, UploadStore
+from scan_normalizer import ScanNormalizer
+from study import QUIZ_QUESTIONS, StudyAssistant
+from jobs import JobQueue
+from metrics import TRACE_PATH, read_records, serve_metrics, span, summarize
 
 # Load environment variables
 load_dotenv()
 
 class NoteManager:
-    def __init__(self):
+    def __init__(self, analysis_model: str = "claude-opus-4-1-20250805"):
         self.console = Console()
         self.data_dir = Path("data")
         self.uploads_dir = Path("uploads")
         self.generated_dir = Path("generated_pdfs")
         self.notes_file = self.data_dir / "notes.json"
+        self.analysis_model = analysis_model
+        self.db_file = self.data_dir / "notes.db"
         
         # Initialize directories
         self._init_directories()
@@ -42,10 +58,64 @@ class NoteManager:
             self.console.print("[red]Error: ANTHROPIC_API_KEY not found in environment variables[/red]")
             exit(1)
         
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # Shared gateway: pooled async client with rate limiting and retries
+        self.gateway = get_gateway(api_key)
         
-        # Load existing notes
-        self.notes = self._load_notes()
+        # Open the note store (imports notes.json on first run)
+        self.store = NoteStore(self.db_file, legacy_json=self.notes_file)
+        
+        # Cache of vision transcriptions keyed by PDF content
+        self.ocr_cache = TranscriptionCache(self.data_dir / "ocr_cache.db")
+        
+        # Raw per-chunk analysis responses, keyed by chunk text and model
+        self.analysis_cache = TranscriptionCache(self.data_dir / "analysis_cache.db")
+        
+        # Full transcriptions, compressed and stored out-of-line from note metadata
+        self.text_store = TextStore(self.data_dir / "texts")
+        
+        # Uploaded PDFs, stored once per distinct file and shared by notes
+        self.upload_store = UploadStore(self.uploads_dir)
+        
+        # Contrast-stretched, binarized, downsampled copies of scans, sent to vision instead of the originals
+        self.scan_normalizer = ScanNormalizer.from_env(self.data_dir / "normalized")
+        
+        # Incremental combined-PDF builder with cached divider pages
+        self.pdf_builder = CombinedPdfBuilder(
+            self.generated_dir,
+            on_warning=lambda message: self.console.print(f"[yellow]Warning: {message}[/yellow]")
+        )
+        
+        # Full-text index; rebuilt from the store if it has drifted (e.g. first run)
+        self.search_index = SearchIndex(self.data_dir / "search_index.db")
+        if self.search_index.count() != self.store.count_notes():
+            self.rebuild_search_index()
+        
+        # Embedding index for semantic search and related notes; same drift check
+        self.vector_index = VectorIndex(self.data_dir / "vector_index.db")
+        if self.vector_index.count() != self.store.count_notes():
+            self.vector_index.rebuild(self.store.list_notes(), self._load_full_text)
+        
+        # Ask/quiz over retrieved note chunks; question sets cached per note content
+        self.study = StudyAssistant(self.gateway, self.store, self.vector_index, self._load_full_text,
+                                    TranscriptionCache(self.data_dir / "study_cache.db"))
+    
+    def rebuild_search_index(self) -> int:
+        """Re-index every stored note."""
+        return self.search_index.rebuild(self.store.list_notes(), self._load_full_text)
+    
+    def reindex_note(self, note: Dict):
+        """(Re-)add one stored note to both indexes; safe to repeat."""
+        text = self._load_full_text(note)
+        self.search_index.index_note(note, text)
+        self.vector_index.index_note(note, text)
+    
+    def _load_full_text(self, note: Dict) -> str:
+        """Load a note's full transcription, falling back to the preview for older notes."""
+        if note.get("text_hash"):
+            text = self.text_store.get(note["text_hash"])
+            if text is not None:
+                return text
+        return note.get("text_preview", "")
     
     def _init_directories(self):
         """Initialize necessary directories."""
@@ -53,156 +123,178 @@ class NoteManager:
         self.uploads_dir.mkdir(exist_ok=True)
         self.generated_dir.mkdir(exist_ok=True)
     
-    def _load_notes(self) -> Dict:
-        """Load existing notes from JSON file."""
-        if self.notes_file.exists():
-            try:
-                with open(self.notes_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                self.console.print("[yellow]Warning: Corrupted notes file, starting fresh[/yellow]")
-        return {"notes": [], "classes": {}}
-    
-    def _save_notes(self):
-        """Save notes to JSON file."""
-        with open(self.notes_file, 'w') as f:
-            json.dump(self.notes, f, indent=2)
-    
-    def _extract_text_from_pdf(self, pdf_path: Path) -> str:
-        """Extract text from PDF file using OCR with vision capabilities."""
+    def _extract_text_from_pdf(self, pdf_path: Path, content_hash: Optional[str] = None) -> str:
+        """Extract text from PDF file using OCR with vision capabilities.
+        
+        Raises if the model could not transcribe every scanned page, rather than
+        returning text with failure markers that would be stored as the note.
+        """
         try:
-            # First try traditional text extraction
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        text += page_text + "\n"
-                
-                # If we got substantial text, return it
-                if len(text.strip()) > 50:
-                    return text
-            
-            # If traditional extraction failed or got minimal text, use vision OCR
-            self.console.print("[yellow]Traditional text extraction failed. Using AI vision to read scanned notes...[/yellow]")
-            return self._extract_text_with_vision(pdf_path)
-            
+            # Keep each page's text layer; only thin (scanned) pages go to vision, in parallel chunks
+            transcription = transcribe_pdf_pages(
+                pdf_path,
+                self.gateway,
+                cache=self.ocr_cache,
+                on_status=lambda message: self.console.print(f"[yellow]{message}[/yellow]"),
+                content_hash=content_hash,
+                normalizer=self.scan_normalizer
+            )
         except Exception as e:
             self.console.print(f"[red]Error with traditional extraction: {e}[/red]")
             self.console.print("[yellow]Falling back to AI vision OCR...[/yellow]")
-            return self._extract_text_with_vision(pdf_path)
+            return self._extract_text_with_vision(pdf_path, content_hash)
+        
+        if transcription.failed_pages:
+            # The chunks that did succeed are cached, so trying again only resends these pages
+            raise RuntimeError(f"Transcription failed for pages {', '.join(map(str, transcription.failed_pages))}")
+        if transcription.vision_pages:
+            self.console.print(f"[green]Transcribed {transcription.vision_pages} scanned pages with AI vision[/green]")
+        return transcription.text
     
-    def _extract_text_with_vision(self, pdf_path: Path) -> str:
+    def _extract_text_with_vision(self, pdf_path: Path, content_hash: Optional[str] = None) -> str:
         """Extract text from scanned PDF using Claude's PDF document support."""
+        # Re-uploads of the same file reuse the earlier transcription
+        content_hash = content_hash or file_sha256(pdf_path)
+        cache_key = TranscriptionCache.make_key(content_hash, VISION_MODEL, VISION_PROMPT)
+        cached = self.ocr_cache.get(cache_key)
+        if cached is not None:
+            self.console.print("[green]Using cached transcription for this PDF[/green]")
+            return cached
+        
         try:
             self.console.print("[yellow]Uploading PDF directly to Claude for analysis...[/yellow]")
             
-            # Read the PDF file and convert to base64
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_data = pdf_file.read()
-                pdf_base64 = base64.b64encode(pdf_data).decode('utf-8')
+            # Send the normalized copy of a scan when there is one; the cache key stays the original's
+            send_path = pdf_path
+            if self.scan_normalizer is not None:
+                send_path = self.scan_normalizer.normalize(pdf_path, content_hash)
             
-            # Use Claude's PDF document support to read the entire PDF
-            message = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=4000,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "document",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "application/pdf",
-                                    "data": pdf_base64
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": "Please read and transcribe all the text content from this PDF. This appears to be handwritten or scanned notes. Extract all text, mathematical formulas, diagrams descriptions, and any other written content from all pages. Be thorough and accurate in your transcription. Organize the content by pages if possible."
-                            }
-                        ]
-                    }
-                ]
-            )
+            # Encode into one buffer (never holding the raw file and its base64 together), reserving
+            # every copy the request makes of it from the upload byte budget
+            with get_upload_budget().reserve(request_bytes(send_path.stat().st_size)):
+                with span("encode"):
+                    pdf_base64 = encode_file_base64(send_path)
+                
+                # Use Claude's PDF document support to read the entire PDF
+                with span("vision", pages="all"):
+                    message = self.gateway.create(**build_vision_request(pdf_base64))
+                del pdf_base64
             
-            return message.content[0].text
+            text = message.content[0].text
+            self.ocr_cache.put(cache_key, text)
+            return text
             
         except Exception as e:
             self.console.print(f"[red]Error with PDF document processing: {e}[/red]")
-            return f"PDF document processing failed: {str(e)}"
+            raise
     
 
     
     def _analyze_notes_with_ai(self, text: str, note_type: str, class_name: str) -> Dict:
-        """Analyze notes using Anthropic Claude."""
-        prompt = f"""
-        Analyze the following {note_type} for {class_name}. This content was extracted from scanned/handwritten notes using AI vision, so it may contain transcription artifacts.
-        
-        Please provide:
-        1. A concise summary (2-3 sentences)
-        2. Key topics/concepts covered
-        3. Important formulas, definitions, or concepts
-        4. Difficulty level (Beginner/Intermediate/Advanced)
-        5. Estimated study time needed
-        6. Related topics that might be connected
-        7. Content quality assessment (how well the notes were transcribed)
-        
-        Notes content:
-        {text[:8000]}  # Limit to avoid token limits
-        
-        Please format your response as JSON with these keys:
-        - summary
-        - key_topics
-        - important_concepts
-        - difficulty_level
-        - estimated_study_time
-        - related_topics
-        - transcription_quality
-        """
+        """Analyze notes using Anthropic Claude.
         
+        Raises when the model can't be reached, so nothing is saved with a failed analysis.
+        """
         try:
-            message = self.client.messages.create(
-                model="claude-opus-4-1-20250805",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
+            # Long notes are analyzed in page-aligned chunks and merged; chunk results are cached
+            return analyze_text(
+                self.gateway,
+                text,
+                note_type,
+                class_name,
+                model=self.analysis_model,
+                cache=self.analysis_cache
             )
-            
-            # Try to parse JSON response
-            try:
-                response_text = message.content[0].text.strip()
-                # Remove code block markers if present
-                if response_text.startswith("```json"):
-                    response_text = response_text[7:]
-                if response_text.endswith("```"):
-                    response_text = response_text[:-3]
-                response_text = response_text.strip()
-                return json.loads(response_text)
-            except json.JSONDecodeError:
-                # If JSON parsing fails, create a structured response
-                return {
-                    "summary": message.content[0].text[:200] + "...",
-                    "key_topics": ["Extracted from AI analysis"],
-                    "important_concepts": ["See full analysis"],
-                    "difficulty_level": "Unknown",
-                    "estimated_study_time": "Unknown",
-                    "related_topics": [],
-                    "transcription_quality": "Unknown"
-                }
                 
         except Exception as e:
             self.console.print(f"[red]Error analyzing notes with AI: {e}[/red]")
-            return {
-                "summary": "AI analysis failed",
-                "key_topics": [],
-                "important_concepts": [],
-                "difficulty_level": "Unknown",
-                "estimated_study_time": "Unknown",
-                "related_topics": [],
-                "transcription_quality": "Failed"
-            }
+            raise
+    
+    def backfill_analyses(self, dry_run: bool = False) -> Dict[str, int]:
+        """Recover structured analyses for notes stored with the unparsed-response placeholder.
+        
+        Uses only local data: cached raw model responses for the note's full text
+        when available, otherwise the raw response (or clipped summary) kept in the note.
+        """
+        counts = {"from_cache": 0, "reparsed": 0, "unrecoverable": 0}
+        for note in self.store.list_notes():
+            if not needs_recovery(note["analysis"]):
+                continue
+            
+            analysis, source = None, "reparsed"
+            text = self.text_store.get(note["text_hash"]) if note.get("text_hash") else None
+            if text:
+                for model in dict.fromkeys((self.analysis_model,) + KNOWN_ANALYSIS_MODELS):
+                    cached = analyze_text(None, text, note["note_type"], note["class_name"], model,
+                                          cache=self.analysis_cache)
+                    if cached is not None and not needs_recovery(cached):
+                        analysis, source = cached, "from_cache"
+                        break
+            if analysis is None:
+                analysis = recover_analysis(note["analysis"])
+            
+            if analysis is None:
+                counts["unrecoverable"] += 1
+                self.console.print(f"[red]unrecoverable[/red] {note['id']}")
+                continue
+            counts[source] += 1
+            self.console.print(f"[green]{source:>13}[/green] {note['id']}: {analysis['summary'][:60]}")
+            if not dry_run:
+                self.store.update_analysis(note["id"], analysis)
+                note["analysis"] = analysis
+                text = text or self._load_full_text(note)
+                self.search_index.index_note(note, text)
+                self.vector_index.index_note(note, text)
+        return counts
+    
+    def reanalyze_notes(self, class_name: Optional[str] = None, batch: bool = True,
+                        resume: Optional[str] = None, poll_interval: float = 30.0,
+                        incomplete_only: bool = False) -> int:
+        """Re-run AI analysis over the library (or one class) and write the results back in bulk.
+        
+        Batch mode goes through the Message Batches API and can be resumed by batch id.
+        incomplete_only limits it to notes whose stored analysis is a placeholder.
+        """
+        notes = self.store.list_notes(class_name=class_name)
+        if incomplete_only:
+            notes = [note for note in notes if needs_recovery(note["analysis"])]
+        status = lambda message: self.console.print(f"[yellow]{message}[/yellow]")
+        
+        if batch:
+            reanalyzer = BatchReanalyzer(
+                anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY")),
+                self.analysis_cache,
+                BatchLog(self.data_dir / "batches.db"),
+                poll_interval=poll_interval,
+                on_status=status
+            )
+            if resume:
+                reanalyzer.collect(resume)
+            results = reanalyzer.run(notes, self._load_full_text, self.analysis_model)
+        else:
+            results = {}
+            for note in notes:
+                status(f"Analyzing {note['id']}...")
+                try:
+                    results[note["id"]] = analyze_text(
+                        self.gateway, self._load_full_text(note), note["note_type"], note["class_name"],
+                        model=self.analysis_model, cache=self.analysis_cache
+                    )
+                except Exception as e:
+                    self.console.print(f"[red]Error analyzing {note['id']}: {e}[/red]")
+        
+        updated = self.store.update_analyses(results)
+        reindexed = []
+        for note in notes:
+            if note["id"] in results:
+                note["analysis"] = results[note["id"]]
+                reindexed.append((note, self._load_full_text(note)))
+        self.search_index.index_notes(reindexed)
+        self.vector_index.index_notes(reindexed)
+        
+        if len(results) < len(notes):
+            self.console.print(f"[red]{len(notes) - len(results)} notes did not complete; run again to retry them[/red]")
+        return updated
     
     def upload_notes(self):
         """Upload and process a new PDF note."""
@@ -227,72 +319,167 @@ class NoteManager:
             choices=["Notes", "Homework", "Study Prep", "Exam", "Other"]
         )
         
-        # Extract text from PDF
-        self.console.print("[yellow]Extracting text from PDF...[/yellow]")
-        text = self._extract_text_from_pdf(pdf_path)
+        try:
+            note_entry = self.process_pdf(pdf_path, class_name, note_type)
+        except Exception as e:
+            # Nothing was saved; cached transcriptions make trying again cheap
+            self.console.print(f"[red]Error: {e}[/red]")
+            return
+        
+        self.console.print(f"[green]✅ Successfully uploaded notes for {class_name}[/green]")
+        self.console.print(f"[blue]Summary: {note_entry['analysis'].get('summary', 'No summary available')}[/blue]")
+    
+    def process_pdf(self, pdf_path: Path, class_name: str, note_type: str,
+                    timestamp: Optional[str] = None, in_uploads: bool = False,
+                    on_stage: Optional[Callable[[str, float], None]] = None,
+                    content_hash: Optional[str] = None) -> Dict:
+        """Extract, analyze, and store one PDF. Shared by the menu upload and background jobs.
+        
+        in_uploads means pdf_path was already saved under uploads/ and should not be copied again.
+        content_hash is the file's sha256 when the caller computed it while saving the upload.
+        """
+        stage = on_stage or (lambda name, progress: None)
+        # Hashed once here: it keys the transcription caches and names the stored upload
+        content_hash = content_hash or file_sha256(pdf_path)
+        
+        with span("upload", class_name=class_name, note_type=note_type):
+            # Extract text from PDF
+            stage("extracting", 0.1)
+            self.console.print("[yellow]Extracting text from PDF...[/yellow]")
+            with span("extract"):
+                text = self._extract_text_from_pdf(pdf_path, content_hash)
+            
+            if not text.strip():
+                raise ValueError("Could not extract text from PDF")
+            
+            # Analyze with AI
+            stage("analyzing", 0.6)
+            self.console.print("[yellow]Analyzing notes with AI...[/yellow]")
+            with span("analyze", chars=len(text)):
+                analysis = self._analyze_notes_with_ai(text, note_type, class_name)
+            
+            # Create note entry
+            stage("saving", 0.9)
+            timestamp = timestamp or datetime.now().isoformat()
+            note_id = f"{class_name}_{timestamp}"
+            
+            with span("save"):
+                # Store the PDF by content; a duplicate of an earlier upload is not copied again
+                if in_uploads:
+                    upload_path = pdf_path
+                else:
+                    _, upload_path = self.upload_store.put_file(pdf_path, content_hash)
+                
+                # Create note entry
+                text_hash = self.text_store.put(text)
+                note_entry = make_note_entry(note_id, class_name, note_type, timestamp, upload_path, analysis, text, text_hash)
+                
+                # Save note (class stats are derived from the store)
+                self.store.add_note(note_entry)
+            
+            with span("index"):
+                self.search_index.index_note(note_entry, text)
+                self.vector_index.index_note(note_entry, text)
+        return note_entry
+    
+    def migrate_uploads(self, dry_run: bool = False) -> Dict[str, int]:
+        """Move notes' PDFs from uploads/<note_id>.pdf into the content-addressed store.
         
-        if not text.strip():
-            self.console.print("[red]Error: Could not extract text from PDF[/red]")
+        Files are linked in first, notes repointed in one transaction, and only then are
+        the old files removed, so an interrupted migration can simply be run again.
+        """
+        counts = {"moved": 0, "deduplicated": 0, "missing": 0, "already_stored": 0}
+        moves, old_files, seen = {}, [], set()
+        for file_path in self.store.file_references():
+            path = Path(file_path)
+            if self.upload_store.is_object(path):
+                counts["already_stored"] += 1
+                continue
+            if not path.exists():
+                counts["missing"] += 1
+                continue
+            digest = file_sha256(path)
+            duplicate = digest in seen or self.upload_store.exists(digest)
+            counts["deduplicated" if duplicate else "moved"] += 1
+            seen.add(digest)
+            if not dry_run:
+                _, object_path = self.upload_store.link_in(path, digest)
+                moves[file_path] = str(object_path)
+                old_files.append(path)
+        
+        if moves:
+            self.store.update_file_paths(moves)
+            for path in old_files:
+                path.unlink(missing_ok=True)
+        return counts
+    
+    def collect_upload_garbage(self, grace_seconds: float = DEFAULT_GRACE_SECONDS,
+                               dry_run: bool = False) -> List[Path]:
+        """Remove stored PDFs that no note or pending upload job references."""
+        referenced = {Path(file_path).resolve() for file_path in self.store.file_references()}
+        jobs_db = self.data_dir / "jobs.db"
+        if jobs_db.exists():
+            referenced.update(Path(file_path).resolve() for file_path in JobQueue(jobs_db).active_files())
+        return self.upload_store.collect_garbage(referenced, grace_seconds, dry_run)
+    
+    def ingest_notes(self, target: str, class_name: str, note_type: str, concurrency: int = 4,
+                     chunk_size: int = 16):
+        """Bulk-ingest a directory or glob of PDFs without prompting."""
+        files = expand_inputs(target)
+        if not files:
+            self.console.print(f"[yellow]No PDF files found for {target}[/yellow]")
             return
         
-        # Analyze with AI
-        self.console.print("[yellow]Analyzing notes with AI...[/yellow]")
-        analysis = self._analyze_notes_with_ai(text, note_type, class_name)
-        
-        # Create note entry
-        timestamp = datetime.now().isoformat()
-        note_id = f"{class_name}_{timestamp}"
-        
-        # Copy PDF to uploads directory
-        upload_path = self.uploads_dir / f"{note_id}.pdf"
-        shutil.copy2(pdf_path, upload_path)
-        
-        # Create note entry
-        note_entry = {
-            "id": note_id,
-            "class_name": class_name,
-            "note_type": note_type,
-            "upload_date": timestamp,
-            "file_path": str(upload_path),
-            "analysis": analysis,
-            "text_preview": text[:500] + "..." if len(text) > 500 else text
-        }
-        
-        # Add to notes list
-        self.notes["notes"].append(note_entry)
-        
-        # Update class information
-        if class_name not in self.notes["classes"]:
-            self.notes["classes"][class_name] = {
-                "total_notes": 0,
-                "note_types": {},
-                "last_updated": timestamp
-            }
-        
-        self.notes["classes"][class_name]["total_notes"] += 1
-        self.notes["classes"][class_name]["note_types"][note_type] = \
-            self.notes["classes"][class_name]["note_types"].get(note_type, 0) + 1
-        self.notes["classes"][class_name]["last_updated"] = timestamp
-        
-        # Save notes
-        self._save_notes()
+        self.console.print(Panel.fit(f"📥 Ingesting {len(files)} PDFs into {class_name}", style="bold blue"))
+        
+        status_styles = {"ingested": "green", "skipped": "blue", "failed": "red"}
+        
+        def on_progress(path: Path, status: str, detail: str):
+            if status in status_styles:
+                style = status_styles[status]
+                self.console.print(f"[{style}]{status:>8}[/{style}] {path}" + (f" - {detail[:80]}" if detail else ""))
+        
+        ingester = BulkIngester(
+            self.store,
+            self.upload_store,
+            vision_fn=self._extract_text_from_pdf,
+            analyze_fn=self._analyze_notes_with_ai,
+            search_index=self.search_index,
+            vector_index=self.vector_index,
+            text_store=self.text_store,
+            chunk_size=chunk_size,
+            model_concurrency=concurrency,
+            on_progress=on_progress
+        )
+        result = ingester.run(files, class_name, note_type)
         
-        self.console.print(f"[green]✅ Successfully uploaded notes for {class_name}[/green]")
-        self.console.print(f"[blue]Summary: {analysis.get('summary', 'No summary available')}[/blue]")
+        self.console.print(
+            f"[green]✅ Ingested {len(result.ingested)}[/green], "
+            f"[blue]skipped {len(result.skipped)}[/blue], "
+            f"[red]failed {len(result.failed)}[/red]"
+        )
+        
+        # Cache reads vs writes show how much of the static prompt prefix was reused
+        stats = self.gateway.stats
+        self.console.print(
+            f"[dim]Tokens: {stats['input_tokens']} input, {stats['output_tokens']} output; "
+            f"prompt cache {stats['cache_read_tokens']} read, {stats['cache_write_tokens']} written[/dim]"
+        )
     
     def search_notes(self):
         """Search through notes."""
         self.console.print(Panel.fit("🔍 Search Notes", style="bold green"))
         
         search_term = Prompt.ask("Enter search term")
+        mode = Prompt.ask("Search mode", choices=["keyword", "semantic"], default="keyword")
         
-        # Search in class names, note types, and AI analysis
-        results = []
-        for note in self.notes["notes"]:
-            searchable_text = f"{note['class_name']} {note['note_type']} {note['analysis'].get('summary', '')} {note['analysis'].get('key_topics', [])}"
-            
-            if search_term.lower() in searchable_text.lower():
-                results.append(note)
+        if mode == "semantic":
+            # Nearest notes in the local embedding index
+            ranked = self.vector_index.search(search_term, limit=10)
+        else:
+            # BM25-ranked search over class, type, transcription and AI analysis
+            ranked = self.search_index.search(search_term, limit=10)
+        results = self.store.get_notes([note_id for note_id, _ in ranked])
         
         if not results:
             self.console.print("[yellow]No notes found matching your search[/yellow]")
@@ -305,21 +492,86 @@ class NoteManager:
         table.add_column("Date", style="green")
         table.add_column("Summary", style="white")
         
-        for note in results[:10]:  # Limit to 10 results
+        for note in results:
             date = datetime.fromisoformat(note["upload_date"]).strftime("%Y-%m-%d %H:%M")
             summary = note["analysis"].get("summary", "No summary")[:100] + "..."
             table.add_row(note["class_name"], note["note_type"], date, summary)
         
         self.console.print(table)
     
+    def _ask_class(self, prompt: str) -> Optional[str]:
+        """Prompt for a known class name; Enter means all classes."""
+        classes = list(self.store.get_classes().keys())
+        if classes:
+            self.console.print(f"Classes: {', '.join(classes)}")
+        class_name = Prompt.ask(prompt, default="")
+        if class_name and class_name not in classes:
+            self.console.print(f"[yellow]Unknown class '{class_name}', using all classes[/yellow]")
+            return None
+        return class_name or None
+    
+    def ask_notes(self, question: Optional[str] = None, class_name: Optional[str] = None):
+        """Answer a question from the most relevant parts of the stored notes, streaming the reply."""
+        if question is None:
+            self.console.print(Panel.fit("💡 Ask About Your Notes", style="bold cyan"))
+            class_name = self._ask_class("Class to ask about (Enter for all)")
+            question = Prompt.ask("What should I explain")
+        
+        try:
+            sources, answer = self.study.ask(question, class_name)
+            if not sources:
+                self.console.print("[yellow]No matching notes found; answering from general knowledge[/yellow]")
+            self.console.print()
+            for delta in answer:
+                self.console.print(delta, end="", markup=False, highlight=False)
+            self.console.print("\n")
+        except Exception as e:
+            self.console.print(f"\n[red]Error answering question: {e}[/red]")
+            return
+        
+        for number, source in enumerate(sources, 1):
+            self.console.print(f"[dim][{number}] {source.label} · {source.score:.2f}[/dim]")
+    
+    def quiz_notes(self, class_name: Optional[str] = None, topic: Optional[str] = None,
+                   count: int = QUIZ_QUESTIONS):
+        """Run a practice quiz from a class's notes, revealing each answer on Enter."""
+        if class_name is None:
+            self.console.print(Panel.fit("📝 Practice Quiz", style="bold magenta"))
+            class_name = self._ask_class("Class to quiz on")
+            if class_name is None:
+                self.console.print("[red]Please choose a class[/red]")
+                return
+            topic = Prompt.ask("Topic (Enter for the latest notes)", default="") or None
+        
+        with self.console.status("[bold green]Preparing questions..."):
+            try:
+                questions = self.study.quiz(class_name, topic, count,
+                                            on_error=lambda message: self.console.print(f"[yellow]{message}[/yellow]"))
+            except Exception as e:
+                self.console.print(f"[red]Error generating questions: {e}[/red]")
+                return
+        if not questions:
+            self.console.print(f"[yellow]No practice questions available for {class_name}[/yellow]")
+            return
+        
+        for number, question in enumerate(questions, 1):
+            self.console.print(f"\n[bold]{number}. {question['question']}[/bold]")
+            for letter, choice in zip("ABCDEFGH", question.get("choices", [])):
+                self.console.print(f"   {letter}. {choice}")
+            Prompt.ask("[dim]Your answer (Enter to reveal)[/dim]", default="", show_default=False)
+            self.console.print(f"[green]Answer:[/green] {question['answer']}")
+            self.console.print(f"[dim]From {question['source']}[/dim]")
+    
     def view_notes(self):
         """View all notes with filtering options."""
         self.console.print(Panel.fit("📖 View Notes", style="bold yellow"))
         
-        if not self.notes["notes"]:
+        if not self.store.count_notes():
             self.console.print("[yellow]No notes uploaded yet[/yellow]")
             return
         
+        classes = self.store.get_classes()
+        
         # Show class overview
         table = Table(title="Classes Overview")
         table.add_column("Class", style="cyan")
@@ -327,7 +579,7 @@ class NoteManager:
         table.add_column("Note Types", style="green")
         table.add_column("Last Updated", style="white")
         
-        for class_name, class_info in self.notes["classes"].items():
+        for class_name, class_info in classes.items():
             note_types = ", ".join([f"{t}: {c}" for t, c in class_info["note_types"].items()])
             last_updated = datetime.fromisoformat(class_info["last_updated"]).strftime("%Y-%m-%d")
             table.add_row(class_name, str(class_info["total_notes"]), note_types, last_updated)
@@ -337,42 +589,50 @@ class NoteManager:
         # Ask for specific class to view
         class_name = Prompt.ask("Enter class name to view detailed notes (or press Enter to skip)")
         
-        if class_name and class_name in self.notes["classes"]:
-            self._view_class_notes(class_name)
+        if class_name and class_name in classes:
+            page_size = IntPrompt.ask("Notes per page", default=20)
+            self._view_class_notes(class_name, max(1, page_size))
     
-    def _view_class_notes(self, class_name: str):
-        """View detailed notes for a specific class."""
-        class_notes = [note for note in self.notes["notes"] if note["class_name"] == class_name]
-        
-        table = Table(title=f"Notes for {class_name}")
-        table.add_column("Type", style="cyan")
-        table.add_column("Date", style="magenta")
-        table.add_column("Summary", style="green")
-        table.add_column("Difficulty", style="yellow")
-        table.add_column("Study Time", style="white")
-        table.add_column("Quality", style="blue")
-        
-        for note in sorted(class_notes, key=lambda x: x["upload_date"], reverse=True):
-            date = datetime.fromisoformat(note["upload_date"]).strftime("%Y-%m-%d %H:%M")
-            summary = note["analysis"].get("summary", "No summary")[:80] + "..."
-            difficulty = note["analysis"].get("difficulty_level", "Unknown")
-            study_time = note["analysis"].get("estimated_study_time", "Unknown")
-            quality = note["analysis"].get("transcription_quality", "Unknown")
+    def _view_class_notes(self, class_name: str, page_size: int = 20):
+        """View detailed notes for a specific class, one page at a time."""
+        cursor = None
+        page = 1
+        while True:
+            class_notes, cursor = self.store.page_notes(class_name=class_name, after=cursor, limit=page_size)
             
-            table.add_row(note["note_type"], date, summary, difficulty, study_time, quality)
-        
-        self.console.print(table)
+            table = Table(title=f"Notes for {class_name} (page {page})")
+            table.add_column("Type", style="cyan")
+            table.add_column("Date", style="magenta")
+            table.add_column("Summary", style="green")
+            table.add_column("Difficulty", style="yellow")
+            table.add_column("Study Time", style="white")
+            table.add_column("Quality", style="blue")
+            
+            for note in class_notes:
+                date = datetime.fromisoformat(note["upload_date"]).strftime("%Y-%m-%d %H:%M")
+                summary = note["analysis"].get("summary", "No summary")[:80] + "..."
+                difficulty = note["analysis"].get("difficulty_level", "Unknown")
+                study_time = note["analysis"].get("estimated_study_time", "Unknown")
+                quality = note["analysis"].get("transcription_quality", "Unknown")
+                
+                table.add_row(note["note_type"], date, summary, difficulty, study_time, quality)
+            
+            self.console.print(table)
+            
+            if cursor is None or not Confirm.ask("Show more notes?", default=True):
+                break
+            page += 1
     
     def generate_class_pdf(self):
         """Generate a combined PDF for a class with page dividers."""
         self.console.print(Panel.fit("📄 Generate Class PDF", style="bold purple"))
         
-        if not self.notes["classes"]:
+        classes = list(self.store.get_classes().keys())
+        if not classes:
             self.console.print("[yellow]No classes available[/yellow]")
             return
         
         # Show available classes
-        classes = list(self.notes["classes"].keys())
         for i, class_name in enumerate(classes, 1):
             self.console.print(f"{i}. {class_name}")
         
@@ -388,84 +648,24 @@ class NoteManager:
     
     def _create_class_pdf(self, class_name: str):
         """Create a combined PDF for a specific class."""
-        class_notes = [note for note in self.notes["notes"] if note["class_name"] == class_name]
+        class_notes = self.store.list_notes(class_name=class_name)
         
         if not class_notes:
             self.console.print(f"[yellow]No notes found for {class_name}[/yellow]")
             return
         
-        # Sort notes by date
-        class_notes.sort(key=lambda x: x["upload_date"])
-        
-        # Create combined PDF
-        output_path = self.generated_dir / f"{class_name}_combined_notes.pdf"
-        
         try:
-            # Use PyPDF2 to combine PDFs
-            merger = PyPDF2.PdfMerger()
-            
-            for i, note in enumerate(class_notes):
-                # Add divider page
-                divider_pdf = self._create_divider_page(note, i + 1)
-                merger.append(divider_pdf)
-                
-                # Add actual note PDF
-                if Path(note["file_path"]).exists():
-                    merger.append(note["file_path"])
-                else:
-                    self.console.print(f"[yellow]Warning: Original PDF not found for {note['id']}[/yellow]")
-            
-            # Write combined PDF
-            with open(output_path, 'wb') as output_file:
-                merger.write(output_file)
+            # Reuses the previous build and cached dividers when notes were only appended
+            output_path, mode = self.pdf_builder.build(class_name, class_notes)
             
-            self.console.print(f"[green]✅ Generated combined PDF: {output_path}[/green]")
+            if mode == "unchanged":
+                self.console.print(f"[green]✅ Combined PDF already up to date: {output_path}[/green]")
+            else:
+                self.console.print(f"[green]✅ Generated combined PDF ({mode}): {output_path}[/green]")
             
         except Exception as e:
             self.console.print(f"[red]Error generating PDF: {e}[/red]")
     
-    def _create_divider_page(self, note: Dict, day_number: int) -> str:
-        """Create a divider page for the combined PDF."""
-        # Create a temporary PDF with divider content
-        divider_path = self.generated_dir / f"divider_{note['id']}.pdf"
-        
-        pdf = fpdf.FPDF()
-        pdf.add_page()
-        pdf.set_font('helvetica', 'B', 16)
-        
-        # Title
-        pdf.cell(0, 20, f"Day {day_number} Notes: {note['class_name']}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT, align='C')
-        pdf.ln(10)
-        
-        # Note type and date
-        pdf.set_font('helvetica', '', 12)
-        pdf.cell(0, 10, f"Type: {note['note_type']}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-        pdf.cell(0, 10, f"Date: {datetime.fromisoformat(note['upload_date']).strftime('%Y-%m-%d %H:%M')}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-        pdf.ln(10)
-        
-        # AI analysis summary
-        analysis = note['analysis']
-        pdf.cell(0, 10, "AI Analysis Summary:", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-        pdf.set_font('helvetica', '', 10)
-        
-        summary = analysis.get('summary', 'No summary available')
-        # Wrap text to fit page width
-        for line in [summary[i:i+80] for i in range(0, len(summary), 80)]:
-            pdf.cell(0, 8, line, new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-        
-        pdf.ln(10)
-        
-        # Key topics
-        if analysis.get('key_topics'):
-            pdf.set_font('helvetica', 'B', 12)
-            pdf.cell(0, 10, "Key Topics:", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-            pdf.set_font('helvetica', '', 10)
-            for topic in analysis['key_topics'][:5]:  # Limit to 5 topics
-                pdf.cell(0, 8, f"- {topic}", new_x=fpdf.XPos.LMARGIN, new_y=fpdf.YPos.NEXT)
-        
-        pdf.output(str(divider_path))
-        return str(divider_path)
-    
     def run(self):
         """Main application loop."""
         while True:
@@ -477,9 +677,11 @@ class NoteManager:
             self.console.print("2. 🔍 Search Notes")
             self.console.print("3. 📖 View Notes")
             self.console.print("4. 📄 Generate Class PDF")
-            self.console.print("5. ❌ Exit")
+            self.console.print("5. 💡 Ask About Notes")
+            self.console.print("6. 📝 Practice Quiz")
+            self.console.print("7. ❌ Exit")
             
-            choice = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5"])
+            choice = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6", "7"])
             
             if choice == "1":
                 self.upload_notes()
@@ -490,17 +692,194 @@ class NoteManager:
             elif choice == "4":
                 self.generate_class_pdf()
             elif choice == "5":
+                self.ask_notes()
+            elif choice == "6":
+                self.quiz_notes()
+            elif choice == "7":
                 self.console.print("[green]Goodbye! 👋[/green]")
                 break
 
-if __name__ == "__main__":
-    # Check if .env file exists
+def _require_env():
+    """Exit early if the .env file is missing."""
     if not Path(".env").exists():
         print("❌ .env file not found!")
         print("Please create a .env file with your Anthropic API key:")
         print("ANTHROPIC_API_KEY=your_api_key_here")
         print("\nOr run: python3 setup.py")
         exit(1)
+
+@click.group(invoke_without_command=True)
+@click.option("--rebuild-index", is_flag=True, help="Rebuild the full-text and embedding indexes and exit")
+@click.pass_context
+def cli(ctx, rebuild_index):
+    """SB Notes - run without a command for the interactive menu."""
+    if rebuild_index:
+        _require_env()
+        manager = NoteManager()
+        count = manager.rebuild_search_index()
+        manager.vector_index.rebuild(manager.store.list_notes(), manager._load_full_text)
+        manager.console.print(f"[green]✅ Re-indexed {count} notes[/green]")
+    elif ctx.invoked_subcommand is None:
+        _require_env()
+        NoteManager().run()
+
+@cli.command()
+@click.argument("target")
+@click.option("--class", "class_name", required=True, help="Class to file the notes under")
+@click.option("--type", "note_type", default="Notes", show_default=True,
+              type=click.Choice(["Notes", "Homework", "Study Prep", "Exam", "Other"]))
+@click.option("--concurrency", default=4, show_default=True, help="Concurrent model calls")
+@click.option("--chunk-size", default=16, show_default=True, help="Files per store transaction")
+def ingest(target, class_name, note_type, concurrency, chunk_size):
+    """Bulk-ingest a directory or glob of PDFs."""
+    _require_env()
+    NoteManager().ingest_notes(target, class_name, note_type, concurrency, chunk_size)
+
+@cli.command()
+@click.argument("question")
+@click.option("--class", "class_name", default=None, help="Only use notes from this class")
+def ask(question, class_name):
+    """Explain something using the most relevant parts of your notes."""
+    _require_env()
+    NoteManager().ask_notes(question, class_name)
+
+@cli.command()
+@click.option("--class", "class_name", required=True, help="Class to quiz on")
+@click.option("--topic", default=None, help="Draw questions from the notes closest to this topic")
+@click.option("--count", default=QUIZ_QUESTIONS, show_default=True, help="Number of questions")
+def quiz(class_name, topic, count):
+    """Practice questions generated from your notes (cached per note)."""
+    _require_env()
+    NoteManager().quiz_notes(class_name, topic, count)
+
+@cli.command()
+@click.option("--class", "class_name", default=None, help="Only re-analyze this class")
+@click.option("--batch/--no-batch", default=True, show_default=True,
+              help="Use the Message Batches API instead of one call per chunk")
+@click.option("--resume", "resume", default=None, metavar="BATCH_ID", help="Collect this earlier batch first")
+@click.option("--poll-interval", default=30.0, show_default=True, help="Seconds between batch status checks")
+@click.option("--incomplete", is_flag=True, help="Only notes with a failed or unparsed analysis")
+def reanalyze(class_name, batch, resume, poll_interval, incomplete):
+    """Re-run AI analysis for stored notes."""
+    _require_env()
+    manager = NoteManager()
+    updated = manager.reanalyze_notes(class_name, batch=batch, resume=resume, poll_interval=poll_interval,
+                                      incomplete_only=incomplete)
+    manager.console.print(f"[green]✅ Updated {updated} notes[/green]")
+
+@cli.command()
+@click.option("--hours", type=float, default=None, help="Only include the last N hours")
+def stats(hours):
+    """Per-stage latency percentiles and model token usage from the trace file."""
+    console = Console()
+    since = time.time() - hours * 3600 if hours else None
+    stages, models = summarize(read_records(TRACE_PATH, since=since))
+    if not stages:
+        console.print(f"[yellow]No trace records in {TRACE_PATH}[/yellow]")
+        return
     
-    note_manager = NoteManager()
-    note_manager.run()
+    table = Table(title="Pipeline Stages")
+    table.add_column("Stage", style="cyan")
+    table.add_column("Count", justify="right")
+    table.add_column("Errors", justify="right", style="red")
+    table.add_column("p50 (s)", justify="right", style="green")
+    table.add_column("p95 (s)", justify="right", style="yellow")
+    table.add_column("Max (s)", justify="right")
+    table.add_column("Total (s)", justify="right", style="magenta")
+    for name, row in stages.items():
+        table.add_row(name, str(row["count"]), str(row["errors"] or ""), f"{row['p50']:.3f}",
+                      f"{row['p95']:.3f}", f"{row['max']:.3f}", f"{row['total']:.1f}")
+    console.print(table)
+    
+    if models:
+        table = Table(title="Model Usage")
+        table.add_column("Model", style="cyan")
+        table.add_column("Calls", justify="right")
+        table.add_column("Input", justify="right")
+        table.add_column("Output", justify="right")
+        table.add_column("Cache Read", justify="right", style="green")
+        table.add_column("Cache Write", justify="right", style="yellow")
+        for model, row in models.items():
+            table.add_row(model, str(row["calls"]), str(row["input_tokens"]), str(row["output_tokens"]),
+                          str(row["cache_read_tokens"]), str(row["cache_write_tokens"]))
+        console.print(table)
+
+@cli.command()
+@click.option("--port", default=9464, show_default=True)
+@click.option("--host", default="127.0.0.1", show_default=True)
+def metrics(port, host):
+    """Serve Prometheus metrics (from the trace file) at /metrics."""
+    server = serve_metrics(port, TRACE_PATH, host)
+    print(f"📈 Serving metrics on http://{host}:{port}/metrics (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+@cli.command("backfill-analysis")
+@click.option("--dry-run", is_flag=True, help="Report what would be recovered without saving")
+def backfill_analysis(dry_run):
+    """Re-parse unparsed AI analyses locally (no API calls)."""
+    _require_env()
+    manager = NoteManager()
+    counts = manager.backfill_analyses(dry_run=dry_run)
+    manager.console.print(
+        f"[green]✅ Recovered {counts['from_cache']} from cached responses, "
+        f"{counts['reparsed']} by re-parsing[/green], [red]{counts['unrecoverable']} unrecoverable[/red]"
+        + (" (dry run)" if dry_run else "")
+    )
+    if counts["unrecoverable"]:
+        manager.console.print("[yellow]Run `reanalyze --incomplete` to analyze the rest again[/yellow]")
+
+@cli.command("migrate-uploads")
+@click.option("--dry-run", is_flag=True, help="Report what would be moved without changing anything")
+def migrate_uploads(dry_run):
+    """Move existing uploads/ PDFs into the deduplicated content-addressed store."""
+    _require_env()
+    manager = NoteManager()
+    counts = manager.migrate_uploads(dry_run=dry_run)
+    manager.console.print(
+        f"[green]✅ Moved {counts['moved']}, deduplicated {counts['deduplicated']}[/green], "
+        f"{counts['already_stored']} already stored, [red]{counts['missing']} missing[/red]"
+        + (" (dry run)" if dry_run else "")
+    )
+    if counts["unrecoverable"]:
+        manager.console.print("[yellow]Run `reanalyze --incomplete` to analyze the rest again[/yellow]")
+
+@cli.command("gc-uploads")
+@click.option("--grace-hours", default=DEFAULT_GRACE_SECONDS / 3600, show_default=True,
+              help="Keep unreferenced files newer than this")
+@click.option("--dry-run", is_flag=True, help="List what would be deleted without deleting it")
+def gc_uploads(grace_hours, dry_run):
+    """Delete stored PDFs that no note references any more."""
+    _require_env()
+    manager = NoteManager()
+    removed = manager.collect_upload_garbage(grace_hours * 3600, dry_run=dry_run)
+    for path in removed:
+        manager.console.print(f"[dim]{'would remove' if dry_run else 'removed'} {path}[/dim]")
+    stats = manager.upload_store.stats()
+    manager.console.print(
+        f"[green]✅ {'Would remove' if dry_run else 'Removed'} {len(removed)} files; "
+        f"{stats['objects']} stored PDFs use {stats['bytes'] / 1024 / 1024:.1f} MB[/green]"
+    )
+
+@cli.command()
+@click.option("--rebuild", is_flag=True, help="Recompute the aggregates from the notes table")
+def aggregates(rebuild):
+    """Verify (or rebuild) the materialized class and library statistics."""
+    console = Console()
+    store = NoteStore(Path("data") / "notes.db", legacy_json=Path("data") / "notes.json")
+    if rebuild:
+        store.rebuild_aggregates()
+        console.print("[green]✅ Aggregates rebuilt[/green]")
+    problems = store.verify_aggregates()
+    for problem in problems:
+        console.print(f"[red]❌ {problem}[/red]")
+    if problems:
+        raise SystemExit(1)
+    totals = store.get_totals()
+    console.print(f"[green]✅ Aggregates match: {totals['total_notes']} notes in {totals['total_classes']} classes[/green]")
+
+if __name__ == "__main__":
+    cli()
@@ -5,18 +5,25 @@ A beautiful Streamlit web app for uploading, analyzing, and organizing PDF notes
 """
 
 import os
-import json
 import shutil
-import base64
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional
-import PyPDF2
 import streamlit as st
-import anthropic
 from dotenv import load_dotenv
 import fpdf
 from dateutil import parser
+from jobs import DEFAULT_WORKERS, JobQueue, ensure_workers
+from model_gateway import get_gateway
+from ocr_cache import TranscriptionCache
+from pdf_builder import CombinedPdfBuilder
+from note_store import NoteStore
+from search_index import SearchIndex
+from vector_index import VectorIndex
+from text_store import TextStore
+from streaming import get_upload_budget, share_upload_budget
+from upload_store import UploadStore
+from study import QUIZ_QUESTIONS, StudyAssistant
 
 # Load environment variables
 load_dotenv()
@@ -69,181 +76,118 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+STATIC_DIR = Path(__file__).parent / "static"
+ANALYSIS_MODEL = "claude-sonnet-4-20250514"
+
+def _file_etag(path: Path) -> str:
+    """Weak ETag from size and mtime, cheap enough to compute on every rerun."""
+    stat = path.stat()
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def _publish_static(path: Path, etag: str) -> str:
+    """Expose a generated PDF under static/ (hard link, copy as fallback) and return its name."""
+    STATIC_DIR.mkdir(exist_ok=True)
+    static_name = f"{path.stem}.{etag}.pdf"
+    target = STATIC_DIR / static_name
+    if not target.exists():
+        # Drop links to older builds of the same file
+        for stale in STATIC_DIR.glob(f"{path.stem}.*.pdf"):
+            stale.unlink()
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+    return static_name
+
 class SBNotesWeb:
     def __init__(self):
         self.data_dir = Path("data")
         self.uploads_dir = Path("uploads")
         self.generated_dir = Path("generated_pdfs")
         self.notes_file = self.data_dir / "notes.json"
+        self.db_file = self.data_dir / "notes.db"
         
         # Initialize directories
         self._init_directories()
         
+        # Values derived from the store, keyed by store version (see _derived)
+        self._derived_cache: Dict[str, tuple] = {}
+        
         # Initialize Anthropic client
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if not api_key:
             st.error("❌ ANTHROPIC_API_KEY not found in environment variables")
             st.stop()
         
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # Shared gateway: pooled async client with rate limiting and retries
+        self.gateway = get_gateway(api_key)
+        
+        # Open the note store (imports notes.json on first run)
+        self.store = NoteStore(self.db_file, legacy_json=self.notes_file)
+        
+        # Durable queue of uploads waiting for the background workers
+        self.job_queue = JobQueue(self.data_dir / "jobs.db")
+        
+        # This process and each worker get an equal share of the upload byte budget
+        share_upload_budget(DEFAULT_WORKERS + 1)
+        
+        # Full transcriptions, compressed and stored out-of-line from note metadata
+        self.text_store = TextStore(self.data_dir / "texts")
+        
+        # Uploaded PDFs, stored once per distinct file and shared by notes
+        self.upload_store = UploadStore(self.uploads_dir)
+        
+        # Incremental combined-PDF builder with cached divider pages
+        self.pdf_builder = CombinedPdfBuilder(self.generated_dir, on_warning=lambda message: st.warning(f"⚠️ {message}"))
+        
+        # Full-text index; rebuilt from the store if it has drifted (e.g. first run)
+        self.search_index = SearchIndex(self.data_dir / "search_index.db")
+        if self.search_index.count() != self.store.count_notes():
+            self.rebuild_search_index()
+        
+        # Embedding index for semantic search and related notes; same drift check
+        self.vector_index = VectorIndex(self.data_dir / "vector_index.db")
+        if self.vector_index.count() != self.store.count_notes():
+            self.vector_index.rebuild(self.store.list_notes(), self._load_full_text)
         
-        # Load existing notes
-        self.notes = self._load_notes()
+        # Ask/quiz over retrieved note chunks; question sets cached per note content
+        self.study = StudyAssistant(self.gateway, self.store, self.vector_index, self._load_full_text,
+                                    TranscriptionCache(self.data_dir / "study_cache.db"))
     
-    def _init_directories(self):
-        """Initialize necessary directories."""
-        self.data_dir.mkdir(exist_ok=True)
-        self.uploads_dir.mkdir(exist_ok=True)
-        self.generated_dir.mkdir(exist_ok=True)
+    def _derived(self, name: str, compute):
+        """Memoize a store-derived value until the store version changes."""
+        version = self.store.version()
+        cached = self._derived_cache.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, compute())
+            self._derived_cache[name] = cached
+        return cached[1]
     
-    def _load_notes(self) -> Dict:
-        """Load existing notes from JSON file."""
-        if self.notes_file.exists():
-            try:
-                with open(self.notes_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                st.warning("⚠️ Corrupted notes file, starting fresh")
-        return {"notes": [], "classes": {}}
+    def get_classes(self) -> Dict[str, Dict]:
+        """Per-class stats, recomputed only after the store changes."""
+        return self._derived("classes", self.store.get_classes)
     
-    def _save_notes(self):
-        """Save notes to JSON file."""
-        with open(self.notes_file, 'w') as f:
-            json.dump(self.notes, f, indent=2)
+    def get_totals(self) -> Dict:
+        """Total note count and latest upload date, recomputed only after the store changes."""
+        return self._derived("totals", self.store.get_totals)
     
-    def _extract_text_from_pdf(self, pdf_path: Path) -> str:
-        """Extract text from PDF file using OCR with vision capabilities."""
-        try:
-            # First try traditional text extraction
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    page_text = page.extract_text()
-                    if page_text.strip():
-                        text += page_text + "\n"
-                
-                # If we got substantial text, return it
-                if len(text.strip()) > 50:
-                    return text
-            
-            # If traditional extraction failed or got minimal text, use vision OCR
-            st.info("🔄 Traditional text extraction failed. Using AI vision to read scanned notes...")
-            return self._extract_text_with_vision(pdf_path)
-            
-        except Exception as e:
-            st.error(f"❌ Error with traditional extraction: {e}")
-            st.info("🔄 Falling back to AI vision OCR...")
-            return self._extract_text_with_vision(pdf_path)
+    def rebuild_search_index(self) -> int:
+        """Re-index every stored note."""
+        return self.search_index.rebuild(self.store.list_notes(), self._load_full_text)
     
-    def _extract_text_with_vision(self, pdf_path: Path) -> str:
-        """Extract text from scanned PDF using Claude's PDF document support."""
-        try:
-            with st.spinner("📤 Uploading PDF to Claude for analysis..."):
-                # Read the PDF file and convert to base64
-                with open(pdf_path, 'rb') as pdf_file:
-                    pdf_data = pdf_file.read()
-                    pdf_base64 = base64.b64encode(pdf_data).decode('utf-8')
-                
-                # Use Claude's PDF document support to read the entire PDF
-                message = self.client.messages.create(
-                    model="claude-sonnet-4-20250514",
-                    max_tokens=4000,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "document",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "application/pdf",
-                                        "data": pdf_base64
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "Please read and transcribe all the text content from this PDF. This appears to be handwritten or scanned notes. Extract all text, mathematical formulas, diagrams descriptions, and any other written content from all pages. Be thorough and accurate in your transcription. Organize the content by pages if possible."
-                                }
-                            ]
-                        }
-                    ]
-                )
-                
-                return message.content[0].text
-                
-        except Exception as e:
-            st.error(f"❌ Error with PDF document processing: {e}")
-            return f"PDF document processing failed: {str(e)}"
+    def _load_full_text(self, note: Dict) -> str:
+        """Load a note's full transcription, falling back to the preview for older notes."""
+        if note.get("text_hash"):
+            text = self.text_store.get(note["text_hash"])
+            if text is not None:
+                return text
+        return note.get("text_preview", "")
     
-    def _analyze_notes_with_ai(self, text: str, note_type: str, class_name: str) -> Dict:
-        """Analyze notes using Anthropic Claude."""
-        prompt = f"""
-        Analyze the following {note_type} for {class_name}. This content was extracted from scanned/handwritten notes using AI vision, so it may contain transcription artifacts.
-        
-        Please provide:
-        1. A concise summary (2-3 sentences)
-        2. Key topics/concepts covered
-        3. Important formulas, definitions, or concepts
-        4. Difficulty level (Beginner/Intermediate/Advanced)
-        5. Estimated study time needed
-        6. Related topics that might be connected
-        7. Content quality assessment (how well the notes were transcribed)
-        
-        Notes content:
-        {text[:8000]}  # Limit to avoid token limits
-        
-        Please format your response as JSON with these keys:
-        - summary
-        - key_topics
-        - important_concepts
-        - difficulty_level
-        - estimated_study_time
-        - related_topics
-        - transcription_quality
-        """
-        
-        try:
-            with st.spinner("🤖 Analyzing notes with AI..."):
-                message = self.client.messages.create(
-                    model="claude-sonnet-4-20250514",
-                    max_tokens=1000,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                
-                # Try to parse JSON response
-                try:
-                    response_text = message.content[0].text.strip()
-                    # Remove code block markers if present
-                    if response_text.startswith("```json"):
-                        response_text = response_text[7:]
-                    if response_text.endswith("```"):
-                        response_text = response_text[:-3]
-                    response_text = response_text.strip()
-                    return json.loads(response_text)
-                except json.JSONDecodeError:
-                    # If JSON parsing fails, create a structured response
-                    return {
-                        "summary": message.content[0].text[:200] + "...",
-                        "key_topics": ["Extracted from AI analysis"],
-                        "important_concepts": ["See full analysis"],
-                        "difficulty_level": "Unknown",
-                        "estimated_study_time": "Unknown",
-                        "related_topics": [],
-                        "transcription_quality": "Unknown"
-                    }
-                    
-        except Exception as e:
-            st.error(f"❌ Error analyzing notes with AI: {e}")
-            return {
-                "summary": "AI analysis failed",
-                "key_topics": [],
-                "important_concepts": [],
-                "difficulty_level": "Unknown",
-                "estimated_study_time": "Unknown",
-                "related_topics": [],
-                "transcription_quality": "Failed"
-            }
+    def _init_directories(self):
+        """Initialize necessary directories."""
+        self.data_dir.mkdir(exist_ok=True)
+        self.uploads_dir.mkdir(exist_ok=True)
+        self.generated_dir.mkdir(exist_ok=True)
     
     def upload_notes(self):
         """Upload and process a new PDF note."""
@@ -284,103 +228,101 @@ class SBNotesWeb:
                         st.error("❌ Please enter a class name")
                         return
                     
-                    # Save uploaded file
+                    # Save uploaded file; a background worker does extraction and analysis
                     timestamp = datetime.now().isoformat()
-                    note_id = f"{class_name}_{timestamp}"
-                    upload_path = self.uploads_dir / f"{note_id}.pdf"
                     
-                    with open(upload_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
+                    # Stored by content (a re-upload of the same PDF isn't written again) and hashed
+                    # on the way, so the worker doesn't re-read the file to hash it. Concurrent
+                    # sessions' in-memory uploads count against this process's upload budget.
+                    uploaded_file.seek(0)
+                    with get_upload_budget().reserve(uploaded_file.size):
+                        content_hash, upload_path = self.upload_store.put_stream(uploaded_file)
                     
-                    # Extract text
-                    with st.spinner("📖 Extracting text from PDF..."):
-                        text = self._extract_text_from_pdf(upload_path)
-                    
-                    if not text.strip():
-                        st.error("❌ Could not extract text from PDF")
-                        return
-                    
-                    # Analyze with AI
-                    analysis = self._analyze_notes_with_ai(text, note_type, class_name)
-                    
-                    # Create note entry
-                    note_entry = {
-                        "id": note_id,
+                    self.job_queue.enqueue("upload", {
+                        "file_path": str(upload_path),
                         "class_name": class_name,
                         "note_type": note_type,
-                        "upload_date": timestamp,
-                        "file_path": str(upload_path),
-                        "analysis": analysis,
-                        "text_preview": text[:500] + "..." if len(text) > 500 else text
-                    }
-                    
-                    # Add to notes list
-                    self.notes["notes"].append(note_entry)
-                    
-                    # Update class information
-                    if class_name not in self.notes["classes"]:
-                        self.notes["classes"][class_name] = {
-                            "total_notes": 0,
-                            "note_types": {},
-                            "last_updated": timestamp
-                        }
-                    
-                    self.notes["classes"][class_name]["total_notes"] += 1
-                    self.notes["classes"][class_name]["note_types"][note_type] = \
-                        self.notes["classes"][class_name]["note_types"].get(note_type, 0) + 1
-                    self.notes["classes"][class_name]["last_updated"] = timestamp
-                    
-                    # Save notes
-                    self._save_notes()
-                    
-                    # Success message
-                    st.success("✅ Successfully uploaded and analyzed notes!")
-                    
-                    # Display analysis results
-                    st.markdown("### 📊 Analysis Results")
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("**Summary:**")
-                        st.write(analysis.get('summary', 'No summary available'))
-                        
-                        st.markdown("**Difficulty Level:**")
-                        st.info(analysis.get('difficulty_level', 'Unknown'))
-                        
-                        st.markdown("**Study Time:**")
-                        st.info(analysis.get('estimated_study_time', 'Unknown'))
-                    
-                    with col2:
-                        st.markdown("**Key Topics:**")
-                        topics = analysis.get('key_topics', [])
-                        if topics:
-                            for topic in topics[:5]:
-                                st.write(f"• {topic}")
-                        else:
-                            st.write("No topics identified")
-                        
-                        st.markdown("**Transcription Quality:**")
-                        quality = analysis.get('transcription_quality', 'Unknown')
-                        if 'good' in quality.lower() or 'excellent' in quality.lower():
-                            st.success(quality)
-                        elif 'failed' in quality.lower():
-                            st.error(quality)
-                        else:
-                            st.info(quality)
+                        "timestamp": timestamp,
+                        "analysis_model": ANALYSIS_MODEL,
+                        "content_hash": content_hash,
+                        "filename": uploaded_file.name
+                    })
+                    ensure_workers(self.job_queue)
+                    st.success("✅ Upload queued! Processing continues in the background.")
             
             st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Poll job progress without rerunning the whole page where Streamlit supports it
+        if hasattr(st, "fragment"):
+            st.fragment(run_every=2)(self.show_jobs)()
+        else:
+            self.show_jobs()
+            st.button("🔄 Refresh")
+    
+    def show_jobs(self):
+        """Status of recent upload jobs."""
+        jobs = self.job_queue.recent(limit=10)
+        if not jobs:
+            return
+        
+        st.markdown("### ⏳ Processing Queue")
+        for job in jobs:
+            payload = job["payload"]
+            filename = payload.get("filename") or Path(payload["file_path"]).name
+            label = f"{payload['class_name']} - {payload['note_type']} ({filename})"
+            
+            if job["status"] == "done":
+                with st.expander(f"✅ {label}"):
+                    self._show_analysis(job["result"]["analysis"])
+            elif job["status"] == "failed":
+                st.error(f"❌ {label}: {job['message']}")
+            else:
+                st.progress(job["progress"], text=f"{label}: {job['message'] or job['status']}")
+    
+    def _show_analysis(self, analysis: Dict):
+        """Display analysis results for a processed note."""
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.markdown("**Summary:**")
+            st.write(analysis.get('summary', 'No summary available'))
+            
+            st.markdown("**Difficulty Level:**")
+            st.info(analysis.get('difficulty_level', 'Unknown'))
+            
+            st.markdown("**Study Time:**")
+            st.info(analysis.get('estimated_study_time', 'Unknown'))
+        
+        with col2:
+            st.markdown("**Key Topics:**")
+            topics = analysis.get('key_topics', [])
+            if topics:
+                for topic in topics[:5]:
+                    st.write(f"• {topic}")
+            else:
+                st.write("No topics identified")
+            
+            st.markdown("**Transcription Quality:**")
+            quality = analysis.get('transcription_quality', 'Unknown')
+            if 'good' in quality.lower() or 'excellent' in quality.lower():
+                st.success(quality)
+            elif 'failed' in quality.lower():
+                st.error(quality)
+            else:
+                st.info(quality)
     
     def view_notes(self):
         """View all notes with filtering options."""
         st.markdown("## 📖 View Notes")
         
-        if not self.notes["notes"]:
+        totals = self.get_totals()
+        total_notes = totals["total_notes"]
+        if not total_notes:
             st.info("📝 No notes uploaded yet. Upload your first note to get started!")
             return
         
         # Statistics
-        total_notes = len(self.notes["notes"])
-        total_classes = len(self.notes["classes"])
+        total_classes = totals["total_classes"]
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -388,8 +330,7 @@ class SBNotesWeb:
         with col2:
             st.metric("Classes", total_classes)
         with col3:
-            latest_note = max(self.notes["notes"], key=lambda x: x["upload_date"])
-            latest_date = datetime.fromisoformat(latest_note["upload_date"]).strftime("%Y-%m-%d")
+            latest_date = datetime.fromisoformat(totals["latest_upload"]).strftime("%Y-%m-%d")
             st.metric("Latest Upload", latest_date)
         
         # Filter options
@@ -399,7 +340,7 @@ class SBNotesWeb:
         with col1:
             class_filter = st.selectbox(
                 "Filter by Class",
-                ["All Classes"] + list(self.notes["classes"].keys())
+                ["All Classes"] + list(self.get_classes().keys())
             )
         
         with col2:
@@ -410,26 +351,52 @@ class SBNotesWeb:
         
         with col3:
             search_term = st.text_input("Search in content", placeholder="Enter keywords...")
+            semantic = st.toggle("Semantic search", help="Match by meaning using the local embedding index")
         
-        # Filter notes
-        filtered_notes = self.notes["notes"]
+        page_size = st.select_slider("Notes per page", options=[10, 25, 50, 100], value=25)
+        class_name = None if class_filter == "All Classes" else class_filter
+        note_type = None if type_filter == "All Types" else type_filter
         
-        if class_filter != "All Classes":
-            filtered_notes = [note for note in filtered_notes if note["class_name"] == class_filter]
-        
-        if type_filter != "All Types":
-            filtered_notes = [note for note in filtered_notes if note["note_type"] == type_filter]
+        # Loaded pages live in session state; changing the filters or the store starts over
+        listing_key = (class_name, note_type, search_term, semantic, page_size, self.store.version())
+        listing = st.session_state.get("notes_listing")
+        if listing is None or listing["key"] != listing_key:
+            listing = {"key": listing_key, "notes": [], "cursor": None, "done": False}
+            st.session_state["notes_listing"] = listing
         
         if search_term:
-            filtered_notes = [
-                note for note in filtered_notes
-                if search_term.lower() in note["class_name"].lower() or
-                   search_term.lower() in note["note_type"].lower() or
-                   search_term.lower() in note["analysis"].get("summary", "").lower()
-            ]
+            # Ranked full-text (or embedding) search, restricted to the selected class/type
+            index = self.vector_index if semantic else self.search_index
+            ranked = index.search(
+                search_term,
+                limit=len(listing["notes"]) + page_size + 1,
+                class_name=class_name,
+                note_type=note_type
+            )
+            # Only as many hits as needed are ranked, so the count may be a lower bound
+            more = len(ranked) > len(listing["notes"]) + page_size
+            total_found = f"{len(ranked) - 1}+" if more else str(len(ranked))
+        else:
+            total_found = str(self.store.count_matching(class_name, note_type))
+        
+        def load_page():
+            if search_term:
+                ids = [note_id for note_id, _ in ranked[len(listing["notes"]):len(listing["notes"]) + page_size]]
+                listing["notes"].extend(self.store.get_notes(ids))
+                listing["done"] = len(ranked) <= len(listing["notes"])
+            else:
+                notes, listing["cursor"] = self.store.page_notes(
+                    class_name=class_name, note_type=note_type, after=listing["cursor"], limit=page_size
+                )
+                listing["notes"].extend(notes)
+                listing["done"] = listing["cursor"] is None
+        
+        if not listing["notes"] and not listing["done"]:
+            load_page()
         
         # Display notes
-        st.markdown(f"### 📋 Notes ({len(filtered_notes)} found)")
+        st.markdown(f"### 📋 Notes ({total_found} found, showing {len(listing['notes'])})")
+        filtered_notes = listing["notes"]
         
         for note in filtered_notes:
             with st.expander(f"📚 {note['class_name']} - {note['note_type']} ({datetime.fromisoformat(note['upload_date']).strftime('%Y-%m-%d %H:%M')})"):
@@ -447,6 +414,10 @@ class SBNotesWeb:
                     
                     st.markdown("**Text Preview:**")
                     st.text(note["text_preview"][:200] + "...")
+                    
+                    # Full text is only read from the text store when asked for
+                    if note.get("text_hash") and st.checkbox("Show full transcription", key=f"full_text_{note['id']}"):
+                        st.text(self._load_full_text(note))
                 
                 with col2:
                     st.markdown("**Details:**")
@@ -455,23 +426,117 @@ class SBNotesWeb:
                     st.write(f"**Difficulty:** {note['analysis'].get('difficulty_level', 'Unknown')}")
                     st.write(f"**Study Time:** {note['analysis'].get('estimated_study_time', 'Unknown')}")
                     st.write(f"**Quality:** {note['analysis'].get('transcription_quality', 'Unknown')}")
+                    
+                    # Looked up only when asked for
+                    if st.checkbox("Related notes", key=f"related_{note['id']}"):
+                        self._show_related(note["id"])
+        
+        if not listing["done"] and st.button("⬇️ Load more"):
+            load_page()
+            st.rerun()
+    
+    def _show_related(self, note_id: str):
+        """List the notes closest to note_id in the embedding index."""
+        related = self.vector_index.related(note_id, limit=5)
+        notes = {note["id"]: note for note in self.store.get_notes([other for other, _ in related])}
+        if not notes:
+            st.caption("No related notes found")
+        for other, score in related:
+            if other in notes:
+                note = notes[other]
+                date = datetime.fromisoformat(note["upload_date"]).strftime("%Y-%m-%d")
+                st.write(f"🔗 {note['class_name']} - {note['note_type']} ({date}) · {score:.2f}")
+    
+    def ask_notes(self):
+        """Answer a question from the most relevant parts of the stored notes, streaming the reply."""
+        st.markdown("## 💡 Ask About Your Notes")
+        
+        classes = self.get_classes()
+        if not classes:
+            st.info("📝 No notes uploaded yet. Upload some notes first!")
+            return
+        
+        class_filter = st.selectbox("Class", ["All"] + list(classes.keys()))
+        question = st.text_area("What should I explain?", placeholder="e.g., Why does the chain rule work?")
+        
+        if st.button("💡 Ask", type="primary") and question.strip():
+            class_name = None if class_filter == "All" else class_filter
+            try:
+                sources, answer = self.study.ask(question, class_name)
+                if not sources:
+                    st.warning("⚠️ No matching notes found; answering from general knowledge.")
+                # Renders each delta as it arrives
+                st.write_stream(answer)
+            except Exception as e:
+                st.error(f"❌ Error answering question: {e}")
+                return
+            
+            if sources:
+                with st.expander(f"📚 Sources ({len(sources)})"):
+                    for number, source in enumerate(sources, 1):
+                        st.write(f"[{number}] {source.label} · {source.score:.2f}")
+    
+    def quiz_notes(self):
+        """Practice quiz drawn from a class's notes; question sets are cached per note."""
+        st.markdown("## 📝 Practice Quiz")
+        
+        classes = self.get_classes()
+        if not classes:
+            st.info("📝 No notes uploaded yet. Upload some notes first!")
+            return
+        
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            class_name = st.selectbox("Class", list(classes.keys()))
+        with col2:
+            topic = st.text_input("Topic (optional)", placeholder="Leave empty for the latest notes")
+        with col3:
+            count = st.number_input("Questions", min_value=1, max_value=20, value=QUIZ_QUESTIONS)
+        
+        if st.button("📝 New Quiz", type="primary"):
+            failures = []
+            with st.spinner("🔄 Preparing questions..."):
+                try:
+                    # Kept in the session so revealing answers (a rerun) doesn't draw a new quiz
+                    st.session_state["quiz"] = self.study.quiz(class_name, topic.strip() or None, int(count),
+                                                               on_error=failures.append)
+                except Exception as e:
+                    st.error(f"❌ Error generating questions: {e}")
+                    return
+            for message in failures:
+                st.warning(f"⚠️ {message}")
+        
+        questions = st.session_state.get("quiz")
+        if questions is None:
+            return
+        if not questions:
+            st.warning(f"⚠️ No practice questions available for {class_name}")
+            return
+        for number, question in enumerate(questions, 1):
+            st.markdown(f"**{number}. {question['question']}**")
+            for letter, choice in zip("ABCDEFGH", question.get("choices", [])):
+                st.write(f"{letter}. {choice}")
+            with st.expander("Show answer"):
+                st.write(question["answer"])
+                st.caption(f"From {question['source']}")
     
     def generate_pdf(self):
         """Generate combined PDFs for classes."""
         st.markdown("## 📄 Generate Class PDFs")
         
-        if not self.notes["classes"]:
+        classes = self.get_classes()
+        if not classes:
             st.info("📝 No classes available. Upload some notes first!")
             return
         
         # Class selection
         selected_class = st.selectbox(
             "Select a class to generate PDF",
-            list(self.notes["classes"].keys())
+            list(classes.keys())
         )
         
         if selected_class:
-            class_notes = [note for note in self.notes["notes"] if note["class_name"] == selected_class]
+            class_notes = self.store.list_notes(class_name=selected_class)
             
             st.markdown(f"### 📚 {selected_class} Notes")
             st.write(f"Found {len(class_notes)} notes for this class")
@@ -482,64 +547,73 @@ class SBNotesWeb:
             
             if st.button("📄 Generate Combined PDF", type="primary"):
                 with st.spinner("🔄 Generating PDF..."):
-                    # Create combined PDF
-                    output_path = self.generated_dir / f"{selected_class}_combined_notes.pdf"
-                    
                     try:
-                        # Use PyPDF2 to combine PDFs
-                        merger = PyPDF2.PdfMerger()
-                        
-                        for i, note in enumerate(class_notes):
-                            # Add actual note PDF
-                            if Path(note["file_path"]).exists():
-                                merger.append(note["file_path"])
-                            else:
-                                st.warning(f"⚠️ Original PDF not found for {note['id']}")
-                        
-                        # Write combined PDF
-                        with open(output_path, 'wb') as output_file:
-                            merger.write(output_file)
-                        
-                        st.success(f"✅ Generated combined PDF: {output_path}")
-                        
-                        # Provide download link
-                        with open(output_path, "rb") as f:
-                            st.download_button(
-                                label="📥 Download Combined PDF",
-                                data=f.read(),
-                                file_name=f"{selected_class}_combined_notes.pdf",
-                                mime="application/pdf"
-                            )
-                        
+                        # Reuses the previous build and cached dividers when notes were only appended
+                        output_path, mode = self.pdf_builder.build(selected_class, class_notes)
+                        if mode == "unchanged":
+                            st.success(f"✅ Combined PDF already up to date: {output_path}")
+                        else:
+                            st.success(f"✅ Generated combined PDF ({mode}): {output_path}")
                     except Exception as e:
                         st.error(f"❌ Error generating PDF: {e}")
+            
+            # Offer the last build on every rerun, without re-merging or re-reading it
+            output_path = self.pdf_builder.output_path(selected_class)
+            if output_path.exists():
+                if not self.pdf_builder.is_up_to_date(selected_class, class_notes):
+                    st.warning("⚠️ The combined PDF is out of date; generate it again to include the latest notes.")
+                self._offer_download(output_path, f"{selected_class}_combined_notes.pdf")
+    
+    def _offer_download(self, output_path: Path, file_name: str):
+        """Serve a generated PDF, streamed from disk when static serving is enabled (run_web.py turns it on)."""
+        if st.get_option("server.enableStaticServing"):
+            # Tornado streams static files in chunks with ETag/Range support
+            static_name = _publish_static(output_path, _file_etag(output_path))
+            st.link_button("📥 Download Combined PDF", f"app/static/{static_name}")
+        else:
+            # Without static serving Streamlit must hold the file in memory, so read it only on request
+            # (never cached) instead of on every rerun
+            size_mb = output_path.stat().st_size / 1024 / 1024
+            if st.button(f"📦 Prepare Download ({size_mb:.1f} MB)"):
+                with open(output_path, "rb") as f:
+                    st.download_button(
+                        label="📥 Download Combined PDF",
+                        data=f,
+                        file_name=file_name,
+                        mime="application/pdf"
+                    )
+
+@st.cache_resource(show_spinner=False)
+def get_app() -> SBNotesWeb:
+    """One SBNotesWeb per server process; derived data is invalidated via the store version."""
+    return SBNotesWeb()
 
 def main():
     # Header
     st.markdown('<h1 class="main-header">📚 SB Notes</h1>', unsafe_allow_html=True)
     st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">Personal Note Management with AI</p>', unsafe_allow_html=True)
     
-    # Initialize app
-    app = SBNotesWeb()
+    # Reuse the process-wide app (store, gateway, indexes) across reruns
+    app = get_app()
     
     # Sidebar navigation
     st.sidebar.markdown("## 🧭 Navigation")
     page = st.sidebar.selectbox(
         "Choose a page",
-        ["📤 Upload Notes", "📖 View Notes", "📄 Generate PDFs"]
+        ["📤 Upload Notes", "📖 View Notes", "💡 Ask Notes", "📝 Practice Quiz", "📄 Generate PDFs"]
     )
     
     # Sidebar stats
     st.sidebar.markdown("## 📊 Statistics")
-    total_notes = len(app.notes["notes"])
-    total_classes = len(app.notes["classes"])
+    totals = app.get_totals()
+    total_notes = totals["total_notes"]
+    total_classes = totals["total_classes"]
     
     st.sidebar.metric("Total Notes", total_notes)
     st.sidebar.metric("Classes", total_classes)
     
     if total_notes > 0:
-        latest_note = max(app.notes["notes"], key=lambda x: x["upload_date"])
-        latest_date = datetime.fromisoformat(latest_note["upload_date"]).strftime("%Y-%m-%d")
+        latest_date = datetime.fromisoformat(totals["latest_upload"]).strftime("%Y-%m-%d")
         st.sidebar.metric("Latest Upload", latest_date)
     
     # Page routing
@@ -547,6 +621,10 @@ def main():
         app.upload_notes()
     elif page == "📖 View Notes":
         app.view_notes()
+    elif page == "💡 Ask Notes":
+        app.ask_notes()
+    elif page == "📝 Practice Quiz":
+        app.quiz_notes()
     elif page == "📄 Generate PDFs":
         app.generate_pdf()
 
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+SB Notes Scan Normalizer
+Local clean-up of scanned pages before they are sent to vision OCR: each
+image-only page is rasterized, contrast-stretched, optionally binarized and
+downsampled to a target DPI with NumPy, then re-packed into a compact PDF
+with the same page count (pages with a real text layer are copied as-is).
+Results are cached on disk by the source file's content hash and the
+normalization settings.
+
+Pages are rasterized with PyMuPDF when it is installed; otherwise the
+full-page image embedded in each scanned page is decoded directly.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import fpdf
+import numpy as np
+import PyPDF2
+from PIL import Image
+from PyPDF2.generic import ContentStream
+
+from metrics import span
+from ocr_cache import file_sha256
+from pdf_text import MIN_PAGE_CHARS
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional; embedded page images are decoded without it
+    fitz = None
+
+# Bump when the pipeline changes so older cached outputs are not reused
+NORMALIZER_VERSION = 2
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+SKIP_SUFFIX = ".skip"
+
+# An image must be drawn over at least this fraction of the page's width and height to count as a scan
+MIN_PAGE_COVERAGE = 0.95
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+COLOR_MODES = {"/DeviceGray": "L", "/DeviceRGB": "RGB", "/DeviceCMYK": "CMYK"}
+
+
+@dataclass(frozen=True)
+class NormalizeSettings:
+    target_dpi: int = 150
+    binarize: bool = True
+    # Percentiles mapped to black and white by the contrast stretch
+    low_percentile: float = 2.0
+    high_percentile: float = 98.0
+    jpeg_quality: int = 70
+
+
+def contrast_stretch(gray: np.ndarray, low_percentile: float = 2.0, high_percentile: float = 98.0) -> np.ndarray:
+    """Linearly map the [low, high] percentile range of a grayscale image to [0, 255]."""
+    low, high = np.percentile(gray, [low_percentile, high_percentile])
+    if high - low < 1:
+        return gray.astype(np.uint8)
+    stretched = (gray.astype(np.float32) - low) * (255.0 / (high - low))
+    return np.clip(stretched, 0, 255).astype(np.uint8)
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Threshold maximizing between-class variance of the grayscale histogram."""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+    variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return int(np.argmax(variance))
+
+
+def downsample(gray: np.ndarray, current_dpi: float, target_dpi: float) -> np.ndarray:
+    """Area-average down to target_dpi; images already at or below it are returned unchanged."""
+    if current_dpi <= target_dpi * 1.05:
+        return gray
+    scale = target_dpi / current_dpi
+    height, width = gray.shape
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return np.asarray(Image.fromarray(gray).resize(size, Image.Resampling.BOX))
+
+
+def normalize_image(gray: np.ndarray, current_dpi: float, settings: NormalizeSettings) -> Image.Image:
+    """Contrast-stretch, downsample and (optionally) binarize one grayscale page."""
+    gray = downsample(gray, current_dpi, settings.target_dpi)
+    gray = contrast_stretch(gray, settings.low_percentile, settings.high_percentile)
+    if settings.binarize:
+        return Image.fromarray(gray > otsu_threshold(gray)).convert("1")
+    return Image.fromarray(gray)
+
+
+def _decode_image(xobject) -> Optional[Image.Image]:
+    """Decode an image XObject with PIL, for the encodings scanners produce; None otherwise."""
+    filters = xobject.get("/Filter", [])
+    filters = [filters] if isinstance(filters, str) else list(filters)
+    data = xobject.get_data()
+    if "/DCTDecode" in filters or "/JPXDecode" in filters:
+        # get_data leaves the JPEG / JPEG 2000 stream itself undecoded
+        return Image.open(io.BytesIO(data))
+
+    size = (int(xobject["/Width"]), int(xobject["/Height"]))
+    bits = int(xobject.get("/BitsPerComponent", 8))
+    color_space = xobject.get("/ColorSpace")
+    if bits == 1:
+        image = Image.frombytes("1", size, data)
+        # /Decode [1 0] (common in fax-style scans) means 1 is black
+        if list(xobject.get("/Decode", [0, 1])) == [1, 0]:
+            image = Image.eval(image.convert("L"), lambda value: 255 - value)
+        return image
+    mode = COLOR_MODES.get(color_space if isinstance(color_space, str) else None)
+    if bits != 8 or mode is None:
+        return None
+    return Image.frombytes(mode, size, data)
+
+
+def _multiply(first: Tuple[float, ...], second: Tuple[float, ...]) -> Tuple[float, ...]:
+    """Compose two PDF transformation matrices [a b c d e f]: first, then second."""
+    a, b, c, d, e, f = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (a * a2 + b * c2, a * b2 + b * d2, c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def _painted_images(page: PyPDF2.PageObject, reader: PyPDF2.PdfReader) -> List[Tuple[object, Tuple[float, ...]]]:
+    """Image XObjects the page's content stream draws, each with the matrix it is drawn under."""
+    contents = page.get_contents()
+    resources = page.get("/Resources")
+    resources = resources.get_object() if resources is not None else {}
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects is not None else {}
+    if contents is None or not xobjects:
+        return []
+    images = []
+    matrix, saved = IDENTITY, []
+    for operands, operator in ContentStream(contents, reader).operations:
+        if operator == b"q":
+            saved.append(matrix)
+        elif operator == b"Q" and saved:
+            matrix = saved.pop()
+        elif operator == b"cm":
+            matrix = _multiply(tuple(float(value) for value in operands), matrix)
+        elif operator == b"Do":
+            xobject = xobjects.get(operands[0])
+            xobject = xobject.get_object() if xobject is not None else None
+            if xobject is not None and xobject.get("/Subtype") == "/Image":
+                images.append((xobject, matrix))
+    return images
+
+
+class ScanNormalizer:
+    """Produces (and caches) normalized copies of scanned PDFs for vision OCR."""
+
+    @classmethod
+    def from_env(cls, cache_dir: Path) -> Optional["ScanNormalizer"]:
+        """A normalizer unless disabled with SBNOTES_NORMALIZE_SCANS=0; SBNOTES_SCAN_DPI sets the target DPI."""
+        if os.getenv("SBNOTES_NORMALIZE_SCANS", "1") == "0":
+            return None
+        return cls(cache_dir, NormalizeSettings(target_dpi=int(os.getenv("SBNOTES_SCAN_DPI", 150))))
+
+    def __init__(self, cache_dir: Path = Path("data/normalized"), settings: NormalizeSettings = NormalizeSettings(),
+                 max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.settings = settings
+        self.max_cache_bytes = max_cache_bytes
+
+    def cache_key(self, content_hash: str) -> str:
+        payload = json.dumps([NORMALIZER_VERSION, content_hash, asdict(self.settings), fitz is not None])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def normalize(self, pdf_path: Path, content_hash: Optional[str] = None) -> Path:
+        """Path of the PDF to send to vision: the cached normalized copy, or pdf_path itself
+        when no page could be normalized or the result would not be smaller."""
+        key = self.cache_key(content_hash or file_sha256(pdf_path))
+        output = self.cache_dir / f"{key}.pdf"
+        skip = self.cache_dir / f"{key}{SKIP_SUFFIX}"
+        for cached in (output, skip):
+            if cached.exists():
+                os.utime(cached)
+                return output if cached is output else Path(pdf_path)
+
+        with span("normalize") as attrs:
+            try:
+                data = self._normalize(Path(pdf_path))
+            except Exception:
+                # A file PyPDF2 can't rebuild is sent to vision exactly as uploaded
+                data = None
+            original_size = Path(pdf_path).stat().st_size
+            attrs.update(bytes_in=original_size, bytes_out=len(data) if data else None)
+        if data is None or len(data) >= original_size:
+            skip.touch()
+            return Path(pdf_path)
+
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, output)
+        self._evict()
+        return output
+
+    def _page_image(self, reader: PyPDF2.PdfReader, index: int, document) -> Optional[Image.Image]:
+        """The page as a raster image at (at most) its native resolution, or None to keep it as-is."""
+        if document is not None:
+            # Render at the target DPI directly; PyMuPDF handles any page content
+            zoom = self.settings.target_dpi / 72
+            pixmap = document[index].get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+            return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+
+        page = reader.pages[index]
+        images = _painted_images(page, reader)
+        if len(images) != 1:
+            return None
+        xobject, (a, b, c, d, _, _) = images[0]
+        # Upright scans only: a rotated or skewed placement can't be redrawn as a plain page image
+        if b or c or a < MIN_PAGE_COVERAGE * float(page.mediabox.width) \
+                or d < MIN_PAGE_COVERAGE * float(page.mediabox.height):
+            return None
+        return _decode_image(xobject)
+
+    def _normalize(self, pdf_path: Path) -> Optional[bytes]:
+        """Build the normalized PDF, or None if no page qualified."""
+        with open(pdf_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            document = fitz.open(str(pdf_path)) if fitz is not None else None
+            # PyMuPDF renders pages as displayed, with /Rotate already applied; decoded
+            # embedded images are unrotated, so their pages get /Rotate set again below
+            rotation_baked_in = document is not None
+            normalized = {}
+            rendered = fpdf.FPDF(unit="pt")
+            for index, page in enumerate(reader.pages):
+                if len((page.extract_text() or "").strip()) >= MIN_PAGE_CHARS:
+                    continue
+                try:
+                    image = self._page_image(reader, index, document)
+                except Exception:
+                    # Unusual encodings are sent to vision unmodified
+                    image = None
+                if image is None:
+                    continue
+                width, height = float(page.mediabox.width), float(page.mediabox.height)
+                if rotation_baked_in and page.rotation % 180:
+                    width, height = height, width
+                current_dpi = image.width / (width / 72)
+                cleaned = normalize_image(np.asarray(image.convert("L")), current_dpi, self.settings)
+
+                rendered.add_page(format=(width, height))
+                if cleaned.mode == "1":
+                    rendered.image(cleaned, x=0, y=0, w=width, h=height)
+                else:
+                    buffer = io.BytesIO()
+                    cleaned.save(buffer, format="JPEG", quality=self.settings.jpeg_quality)
+                    rendered.image(buffer, x=0, y=0, w=width, h=height)
+                normalized[index] = len(normalized)
+            if document is not None:
+                document.close()
+            if not normalized:
+                return None
+
+            rendered_reader = PyPDF2.PdfReader(io.BytesIO(bytes(rendered.output())))
+            writer = PyPDF2.PdfWriter()
+            for index, page in enumerate(reader.pages):
+                if index in normalized:
+                    new_page = writer.add_page(rendered_reader.pages[normalized[index]])
+                    if page.rotation and not rotation_baked_in:
+                        new_page.rotate(page.rotation)
+                else:
+                    writer.add_page(page)
+            buffer = io.BytesIO()
+            writer.write(buffer)
+        return buffer.getvalue()
+
+    def _evict(self):
+        """Drop least recently used outputs once the cache is over its size limit."""
+        files = sorted(self.cache_dir.glob("*.pdf"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        while files and total > self.max_cache_bytes:
+            oldest = files.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
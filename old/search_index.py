@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+SB Notes Search Index
+Persistent full-text inverted index (SQLite FTS5) with BM25 ranking over the
+class, type, extracted text, summary, key topics and important concepts of
+every note.
+"""
+
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    rowid INTEGER PRIMARY KEY,
+    note_id TEXT NOT NULL UNIQUE
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+    class_name,
+    note_type,
+    summary,
+    topics,
+    concepts,
+    body,
+    tokenize = 'porter unicode61 remove_diacritics 2'
+);
+"""
+
+# BM25 column weights, in notes_fts column order
+BM25_WEIGHTS = (2.0, 1.0, 3.0, 4.0, 3.0, 1.0)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize_query(query: str) -> List[str]:
+    """Split a free-text query into terms safe to pass to FTS5 MATCH."""
+    return [token.lower() for token in TOKEN_RE.findall(query)]
+
+
+def _join_field(value) -> str:
+    """Flatten list-valued analysis fields into indexable text."""
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(item) for item in value)
+    return str(value or "")
+
+
+class SearchIndex:
+    """BM25-ranked full-text index kept in sync with the note store."""
+
+    def __init__(self, db_path: Path = Path("data/search_index.db")):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    @staticmethod
+    def _row(note: Dict, text: str) -> Tuple:
+        analysis = note.get("analysis", {})
+        return (
+            note["id"],
+            note["class_name"],
+            note["note_type"],
+            _join_field(analysis.get("summary", "")),
+            _join_field(analysis.get("key_topics", [])),
+            _join_field(analysis.get("important_concepts", [])),
+            text or ""
+        )
+
+    def _delete(self, note_id: str):
+        """Remove a note's postings via its rowid (caller holds the lock and commits)."""
+        row = self._conn.execute("SELECT rowid FROM docs WHERE note_id = ?", (note_id,)).fetchone()
+        if row is not None:
+            self._conn.execute("DELETE FROM notes_fts WHERE rowid = ?", (row[0],))
+            self._conn.execute("DELETE FROM docs WHERE rowid = ?", (row[0],))
+
+    def index_notes(self, notes: Iterable[Tuple[Dict, str]]):
+        """Add or replace (note, full_text) pairs in one transaction."""
+        rows = [self._row(note, text) for note, text in notes]
+        with self._lock, self._conn:
+            for row in rows:
+                self._delete(row[0])
+                rowid = self._conn.execute("INSERT INTO docs (note_id) VALUES (?)", (row[0],)).lastrowid
+                self._conn.execute("INSERT INTO notes_fts (rowid, class_name, note_type, summary, topics, concepts, body) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", (rowid,) + row[1:])
+
+    def index_note(self, note: Dict, text: str):
+        """Add or replace a single note."""
+        self.index_notes([(note, text)])
+
+    def remove_note(self, note_id: str):
+        """Drop a note from the index."""
+        with self._lock, self._conn:
+            self._delete(note_id)
+
+    def count(self) -> int:
+        """Number of indexed notes."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def _match(self, match: str, limit: int, class_name: Optional[str],
+               note_type: Optional[str]) -> List[Tuple[str, float]]:
+        clauses, params = ["notes_fts MATCH ?"], [match]
+        if class_name is not None:
+            clauses.append("notes_fts.class_name = ?")
+            params.append(class_name)
+        if note_type is not None:
+            clauses.append("notes_fts.note_type = ?")
+            params.append(note_type)
+        weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+        query = (
+            f"SELECT docs.note_id, bm25(notes_fts, {weights}) AS score "
+            f"FROM notes_fts JOIN docs ON docs.rowid = notes_fts.rowid "
+            f"WHERE {' AND '.join(clauses)} ORDER BY score LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        # FTS5 bm25() is lower-is-better; flip so callers see higher-is-better
+        return [(note_id, -score) for note_id, score in rows]
+
+    def search(self, query: str, limit: int = 10, class_name: Optional[str] = None,
+               note_type: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Return (note_id, score) pairs, best first.
+
+        All terms must match; if that finds nothing, any term may match. The
+        last term is treated as a prefix so partial words still hit.
+        """
+        terms = tokenize_query(query)
+        if not terms:
+            return []
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+
+        results = self._match(" AND ".join(quoted), limit, class_name, note_type)
+        if not results and len(quoted) > 1:
+            results = self._match(" OR ".join(quoted), limit, class_name, note_type)
+        return results
+
+    def rebuild(self, notes: Iterable[Dict], text_loader: Callable[[Dict], str], batch_size: int = 500) -> int:
+        """Drop and re-index every note. Returns the number of notes indexed."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM notes_fts")
+            self._conn.execute("DELETE FROM docs")
+
+        total, batch = 0, []
+        for note in notes:
+            batch.append((note, text_loader(note)))
+            if len(batch) >= batch_size:
+                self.index_notes(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.index_notes(batch)
+            total += len(batch)
+
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO notes_fts (notes_fts) VALUES ('optimize')")
+        return total
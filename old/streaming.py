@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+SB Notes Streaming I/O
+Bounded-memory helpers for the upload path: chunked copies that hash the
+bytes as they pass, base64 encoding into a single preallocated buffer, and
+a byte budget that caps how much PDF data concurrent uploads may hold at
+once. The budget lives in each process; processes that upload side by side
+(the web app and its workers) each take an equal share of it.
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+
+COPY_CHUNK_BYTES = 1024 * 1024
+# A multiple of 3, so each encoded piece is whole base64 with no padding mid-stream
+ENCODE_CHUNK_BYTES = 3 * 256 * 1024
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024
+# Copies of a document's base64 alive while it is sent: the string itself, then the
+# JSON text of the request body and its UTF-8 bytes (built one after the other by httpx)
+REQUEST_COPIES = 3
+
+
+def copy_stream(source: BinaryIO, dest_path: Path, chunk_size: int = COPY_CHUNK_BYTES,
+                overwrite: bool = True) -> Tuple[str, int]:
+    """Copy a file object to dest_path in chunks, hashing as it goes. Returns (sha256 hex, size).
+
+    Writes to a uniquely named temporary file beside dest_path and renames it
+    into place, so a failed copy never leaves a truncated upload behind and
+    concurrent copies to the same path don't write into each other. With
+    overwrite=False an existing dest_path is kept and this copy discarded
+    (for content-addressed files, where both are the same bytes).
+    """
+    dest_path = Path(dest_path)
+    fd, tmp_name = tempfile.mkstemp(dir=dest_path.parent, suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        if overwrite:
+            os.replace(tmp_name, dest_path)
+        else:
+            try:
+                # Unlike a rename, a link never replaces a file another writer put there first
+                os.link(tmp_name, dest_path)
+            except FileExistsError:
+                pass
+            except OSError:
+                # No hard links on this filesystem; a rename is still atomic
+                os.replace(tmp_name, dest_path)
+            Path(tmp_name).unlink(missing_ok=True)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return digest.hexdigest(), size
+
+
+def encoded_size(raw_bytes: int) -> int:
+    """Length of the base64 encoding of raw_bytes bytes."""
+    return 4 * ((raw_bytes + 2) // 3)
+
+
+def request_bytes(raw_bytes: int) -> int:
+    """Memory to reserve for sending a document of raw_bytes bytes as base64."""
+    return encoded_size(raw_bytes) * REQUEST_COPIES
+
+
+def encode_file_base64(path: Path, chunk_size: int = ENCODE_CHUNK_BYTES) -> str:
+    """Base64 of a file, encoded piece by piece into one buffer of the final size.
+
+    Only the buffer and the string decoded from it ever exist together, never
+    the raw file or a list of encoded pieces.
+    """
+    with open(path, "rb") as f:
+        buffer = bytearray(encoded_size(os.fstat(f.fileno()).st_size))
+        offset = 0
+        with memoryview(buffer) as view:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                encoded = base64.b64encode(chunk)
+                view[offset:offset + len(encoded)] = encoded
+                offset += len(encoded)
+    # The file may have shrunk since it was measured
+    del buffer[offset:]
+    return buffer.decode("ascii")
+
+
+class ByteBudget:
+    """Counting limit on bytes held by concurrent uploads; reservations block until they fit.
+
+    A single reservation larger than the whole budget is admitted once nothing
+    else is in flight, so one oversized file still goes through on its own.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES):
+        self.max_bytes = max(1, max_bytes)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        nbytes = max(0, nbytes)
+        with self._cond:
+            while self.in_flight and self.in_flight + nbytes > self.max_bytes:
+                self._cond.wait()
+            self.in_flight += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight -= nbytes
+                self._cond.notify_all()
+
+
+_budget: Optional[ByteBudget] = None
+_budget_shares = 1
+_budget_lock = threading.Lock()
+
+
+def share_upload_budget(processes: int):
+    """Split the upload budget evenly between processes that upload at the same time.
+
+    Call before the first upload in each of them, with the same total count.
+    """
+    global _budget, _budget_shares
+    with _budget_lock:
+        # Repeat calls (e.g. on every Streamlit rerun) keep the budget that is in use
+        if max(1, processes) != _budget_shares:
+            _budget_shares = max(1, processes)
+            _budget = None
+
+
+def get_upload_budget() -> ByteBudget:
+    """This process's budget: SBNOTES_MAX_INFLIGHT_BYTES (default 256 MB) over the number of sharing processes."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            total = int(os.getenv("SBNOTES_MAX_INFLIGHT_BYTES", DEFAULT_MAX_INFLIGHT_BYTES))
+            _budget = ByteBudget(total // _budget_shares)
+        return _budget
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+SB Notes Study Assistant
+Explains topics and writes practice questions from a student's own notes.
+Questions are answered from the top-k most relevant transcription chunks
+for a class (retrieved from the vector index) packed into a fixed token
+budget, never whole notes, and answers stream back as they are generated.
+Practice question sets are generated per note and cached by the note's
+content hash, so a quiz over unchanged notes costs no model calls.
+"""
+
+import json
+import math
+import random
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from analysis import extract_analysis_json
+from metrics import span
+from model_gateway import ModelGateway, cacheable_system
+from note_store import NoteStore
+from ocr_cache import TranscriptionCache
+from text_store import text_sha256
+from vector_index import VectorIndex, note_chunks
+
+STUDY_MODEL = "claude-sonnet-4-20250514"
+TOP_K = 8
+# Prompt budget for retrieved note text; the instructions and question come on top
+CONTEXT_TOKENS = 6000
+# Rough size of an English token, for budgeting without a tokenizer round trip
+CHARS_PER_TOKEN = 4
+QUESTIONS_PER_NOTE = 8
+QUIZ_QUESTIONS = 5
+QUIZ_NOTES = 3
+MAX_CONCURRENT_QUIZZES = 4
+
+ASK_INSTRUCTIONS = """You are a study assistant answering a student's question from their own class notes. The notes were transcribed from scanned/handwritten pages, so they may contain transcription artifacts.
+
+Answer from the numbered excerpts you are given, explaining step by step where that helps, and cite excerpts like [1]. If the excerpts don't cover the question, say so, then answer briefly from general knowledge and mark that part clearly."""
+
+QUIZ_INSTRUCTIONS = """You write practice questions that help a student review their own class notes. The notes were transcribed from scanned/handwritten pages, so they may contain transcription artifacts.
+
+Cover the most important ideas, mixing recall, application and conceptual questions. Every answer must be supported by the notes.
+
+Respond with a single JSON object and nothing else, with the key "questions": a list of objects with these keys:
+- question
+- answer (a short model answer)
+- type ("short_answer" or "multiple_choice")
+- choices (multiple_choice only: a list of options, one of which is the answer)"""
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def note_label(note: Dict) -> str:
+    date = datetime.fromisoformat(note["upload_date"]).strftime("%Y-%m-%d")
+    return f"{note['class_name']} - {note['note_type']} ({date})"
+
+
+@dataclass
+class ContextChunk:
+    """One retrieved piece of a note: the note, its chunk number and text, and the retrieval score."""
+    note: Dict
+    chunk: int
+    text: str
+    score: float
+
+    @property
+    def label(self) -> str:
+        return note_label(self.note)
+
+
+def pack_context(chunks: List[ContextChunk], max_tokens: int = CONTEXT_TOKENS) -> List[ContextChunk]:
+    """Best-scoring chunks that fit in max_tokens, returned in note and page order.
+
+    Chunks that don't fit are skipped so smaller, lower-ranked ones can still
+    use the room; a best chunk larger than the whole budget is truncated.
+    """
+    packed, used = [], 0
+    for chunk in sorted(chunks, key=lambda chunk: -chunk.score):
+        tokens = estimate_tokens(chunk.text)
+        if not packed and tokens > max_tokens:
+            chunk = ContextChunk(chunk.note, chunk.chunk, chunk.text[:max_tokens * CHARS_PER_TOKEN], chunk.score)
+            tokens = max_tokens
+        if used + tokens <= max_tokens:
+            packed.append(chunk)
+            used += tokens
+    return sorted(packed, key=lambda chunk: (chunk.note["upload_date"], chunk.note["id"], chunk.chunk))
+
+
+def build_ask_prompt(question: str, context: List[ContextChunk], class_name: Optional[str] = None) -> str:
+    """Variable part of an ask request: the numbered excerpts, then the question (always last)."""
+    excerpts = "\n\n".join(f"[{number}] {chunk.label}\n{chunk.text.strip()}"
+                           for number, chunk in enumerate(context, 1))
+    scope = f" for {class_name}" if class_name else ""
+    return f"Excerpts from my notes{scope}:\n\n{excerpts or '(no matching notes)'}\n\nQuestion: {question}"
+
+
+def build_ask_request(question: str, context: List[ContextChunk], model: str = STUDY_MODEL,
+                      class_name: Optional[str] = None, max_tokens: int = 1500) -> Dict[str, Any]:
+    """Keyword arguments for an ask call: cached instructions first, excerpts and question last."""
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": cacheable_system(ASK_INSTRUCTIONS),
+        "messages": [{"role": "user", "content": build_ask_prompt(question, context, class_name)}]
+    }
+
+
+def build_quiz_request(note: Dict, text: str, model: str = STUDY_MODEL, count: int = QUESTIONS_PER_NOTE,
+                       max_tokens: int = 2500) -> Dict[str, Any]:
+    """Keyword arguments for generating one note's question set."""
+    prompt = (f"Write {count} practice questions for the following {note['note_type']} "
+              f"for {note['class_name']}.\n\nNotes content:\n{text}")
+    return {
+        "model": model,
+        "max_tokens": max_tokens,
+        "system": cacheable_system(QUIZ_INSTRUCTIONS),
+        "messages": [{"role": "user", "content": prompt}]
+    }
+
+
+def parse_questions(response_text: str) -> List[Dict]:
+    """Question dicts from a quiz response; malformed entries are dropped."""
+    parsed = extract_analysis_json(response_text) or {}
+    questions = []
+    for item in parsed.get("questions", []) if isinstance(parsed.get("questions"), list) else []:
+        if not isinstance(item, dict) or not item.get("question") or not item.get("answer"):
+            continue
+        question = {
+            "question": str(item["question"]).strip(),
+            "answer": str(item["answer"]).strip(),
+            "type": "multiple_choice" if item.get("choices") else "short_answer"
+        }
+        if isinstance(item.get("choices"), list) and item["choices"]:
+            question["choices"] = [str(choice) for choice in item["choices"]]
+        questions.append(question)
+    return questions
+
+
+class StudyAssistant:
+    """Retrieval-backed ask and quiz over the note store, shared by the terminal and web apps."""
+
+    def __init__(self, gateway: ModelGateway, store: NoteStore, vector_index: VectorIndex,
+                 text_loader: Callable[[Dict], str], cache: TranscriptionCache, model: str = STUDY_MODEL,
+                 context_tokens: int = CONTEXT_TOKENS):
+        self.gateway = gateway
+        self.store = store
+        self.vector_index = vector_index
+        self.text_loader = text_loader
+        self.cache = cache
+        self.model = model
+        self.context_tokens = context_tokens
+
+    def retrieve(self, query: str, class_name: Optional[str] = None, top_k: int = TOP_K) -> List[ContextChunk]:
+        """Top-k chunks for query, packed into the context budget."""
+        with span("retrieve") as attrs:
+            hits = self.vector_index.search_chunks(query, limit=top_k, class_name=class_name)
+            notes = {note["id"]: note for note in self.store.get_notes(list({note_id for note_id, _, _ in hits}))}
+            texts: Dict[str, List[str]] = {}
+            chunks = []
+            for note_id, number, score in hits:
+                note = notes.get(note_id)
+                if note is None:
+                    continue
+                if note_id not in texts:
+                    # Re-split the stored text the same way the index did
+                    texts[note_id] = note_chunks(note, self.text_loader(note))
+                if number < len(texts[note_id]):
+                    chunks.append(ContextChunk(note, number, texts[note_id][number], score))
+            packed = pack_context(chunks, self.context_tokens)
+            attrs.update(hits=len(hits), packed=len(packed),
+                         tokens=sum(estimate_tokens(chunk.text) for chunk in packed))
+        return packed
+
+    def ask(self, question: str, class_name: Optional[str] = None,
+            top_k: int = TOP_K) -> Tuple[List[ContextChunk], Iterator[str]]:
+        """Sources used and a stream of answer text deltas."""
+        context = self.retrieve(question, class_name, top_k)
+        request = build_ask_request(question, context, self.model, class_name)
+        return context, self.gateway.stream(**request)
+
+    def _quiz_text(self, note: Dict) -> str:
+        """The note's text, cut to the context budget at a chunk boundary where possible."""
+        text = ""
+        for chunk in note_chunks(note, self.text_loader(note))[1:]:
+            if text and estimate_tokens(text + chunk) > self.context_tokens:
+                break
+            text += chunk
+        return text[:self.context_tokens * CHARS_PER_TOKEN]
+
+    def _quiz_key(self, note: Dict) -> str:
+        content_hash = note.get("text_hash") or text_sha256(note.get("text_preview", ""))
+        return TranscriptionCache.make_key(f"quiz:{content_hash}:{QUESTIONS_PER_NOTE}", self.model, QUIZ_INSTRUCTIONS)
+
+    def question_sets(self, notes: List[Dict],
+                      on_error: Optional[Callable[[str], None]] = None) -> Dict[str, List[Dict]]:
+        """Each note's cached question set, generating the missing ones concurrently.
+
+        Notes whose generation fails are reported to on_error and left out; if
+        that leaves no question sets at all, the first failure is raised.
+        """
+        notify = on_error or (lambda message: None)
+        sets, missing, errors = {}, [], []
+        for note in notes:
+            cached = self.cache.get(self._quiz_key(note))
+            if cached is not None:
+                sets[note["id"]] = json.loads(cached)
+            else:
+                missing.append(note)
+        if missing:
+            requests = [build_quiz_request(note, self._quiz_text(note), self.model) for note in missing]
+            with span("quiz", notes=len(missing)):
+                responses = self.gateway.create_many(requests, max_concurrency=MAX_CONCURRENT_QUIZZES)
+            for note, response in zip(missing, responses):
+                if isinstance(response, Exception):
+                    errors.append(response)
+                    notify(f"Questions for {note_label(note)} failed: {response}")
+                    continue
+                questions = parse_questions(response.content[0].text)
+                if questions:
+                    self.cache.put(self._quiz_key(note), json.dumps(questions))
+                sets[note["id"]] = questions
+        if errors and not sets:
+            raise errors[0]
+        return sets
+
+    def quiz(self, class_name: str, topic: Optional[str] = None, count: int = QUIZ_QUESTIONS,
+             max_notes: int = QUIZ_NOTES, on_error: Optional[Callable[[str], None]] = None) -> List[Dict]:
+        """count practice questions drawn from the notes most relevant to topic (or the latest notes).
+
+        Each question carries the label of the note it came from under "source".
+        Failures are handled as in question_sets.
+        """
+        if topic:
+            ranked = self.vector_index.search(topic, limit=max_notes, class_name=class_name)
+            notes = self.store.get_notes([note_id for note_id, _ in ranked])
+        else:
+            notes, _ = self.store.page_notes(class_name=class_name, limit=max_notes)
+        sets = self.question_sets(notes, on_error)
+
+        pools = []
+        for note in notes:
+            questions = [dict(question, source=note_label(note)) for question in sets.get(note["id"], [])]
+            random.shuffle(questions)
+            pools.append(questions)
+        # Round-robin across notes so one long note doesn't fill the whole quiz
+        drawn = []
+        while len(drawn) < count and any(pools):
+            for pool in pools:
+                if pool and len(drawn) < count:
+                    drawn.append(pool.pop())
+        return drawn
@@ -0,0 +1,57 @@
+"""Chunked analysis requests, their cache keys, and merging the parts."""
+
+from types import SimpleNamespace
+
+from analysis import CHUNK_CHARS, PAGE_CHARS, _cache_key, _chunk_requests, analyze_text
+
+MODEL = "claude-sonnet-4-20250514"
+
+
+def pages_text(count: int) -> str:
+    return "".join(f"## Page {page}\n\n" + f"Page {page} covers enzyme kinetics. " * 50 + "\n\n"
+                   for page in range(1, count + 1))
+
+
+def chunk_keys(text: str):
+    requests = _chunk_requests(text, "Lecture", "Biology", MODEL, CHUNK_CHARS, 1000)
+    return [_cache_key("analysis", request) for request in requests]
+
+
+def test_appending_a_group_keeps_earlier_chunk_keys():
+    pages_per_chunk = CHUNK_CHARS // PAGE_CHARS
+    before = chunk_keys(pages_text(pages_per_chunk * 3))
+    after = chunk_keys(pages_text(pages_per_chunk * 3 + 1))
+
+    assert len(before) == 3
+    assert len(after) == 4
+    assert after[:3] == before
+
+
+class StubGateway:
+    """Returns canned map replies, then the given merge reply."""
+
+    def __init__(self, merge_reply: str):
+        self.merge_reply = merge_reply
+
+    def create_many(self, requests, max_concurrency=4):
+        reply = ('{"summary": "Part.", "key_topics": ["enzymes"], "important_concepts": ["Km"], '
+                 '"difficulty_level": "Advanced", "estimated_study_time": "1 hour", '
+                 '"related_topics": ["metabolism"], "transcription_quality": "Good"}')
+        return [SimpleNamespace(content=[SimpleNamespace(text=reply)]) for _ in requests]
+
+    def create(self, **request):
+        return SimpleNamespace(content=[SimpleNamespace(text=self.merge_reply)])
+
+
+def test_merge_fills_only_keys_the_response_left_out():
+    gateway = StubGateway('{"summary": "Whole note.", "key_topics": ["kinetics"], "difficulty_level": "Intermediate"}')
+
+    analysis = analyze_text(gateway, pages_text(12), "Lecture", "Biology", MODEL)
+
+    assert analysis["summary"] == "Whole note."
+    assert analysis["key_topics"] == ["kinetics"]
+    assert analysis["difficulty_level"] == "Intermediate"
+    # Left out of the merge response: taken from the local reduce of the parts
+    assert analysis["related_topics"] == ["metabolism"]
+    assert analysis["transcription_quality"] == "Good"
+    assert analysis["estimated_study_time"] == "1 hour; 1 hour; 1 hour"
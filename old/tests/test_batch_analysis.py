@@ -0,0 +1,120 @@
+"""Batch re-analysis driven end to end against fake_anthropic."""
+
+import anthropic
+import pytest
+
+import fake_anthropic
+from analysis import pending_requests
+from batch_analysis import BatchLog, BatchReanalyzer
+from ocr_cache import TranscriptionCache
+
+MODEL = "claude-sonnet-4-20250514"
+
+
+def make_note(note_id: str, pages: int) -> dict:
+    """A note whose text is pages of about 1,900 characters each."""
+    text = "".join(f"## Page {page}\n\nNote {note_id}, page {page}: mitosis and the spindle. "
+                   + "Cells divide through prophase and metaphase. " * 40 + "\n\n"
+                   for page in range(1, pages + 1))
+    return {"id": note_id, "class_name": "Biology", "note_type": "Lecture", "text": text}
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(**options):
+        server = fake_anthropic.serve(0, **options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def make_reanalyzer(server, tmp_path) -> BatchReanalyzer:
+    client = anthropic.Anthropic(api_key="test", base_url=f"http://127.0.0.1:{server.server_address[1]}",
+                                 max_retries=0)
+    return BatchReanalyzer(client, TranscriptionCache(tmp_path / "cache.db"), BatchLog(tmp_path / "batches.db"),
+                           poll_interval=0.05)
+
+
+def test_run_analyzes_short_and_long_notes(server_factory, tmp_path):
+    server = server_factory(batch_delay=0.1)
+    reanalyzer = make_reanalyzer(server, tmp_path)
+    notes = [make_note("short", 1), make_note("long", 12)]
+
+    results = reanalyzer.run(notes, lambda note: note["text"], MODEL)
+
+    assert set(results) == {"short", "long"}
+    for analysis in results.values():
+        assert analysis["summary"].startswith("Fake analysis")
+    # Long notes need a map round and a merge round, all through batches
+    assert len(server.state.batches) == 2
+    assert server.state.message_requests == 0
+    for note in notes:
+        assert pending_requests(note["text"], note["note_type"], note["class_name"], MODEL, reanalyzer.cache) == []
+    assert reanalyzer.log.unfinished() == []
+
+
+def test_collect_caches_only_succeeded_requests(server_factory, tmp_path):
+    server = server_factory(batch_delay=0.0, error_rate=0.5, seed=7)
+    reanalyzer = make_reanalyzer(server, tmp_path)
+    notes = [make_note(f"n{i}", 1) for i in range(20)]
+    requests = [pair for note in notes
+                for pair in pending_requests(note["text"], note["note_type"], note["class_name"], MODEL,
+                                             reanalyzer.cache)]
+
+    [batch_id] = reanalyzer.submit(requests)
+    succeeded, failed = reanalyzer.collect(batch_id)
+
+    assert succeeded + failed == len(requests)
+    assert 0 < succeeded < len(requests)
+    cached = [key for key, _ in requests if reanalyzer.cache.get(key) is not None]
+    assert len(cached) == succeeded
+
+
+def test_failed_requests_are_retried_in_later_rounds(server_factory, tmp_path):
+    server = server_factory(batch_delay=0.0, error_rate=0.5, seed=7)
+    reanalyzer = make_reanalyzer(server, tmp_path)
+    notes = [make_note(f"n{i}", 1) for i in range(6)]
+
+    results = reanalyzer.run(notes, lambda note: note["text"], MODEL, max_rounds=10)
+
+    assert set(results) == {note["id"] for note in notes}
+    assert len(server.state.batches) > 1
+
+
+def test_all_errored_returns_no_results(server_factory, tmp_path):
+    server = server_factory(batch_delay=0.0, error_rate=1.0)
+    reanalyzer = make_reanalyzer(server, tmp_path)
+
+    results = reanalyzer.run([make_note("a", 1), make_note("b", 12)], lambda note: note["text"], MODEL,
+                             max_rounds=2)
+
+    assert results == {}
+    assert len(server.state.batches) == 2
+
+
+def test_resume_collects_unfinished_batch(server_factory, tmp_path):
+    server = server_factory(batch_delay=0.2)
+    reanalyzer = make_reanalyzer(server, tmp_path)
+    note = make_note("a", 1)
+    requests = pending_requests(note["text"], note["note_type"], note["class_name"], MODEL, reanalyzer.cache)
+    [batch_id] = reanalyzer.submit(requests)
+
+    # A new run (same cache and log) picks up the batch the interrupted one left behind
+    resumed = make_reanalyzer(server, tmp_path)
+    assert resumed.log.unfinished() == [batch_id]
+    assert resumed.resume() == 1
+    assert resumed.log.unfinished() == []
+    # Everything came back with the resumed batch, so the run submits nothing new
+    assert set(resumed.run([note], lambda note: note["text"], MODEL)) == {"a"}
+    assert len(server.state.batches) == 1
+
+
+def test_collect_rejects_unknown_batch(server_factory, tmp_path):
+    reanalyzer = make_reanalyzer(server_factory(), tmp_path)
+    with pytest.raises(ValueError):
+        reanalyzer.collect("msgbatch_unknown")
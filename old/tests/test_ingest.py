@@ -0,0 +1,63 @@
+"""Bulk ingest through NoteManager when the model is unreachable, then again when it is back."""
+
+import socket
+
+import fpdf
+import pytest
+from rich.console import Console
+
+import fake_anthropic
+from model_gateway import ModelGateway
+
+
+def write_text_pdf(path, words: str):
+    pdf = fpdf.FPDF()
+    pdf.add_page()
+    pdf.set_font("helvetica", size=11)
+    pdf.multi_cell(0, 6, " ".join([words] * 40))
+    pdf.output(str(path))
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    from sbnotes import NoteManager
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{closed_port()}")
+    manager = NoteManager()
+    manager.console = Console(quiet=True)
+    manager.gateway = ModelGateway("test", max_retries=0)
+    yield manager
+    manager.gateway.close()
+
+
+def test_ingest_retries_files_that_failed_during_an_outage(manager, tmp_path, monkeypatch):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_text_pdf(corpus / "cells.pdf", "Mitosis divides the nucleus through prophase and metaphase.")
+    write_text_pdf(corpus / "genes.pdf", "Transcription copies DNA into messenger RNA in the nucleus.")
+
+    manager.ingest_notes(str(corpus), "Biology", "Notes")
+    assert manager.store.count_notes() == 0
+
+    server = fake_anthropic.serve(0)
+    try:
+        monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+        manager.gateway.close()
+        manager.gateway = ModelGateway("test", max_retries=0)
+        manager.ingest_notes(str(corpus), "Biology", "Notes")
+    finally:
+        server.shutdown()
+
+    notes = manager.store.list_notes()
+    assert len(notes) == 2
+    for note in notes:
+        assert note["analysis"]["summary"].startswith("Fake analysis")
+        assert note["analysis"]["transcription_quality"] != "Failed"
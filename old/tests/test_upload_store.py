@@ -0,0 +1,47 @@
+"""Content-addressed upload storage under concurrent writers."""
+
+import io
+import threading
+
+from upload_store import UploadStore
+
+
+class SlowStream(io.BytesIO):
+    """Reads in small steps and yields between them, so concurrent copies interleave."""
+
+    def read(self, size=-1):
+        threading.Event().wait(0.001)
+        return super().read(min(size, 4096) if size and size > 0 else 4096)
+
+
+def test_concurrent_puts_of_the_same_file_all_succeed(tmp_path):
+    store = UploadStore(tmp_path / "uploads")
+    data = b"%PDF-1.4\n" + bytes(range(256)) * 400
+    results, errors = [], []
+
+    def put():
+        try:
+            results.append(store.put_stream(SlowStream(data)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len({path for _, path in results}) == 1
+    path = results[0][1]
+    assert path.read_bytes() == data
+    assert list(store.root.rglob("*.part")) == []
+    assert store.stats() == {"objects": 1, "bytes": len(data)}
+
+
+def test_reuse_does_not_modify_the_object(tmp_path):
+    store = UploadStore(tmp_path / "uploads")
+    _, path = store.put_stream(io.BytesIO(b"%PDF-1.4 same"))
+    before = path.stat().st_mtime_ns
+    store.put_stream(io.BytesIO(b"%PDF-1.4 same"))
+    assert path.stat().st_mtime_ns == before
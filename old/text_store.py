@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+SB Notes Text Store
+Content-addressed, compressed storage for full note transcriptions.
+Blobs are named by the SHA-256 of the text and compressed with zstd when
+the zstandard package is installed, zlib otherwise.
+"""
+
+import hashlib
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+ZSTD_SUFFIX = ".zst"
+ZLIB_SUFFIX = ".zz"
+
+
+def text_sha256(text: str) -> str:
+    """Content address of a transcription."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TextStore:
+    """Write-once blob store for extracted note text, keyed by content hash."""
+
+    def __init__(self, root: Path = Path("data/texts"), level: int = 9):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.level = level
+
+    def _base_path(self, digest: str) -> Path:
+        """Fan out into 256 subdirectories to keep directory listings small."""
+        return self.root / digest[:2] / digest[2:]
+
+    def _find(self, digest: str) -> Optional[Path]:
+        base = self._base_path(digest)
+        for suffix in (ZSTD_SUFFIX, ZLIB_SUFFIX):
+            path = base.with_suffix(suffix)
+            if path.exists():
+                return path
+        return None
+
+    def put(self, text: str) -> str:
+        """Store text (if not already present) and return its hash."""
+        digest = text_sha256(text)
+        if self._find(digest) is not None:
+            return digest
+
+        raw = text.encode("utf-8")
+        if zstandard is not None:
+            data = zstandard.ZstdCompressor(level=self.level).compress(raw)
+            suffix = ZSTD_SUFFIX
+        else:
+            data = zlib.compress(raw, self.level)
+            suffix = ZLIB_SUFFIX
+
+        path = self._base_path(digest).with_suffix(suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """Load and decompress a transcription, or None if it is missing."""
+        path = self._find(digest)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        if path.suffix == ZSTD_SUFFIX:
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd-compressed but the zstandard package is not installed")
+            raw = zstandard.ZstdDecompressor().decompress(data)
+        else:
+            raw = zlib.decompress(data)
+        return raw.decode("utf-8")
+
+    def exists(self, digest: str) -> bool:
+        return self._find(digest) is not None
+
+    def delete(self, digest: str) -> bool:
+        """Remove a blob. Returns True if one was deleted."""
+        path = self._find(digest)
+        if path is None:
+            return False
+        path.unlink()
+        return True
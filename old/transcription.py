@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+SB Notes Page-Level Transcription
+Keeps each page's PyPDF2 text layer when it is usable and sends only the thin
+(scanned/handwritten) pages to the vision model, split into small page-range
+chunks that are transcribed concurrently and reassembled in page order.
+Text layers come from the sampling/parallel extractor in pdf_text; with a
+ScanNormalizer, chunks are cut from the cleaned-up copy of the scan.
+"""
+
+import base64
+import io
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+import PyPDF2
+
+from metrics import span
+from model_gateway import VISION_MODEL, ModelGateway, build_vision_request
+from ocr_cache import TranscriptionCache, file_sha256
+from pdf_text import MIN_PAGE_CHARS, extract_pdf_text
+from scan_normalizer import ScanNormalizer
+from streaming import ByteBudget, get_upload_budget, request_bytes
+
+PAGES_PER_CHUNK = 4
+MAX_CONCURRENT_CHUNKS = 4
+
+# Static instructions (prompt-cached system block) and the per-chunk page numbering that follows the document
+CHUNK_INSTRUCTIONS = (
+    "Please read and transcribe all the text content from these PDF pages. They appear to be handwritten "
+    "or scanned notes. Extract all text, mathematical formulas, diagrams descriptions, and any other written "
+    "content. Be thorough and accurate in your transcription."
+)
+CHUNK_PAGE_PROMPT = (
+    "The first page in this document is page {first_page} of the original file; start each page with a "
+    "heading of the form '## Page N' using the original page numbers."
+)
+
+
+def chunk_prompt(first_page: int) -> str:
+    """Full instruction text for a chunk; also the transcription cache key component."""
+    return f"{CHUNK_INSTRUCTIONS} {CHUNK_PAGE_PROMPT.format(first_page=first_page)}"
+
+
+@dataclass
+class PageProvenance:
+    """Where the text for one page came from."""
+    page: int
+    source: str  # "text_layer", "vision", or "failed"
+    chunk: Optional[Tuple[int, int]] = None
+    extract_seconds: float = 0.0  # time spent reading the page's text layer
+
+
+@dataclass
+class Transcription:
+    """Reassembled transcription with per-page provenance."""
+    text: str
+    pages: List[PageProvenance] = field(default_factory=list)
+    kind: str = ""  # sampled classification: "text", "scanned" or "mixed"
+
+    @property
+    def vision_pages(self) -> int:
+        return sum(1 for page in self.pages if page.source == "vision")
+
+    @property
+    def failed_pages(self) -> List[int]:
+        """Pages whose text is a "[Transcription failed ...]" marker."""
+        return [page.page for page in self.pages if page.source == "failed"]
+
+
+def _page_chunks(pages: List[int], pages_per_chunk: int) -> List[Tuple[int, int]]:
+    """Group sorted page numbers into runs of consecutive pages, at most pages_per_chunk long."""
+    chunks: List[Tuple[int, int]] = []
+    for page in pages:
+        if chunks and page == chunks[-1][1] + 1 and page - chunks[-1][0] < pages_per_chunk:
+            chunks[-1] = (chunks[-1][0], page)
+        else:
+            chunks.append((page, page))
+    return chunks
+
+
+def _chunk_pdf_base64(reader: PyPDF2.PdfReader, first: int, last: int) -> str:
+    """Base64 of a new PDF holding pages first..last (1-based, inclusive)."""
+    writer = PyPDF2.PdfWriter()
+    for index in range(first - 1, last):
+        writer.add_page(reader.pages[index])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return base64.b64encode(buffer.getbuffer()).decode("utf-8")
+
+
+def _waves(chunks: List[Tuple[int, int]], chunk_bytes: Callable[[Tuple[int, int]], int],
+           max_bytes: int) -> List[List[Tuple[int, int]]]:
+    """Split chunks into consecutive groups whose estimated encoded size fits max_bytes."""
+    waves: List[List[Tuple[int, int]]] = []
+    total = 0
+    for chunk in chunks:
+        size = chunk_bytes(chunk)
+        if waves and total + size <= max_bytes:
+            waves[-1].append(chunk)
+            total += size
+        else:
+            waves.append([chunk])
+            total = size
+    return waves
+
+
+def transcribe_pdf_pages(pdf_path: Path, gateway: ModelGateway,
+                         cache: Optional[TranscriptionCache] = None,
+                         pages_per_chunk: int = PAGES_PER_CHUNK,
+                         max_concurrency: int = MAX_CONCURRENT_CHUNKS,
+                         min_page_chars: int = MIN_PAGE_CHARS,
+                         on_status: Optional[Callable[[str], None]] = None,
+                         content_hash: Optional[str] = None,
+                         budget: Optional[ByteBudget] = None,
+                         normalizer: Optional[ScanNormalizer] = None) -> Transcription:
+    """Transcribe a PDF page by page, sending only thin pages to the model.
+
+    Pass content_hash when the caller already hashed the file (e.g. while
+    copying it). Encoded chunks are built in waves that fit the upload byte
+    budget, so a long scan never holds every chunk's base64 at once. With a
+    normalizer, uncached chunks are sent from the normalized copy of the file;
+    cache keys still refer to the original.
+
+    Raises PyPDF2 errors if the file cannot be parsed at all; callers fall back
+    to whole-document vision in that case.
+    """
+    with open(pdf_path, "rb") as pdf_file:
+        # PyPDF2 reads objects from the open file on demand instead of from a full in-memory copy
+        return _transcribe(pdf_path, pdf_file, gateway, cache, pages_per_chunk, max_concurrency,
+                           min_page_chars, on_status or (lambda message: None), content_hash,
+                           budget or get_upload_budget(), normalizer)
+
+
+def _transcribe(pdf_path: Path, pdf_file: BinaryIO, gateway: ModelGateway,
+                cache: Optional[TranscriptionCache], pages_per_chunk: int, max_concurrency: int,
+                min_page_chars: int, notify: Callable[[str], None], content_hash: Optional[str],
+                budget: ByteBudget, normalizer: Optional[ScanNormalizer]) -> Transcription:
+    with span("pdf_text") as attrs:
+        reader = PyPDF2.PdfReader(pdf_file)
+        extraction = extract_pdf_text(pdf_path, reader=reader, min_chars=min_page_chars)
+        page_texts = [page.text for page in extraction.pages]
+        slowest = extraction.slowest()
+        attrs.update(pages=len(page_texts), kind=extraction.kind, parallel=extraction.parallel,
+                     slowest_page=slowest.page if slowest else None,
+                     slowest_seconds=slowest.seconds if slowest else 0.0)
+
+    thin_pages = extraction.thin_pages(min_page_chars)
+    chunks = _page_chunks(thin_pages, max(1, pages_per_chunk))
+
+    chunk_texts = {}
+    pending, cache_keys = [], {}
+    if chunks:
+        content_hash = content_hash or file_sha256(pdf_path)
+        for first, last in chunks:
+            key = TranscriptionCache.make_key(f"{content_hash}#p{first}-{last}", VISION_MODEL, chunk_prompt(first))
+            cached = cache.get(key) if cache is not None else None
+            if cached is not None:
+                chunk_texts[(first, last)] = cached
+            else:
+                cache_keys[(first, last)] = key
+                pending.append((first, last))
+
+    if pending:
+        notify(f"Transcribing {sum(last - first + 1 for first, last in pending)} scanned pages "
+               f"in {len(pending)} chunks...")
+        pdf_size = os.fstat(pdf_file.fileno()).st_size
+        if normalizer is not None:
+            # Same page count and order as the original, so chunk page ranges carry over; the
+            # normalized copy is small enough to read into memory
+            normalized_path = normalizer.normalize(pdf_path, content_hash)
+            if normalized_path != Path(pdf_path):
+                reader = PyPDF2.PdfReader(str(normalized_path))
+                pdf_size = normalized_path.stat().st_size
+        # Estimated from the file's average page size, times the copies a request holds; only used to size reservations
+        page_bytes = request_bytes(pdf_size) // max(1, len(page_texts))
+
+        def chunk_bytes(chunk: Tuple[int, int]) -> int:
+            return page_bytes * (chunk[1] - chunk[0] + 1)
+
+        for wave in _waves(pending, chunk_bytes, budget.max_bytes):
+            with budget.reserve(sum(chunk_bytes(chunk) for chunk in wave)):
+                with span("encode", chunks=len(wave)):
+                    requests = [
+                        build_vision_request(_chunk_pdf_base64(reader, first, last),
+                                             instructions=CHUNK_INSTRUCTIONS,
+                                             prompt=CHUNK_PAGE_PROMPT.format(first_page=first))
+                        for first, last in wave
+                    ]
+                with span("vision", pages=sum(last - first + 1 for first, last in wave), chunks=len(wave)):
+                    responses = gateway.create_many(requests, max_concurrency=max_concurrency)
+                del requests
+            for chunk, response in zip(wave, responses):
+                if isinstance(response, Exception):
+                    notify(f"Pages {chunk[0]}-{chunk[1]} failed: {response}")
+                    continue
+                chunk_texts[chunk] = response.content[0].text
+                if cache is not None:
+                    cache.put(cache_keys[chunk], chunk_texts[chunk])
+
+    # Reassemble in page order
+    chunk_by_first = {first: (first, last) for first, last in chunks}
+    parts, provenance = [], []
+    page = 1
+    while page <= len(page_texts):
+        if page in chunk_by_first:
+            first, last = chunk_by_first[page]
+            text = chunk_texts.get((first, last))
+            source = "vision" if text is not None else "failed"
+            if text is None:
+                text = f"## Page {first}\n\n[Transcription failed for pages {first}-{last}]"
+            parts.append(text.strip())
+            provenance.extend(
+                PageProvenance(number, source, (first, last), extraction.pages[number - 1].seconds)
+                for number in range(first, last + 1)
+            )
+            page = last + 1
+        else:
+            parts.append(f"## Page {page}\n\n{page_texts[page - 1].strip()}")
+            provenance.append(PageProvenance(page, "text_layer", extract_seconds=extraction.pages[page - 1].seconds))
+            page += 1
+
+    return Transcription(text="\n\n".join(parts) + "\n", pages=provenance, kind=extraction.kind)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+SB Notes Upload Store
+Content-addressed storage for uploaded PDFs. Each distinct file is kept once
+under uploads/objects/, named by its SHA-256, and notes point at it through
+their file_path; the notes table is the reference count. Uploading a file
+that is already stored costs no copy and no disk. Objects no note (or queued
+job) references are removed by collect_garbage after a grace period that
+starts when the object was last stored; that time is kept in a sidecar
+file, so objects themselves are never modified once written.
+"""
+
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set, Tuple
+
+from ocr_cache import file_sha256
+from streaming import COPY_CHUNK_BYTES, copy_stream
+
+OBJECTS_DIR = "objects"
+PDF_SUFFIX = ".pdf"
+PART_SUFFIX = ".part"
+USED_SUFFIX = ".used"
+# Objects younger than this are never collected: a note for them may still be on its way
+DEFAULT_GRACE_SECONDS = 24 * 3600
+
+
+class UploadStore:
+    """Deduplicated, write-once PDF store keyed by content hash."""
+
+    def __init__(self, root: Path = Path("uploads")):
+        self.root = Path(root)
+        self.objects = self.root / OBJECTS_DIR
+        self.objects.mkdir(parents=True, exist_ok=True)
+
+    def path_for(self, digest: str) -> Path:
+        """Fan out into 256 subdirectories, like the text store."""
+        return self.objects / digest[:2] / f"{digest[2:]}{PDF_SUFFIX}"
+
+    def is_object(self, path: Path) -> bool:
+        return Path(path).resolve().is_relative_to(self.objects.resolve())
+
+    def exists(self, digest: str) -> bool:
+        return self.path_for(digest).exists()
+
+    @staticmethod
+    def _mark_used(path: Path):
+        """Restart an object's grace period for the note about to reference it.
+
+        Recorded on a sidecar file: the object's own mtime is part of the
+        combined-PDF builder's change signature, so touching it would force rebuilds.
+        """
+        path.with_suffix(USED_SUFFIX).touch()
+
+    def _reuse(self, path: Path) -> bool:
+        """Whether an object already exists (marking it used if so)."""
+        if not path.exists():
+            return False
+        self._mark_used(path)
+        return True
+
+    @staticmethod
+    def _last_stored(path: Path) -> float:
+        """When an object was written or last reused, whichever is later."""
+        try:
+            used = path.with_suffix(USED_SUFFIX).stat().st_mtime
+        except FileNotFoundError:
+            used = 0.0
+        return max(path.stat().st_mtime, used)
+
+    def put_file(self, source: Path, content_hash: Optional[str] = None) -> Tuple[str, Path]:
+        """Store a file by content. Returns (digest, object path).
+
+        With a known content_hash an already-stored file is not read at all.
+        """
+        if content_hash is not None and self._reuse(self.path_for(content_hash)):
+            return content_hash, self.path_for(content_hash)
+        digest = content_hash or file_sha256(source)
+        path = self.path_for(digest)
+        if not self._reuse(path):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(source, "rb") as f:
+                copy_stream(f, path, overwrite=False)
+            self._mark_used(path)
+        return digest, path
+
+    def put_stream(self, stream: BinaryIO) -> Tuple[str, Path]:
+        """Store a seekable file object (e.g. an in-memory upload); duplicates are never written."""
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(COPY_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+        path = self.path_for(content_hash)
+        if not self._reuse(path):
+            stream.seek(0)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            copy_stream(stream, path, overwrite=False)
+            self._mark_used(path)
+        return content_hash, path
+
+    def link_in(self, source: Path, content_hash: Optional[str] = None) -> Tuple[str, Path]:
+        """Add a file from the same filesystem by hard-linking it (copying where links aren't
+        supported). The source is left in place for the caller to remove once nothing points at it.
+        """
+        digest = content_hash or file_sha256(source)
+        path = self.path_for(digest)
+        if not self._reuse(path):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(source, path)
+            except FileExistsError:
+                # Another writer stored the same content first
+                pass
+            except OSError:
+                with open(source, "rb") as f:
+                    copy_stream(f, path, overwrite=False)
+            # A hard link keeps the source's (possibly old) mtime
+            self._mark_used(path)
+        return digest, path
+
+    def iter_objects(self) -> Iterable[Path]:
+        return self.objects.glob(f"*/*{PDF_SUFFIX}")
+
+    def stats(self) -> Dict[str, int]:
+        sizes = [path.stat().st_size for path in self.iter_objects()]
+        return {"objects": len(sizes), "bytes": sum(sizes)}
+
+    def collect_garbage(self, referenced: Set[Path], grace_seconds: float = DEFAULT_GRACE_SECONDS,
+                        dry_run: bool = False) -> List[Path]:
+        """Delete unreferenced objects, stray pre-store uploads and abandoned partial copies.
+
+        referenced holds resolved paths that must be kept. Returns what was (or would be) removed.
+        """
+        cutoff = time.time() - grace_seconds
+        candidates = list(self.iter_objects())
+        # Loose PDFs in uploads/ predate the object store; the migration moves the referenced ones
+        candidates.extend(self.root.glob(f"*{PDF_SUFFIX}"))
+        candidates.extend(self.root.rglob(f"*{PART_SUFFIX}"))
+
+        removed = []
+        for path in candidates:
+            try:
+                if path.resolve() in referenced or self._last_stored(path) > cutoff:
+                    continue
+                if not dry_run:
+                    path.unlink()
+                    path.with_suffix(USED_SUFFIX).unlink(missing_ok=True)
+                removed.append(path)
+            except FileNotFoundError:
+                continue
+        # Markers whose object is already gone
+        for marker in self.objects.glob(f"*/*{USED_SUFFIX}"):
+            if not dry_run and not marker.with_suffix(PDF_SUFFIX).exists():
+                marker.unlink(missing_ok=True)
+        return removed
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+SB Notes Vector Index
+Local embedding index for semantic search, related-note lookup and chunk
+retrieval for the study assistant. Each note
+is embedded as a header chunk (summary, topics, concepts) plus page-aligned
+body chunks; vectors are stored int8-quantized in SQLite and searched by
+brute force with NumPy. Embeddings come from sentence-transformers when it
+is installed, and from a hashed TF-IDF embedder otherwise.
+"""
+
+import hashlib
+import importlib.util
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from analysis import split_for_analysis
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    note_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    note_type TEXT NOT NULL,
+    scale REAL NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_note_id ON chunks (note_id);
+CREATE TABLE IF NOT EXISTS df (
+    bucket INTEGER PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Body chunks are smaller than analysis chunks so a hit points at a few pages
+CHUNK_CHARS = 2000
+SENTENCE_MODEL = "all-MiniLM-L6-v2"
+# Bump when note_chunks splits text differently, so stored chunk numbers are re-derived
+CHUNKING_VERSION = 2
+
+TOKEN_RE = re.compile(r"[^\W_]{2,}", re.UNICODE)
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the this to was were
+will with which what when where who how can not no into than then there these those also such
+""".split())
+
+
+def _join_field(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return "; ".join(str(item) for item in value)
+    return str(value or "")
+
+
+def note_chunks(note: Dict, text: str, chunk_chars: int = CHUNK_CHARS) -> List[str]:
+    """Texts embedded for a note: an analysis header followed by body chunks."""
+    analysis = note.get("analysis", {})
+    header = "\n".join(part for part in (
+        f"{note['class_name']} {note['note_type']}",
+        _join_field(analysis.get("summary")),
+        _join_field(analysis.get("key_topics")),
+        _join_field(analysis.get("important_concepts"))
+    ) if part)
+    body = [chunk for chunk in split_for_analysis(text, chunk_chars) if chunk.strip()] if text else []
+    return [header] + body
+
+
+class HashingEmbedder:
+    """Feature-hashed unigram+bigram term frequencies; IDF is applied by the index at query time."""
+
+    uses_idf = True
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-tf-{dim}"
+
+    def _features(self, text: str) -> Counter:
+        tokens = [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value >> 63 else -1.0
+                # Sublinear tf so repeated words don't dominate a chunk
+                vectors[row, value % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceEmbedder:
+    """CPU sentence-transformers model, loaded on first use."""
+
+    uses_idf = False
+
+    def __init__(self, model_name: str = SENTENCE_MODEL):
+        self.model_name = model_name
+        self.name = f"sentence-transformers/{model_name}"
+        self._model = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name, device="cpu")
+        vectors = self._model.encode(texts, batch_size=32, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def default_embedder():
+    """sentence-transformers if installed (optional), otherwise the hashing fallback."""
+    if importlib.util.find_spec("sentence_transformers") is not None:
+        return SentenceEmbedder()
+    return HashingEmbedder()
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization; returns (int8 rows, float32 scales)."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+class VectorIndex:
+    """Brute-force cosine search over int8 chunk embeddings, kept in sync with the note store."""
+
+    def __init__(self, db_path: Path = Path("data/vector_index.db"), embedder=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.embedder = embedder or default_embedder()
+        self._lock = threading.RLock()
+        self._writes = 0
+        self._loaded: Optional[Tuple[str, Dict]] = None
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+        # Vectors from a different embedder or chunking are not comparable; start over (callers rebuild on drift)
+        layout = f"{self.embedder.name}#chunks-v{CHUNKING_VERSION}"
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()
+        if row is None or row[0] != layout:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM df")
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('embedder', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (layout,)
+            )
+        self._conn.commit()
+
+    def _version(self) -> str:
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        return f"{data_version}.{self._writes}"
+
+    def _adjust_df(self, quantized: np.ndarray, delta: int):
+        """Add or subtract each chunk's nonzero buckets from the document frequencies."""
+        if not self.embedder.uses_idf or not len(quantized):
+            return
+        counts = np.count_nonzero(quantized, axis=0)
+        buckets = np.nonzero(counts)[0]
+        self._conn.executemany(
+            "INSERT INTO df (bucket, n) VALUES (?, ?) ON CONFLICT(bucket) DO UPDATE SET n = n + excluded.n",
+            [(int(bucket), int(counts[bucket]) * delta) for bucket in buckets]
+        )
+
+    def _delete(self, note_id: str):
+        """Remove a note's chunks (caller holds the lock and commits)."""
+        rows = self._conn.execute("SELECT vector FROM chunks WHERE note_id = ?", (note_id,)).fetchall()
+        if rows:
+            old = np.stack([np.frombuffer(row[0], dtype=np.int8) for row in rows])
+            self._adjust_df(old, -1)
+            self._conn.execute("DELETE FROM chunks WHERE note_id = ?", (note_id,))
+
+    def index_notes(self, notes: Iterable[Tuple[Dict, str]]):
+        """Embed and add or replace (note, full_text) pairs in one transaction."""
+        notes = list(notes)
+        texts, owners = [], []
+        for note, text in notes:
+            chunks = note_chunks(note, text)
+            texts.extend(chunks)
+            owners.extend((note, number) for number in range(len(chunks)))
+        if not texts:
+            return
+        # Embed outside the lock; this is the slow part
+        quantized, scales = quantize(self.embedder.embed(texts))
+
+        with self._lock, self._conn:
+            self._writes += 1
+            for note, _ in notes:
+                self._delete(note["id"])
+            self._conn.executemany(
+                "INSERT INTO chunks (note_id, chunk, class_name, note_type, scale, vector) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (note["id"], number, note["class_name"], note["note_type"], float(scale), vector.tobytes())
+                    for (note, number), vector, scale in zip(owners, quantized, scales)
+                ]
+            )
+            self._adjust_df(quantized, 1)
+
+    def index_note(self, note: Dict, text: str):
+        """Add or replace a single note."""
+        self.index_notes([(note, text)])
+
+    def remove_note(self, note_id: str):
+        """Drop a note from the index."""
+        with self._lock, self._conn:
+            self._writes += 1
+            self._delete(note_id)
+
+    def count(self) -> int:
+        """Number of indexed notes."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(DISTINCT note_id) FROM chunks").fetchone()[0]
+
+    def _matrix(self) -> Dict:
+        """In-memory copy of the index, reloaded only after the database changes."""
+        with self._lock:
+            version = self._version()
+            if self._loaded is not None and self._loaded[0] == version:
+                return self._loaded[1]
+
+            rows = self._conn.execute(
+                "SELECT note_id, class_name, note_type, scale, vector, chunk FROM chunks ORDER BY id"
+            ).fetchall()
+            dim = len(rows[0][4]) if rows else 0
+            vectors = np.frombuffer(b"".join(row[4] for row in rows), dtype=np.int8).reshape(len(rows), dim)
+            scales = np.array([row[3] for row in rows], dtype=np.float32)
+
+            weights = np.ones(dim, dtype=np.float32)
+            if self.embedder.uses_idf and rows:
+                df = np.zeros(dim, dtype=np.float32)
+                for bucket, n in self._conn.execute("SELECT bucket, n FROM df"):
+                    if bucket < dim:
+                        df[bucket] = n
+                weights = (np.log((1.0 + len(rows)) / (1.0 + df)) + 1.0).astype(np.float32)
+
+            # Pre-weight and normalize once so a query is a single matrix-vector product
+            weighted = vectors.astype(np.float32) * scales[:, None] * weights
+            weighted /= np.maximum(np.linalg.norm(weighted, axis=1, keepdims=True), 1e-12)
+            matrix = {
+                "note_ids": np.array([row[0] for row in rows], dtype=object),
+                "class_names": np.array([row[1] for row in rows], dtype=object),
+                "note_types": np.array([row[2] for row in rows], dtype=object),
+                "chunks": np.array([row[5] for row in rows], dtype=np.int64),
+                "vectors": weighted,
+                "weights": weights
+            }
+            self._loaded = (version, matrix)
+            return matrix
+
+    def _scores(self, matrix: Dict, query_vectors: np.ndarray, class_name: Optional[str],
+                note_type: Optional[str], exclude: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Every chunk's best cosine score against the query vectors, and the filter mask."""
+        query = query_vectors * matrix["weights"]
+        query /= np.maximum(np.linalg.norm(query, axis=1, keepdims=True), 1e-12)
+        scores = (matrix["vectors"] @ query.T).max(axis=1)
+
+        mask = np.ones(len(scores), dtype=bool)
+        if class_name is not None:
+            mask &= matrix["class_names"] == class_name
+        if note_type is not None:
+            mask &= matrix["note_types"] == note_type
+        if exclude is not None:
+            mask &= matrix["note_ids"] != exclude
+        return scores, mask
+
+    def _rank(self, query_vectors: np.ndarray, limit: int, class_name: Optional[str],
+              note_type: Optional[str], exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Score chunks against query vectors and keep each note's best chunk."""
+        matrix = self._matrix()
+        if not len(matrix["note_ids"]):
+            return []
+        scores, mask = self._scores(matrix, query_vectors, class_name, note_type, exclude)
+
+        best: Dict[str, float] = {}
+        for index in np.argsort(-np.where(mask, scores, -np.inf)):
+            if not mask[index] or scores[index] <= 0:
+                break
+            note_id = matrix["note_ids"][index]
+            if note_id not in best:
+                best[note_id] = float(scores[index])
+                if len(best) >= limit:
+                    break
+        return list(best.items())
+
+    def search(self, query: str, limit: int = 10, class_name: Optional[str] = None,
+               note_type: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Return (note_id, cosine score) pairs, best first."""
+        if not query.strip():
+            return []
+        return self._rank(self.embedder.embed([query]), limit, class_name, note_type)
+
+    def search_chunks(self, query: str, limit: int = 8, class_name: Optional[str] = None,
+                      note_type: Optional[str] = None) -> List[Tuple[str, int, float]]:
+        """Return the best (note_id, chunk number, cosine score) triples, best first.
+
+        Chunk numbers index note_chunks(note, text): 0 is the analysis header.
+        """
+        matrix = self._matrix()
+        if limit <= 0 or not query.strip() or not len(matrix["note_ids"]):
+            return []
+        scores, mask = self._scores(matrix, self.embedder.embed([query]), class_name, note_type)
+        scores = np.where(mask, scores, -np.inf)
+        limit = min(limit, len(scores))
+        # Partial selection, then sort just the top rows
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (matrix["note_ids"][index], int(matrix["chunks"][index]), float(scores[index]))
+            for index in top if scores[index] > 0
+        ]
+
+    def related(self, note_id: str, limit: int = 5, min_score: float = 0.1) -> List[Tuple[str, float]]:
+        """Notes most similar to note_id, matched on any of its chunks."""
+        matrix = self._matrix()
+        own = matrix["vectors"][matrix["note_ids"] == note_id] if len(matrix["note_ids"]) else []
+        if not len(own):
+            return []
+        # Stored rows are already weighted; undo the weights so _rank doesn't apply them twice
+        ranked = self._rank(own / matrix["weights"], limit, None, None, exclude=note_id)
+        return [(other, score) for other, score in ranked if score >= min_score]
+
+    def rebuild(self, notes: Iterable[Dict], text_loader: Callable[[Dict], str], batch_size: int = 200) -> int:
+        """Drop and re-embed every note. Returns the number of notes indexed."""
+        with self._lock, self._conn:
+            self._writes += 1
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM df")
+
+        total, batch = 0, []
+        for note in notes:
+            batch.append((note, text_loader(note)))
+            if len(batch) >= batch_size:
+                self.index_notes(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self.index_notes(batch)
+            total += len(batch)
+        return total